@@ -0,0 +1,232 @@
+"""
+Answer cache for RAG queries.
+
+Answers are cached in memory per query, retrieval variant (mode and k) and
+document version, so re-ingesting a document makes its cached answers
+unreachable. Queries over all documents are scoped to a corpus version,
+read from Neo4j only when a lookup misses.
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from embedding_service import normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Scope of a cached answer: (doc_id or None for all documents, version)
+Scope = Tuple[Optional[str], str]
+
+
+class AnswerCache:
+    """
+    In-memory LRU cache of query answers.
+
+    Args:
+        driver_getter (Callable[[], Any]): Returns the Neo4j driver, used to
+        read document versions.
+        max_entries (int): Maximum number of cached answers.
+        similarity_threshold (float): Minimum cosine similarity between query
+        embeddings for a non-exact match. 0 disables similarity matching.
+        encoder (Optional[Callable[[str], np.ndarray]]): Query encoder used
+        for similarity matching.
+    """
+
+    def __init__(
+        self,
+        driver_getter: Callable[[], Any],
+        max_entries: int = 1000,
+        similarity_threshold: float = 0.0,
+        encoder: Optional[Callable[[str], np.ndarray]] = None,
+    ):
+        self._driver_getter = driver_getter
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold if encoder is not None else 0.0
+        self._encoder = encoder
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[Scope, str, str], Dict]" = OrderedDict()
+        # Last version seen per document (None: the whole corpus)
+        self._versions: Dict[Optional[str], str] = {}
+
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def _fetch_version(self, doc_id: Optional[str]) -> str:
+        with self._driver_getter().session() as session:
+            if doc_id is None:
+                record = session.run(
+                    """
+                    MATCH (d:Document)
+                    WITH d ORDER BY d.id
+                    RETURN collect(d.id + ':' + coalesce(d.version, '')) AS versions
+                    """
+                ).single()
+                versions = record["versions"] if record else []
+                return hashlib.sha256("\n".join(versions).encode("utf-8")).hexdigest()[:16]
+            record = session.run(
+                "MATCH (d:Document {id: $doc_id}) RETURN d.version AS version", doc_id=doc_id
+            ).single()
+        return (record and record["version"]) or ""
+
+    def _scope(self, doc_id: Optional[str]) -> Scope:
+        version = self._fetch_version(doc_id)
+        with self._lock:
+            known = self._versions.get(doc_id)
+            if known != version:
+                if known is not None:
+                    self._drop(doc_id)
+                self._versions[doc_id] = version
+        return doc_id, version
+
+    def _known_scope(self, doc_id: Optional[str]) -> Optional[Scope]:
+        with self._lock:
+            version = self._versions.get(doc_id)
+        return None if version is None else (doc_id, version)
+
+    def _embed(self, key: str) -> Optional[np.ndarray]:
+        if not self.similarity_threshold:
+            return None
+        embedding = np.asarray(self._encoder(key), dtype=np.float32)  # type: ignore
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def get(self, query: str, doc_id: Optional[str] = None, variant: str = "") -> Tuple[Optional[Dict], Scope]:
+        """
+        Look up the cached answer to a query.
+
+        Args:
+            query (str): User query.
+            doc_id (Optional[str]): Document the query is about, None for all.
+            variant (str): Retrieval settings the answer depends on.
+
+        Returns:
+            Tuple[Optional[Dict], Scope]: The cached answer (None on a miss)
+            and the scope it was looked up in, to pass on to put().
+        """
+        key = normalize_query(query)
+        if doc_id is None:
+            # Reading every document version costs a query per lookup: the
+            # corpus version seen last is trusted until a lookup misses
+            scope = self._known_scope(None)
+            if scope is not None:
+                answer = self._lookup(scope, variant, key)
+                if answer is not None:
+                    return answer, scope
+        scope = self._scope(doc_id)
+        answer = self._lookup(scope, variant, key)
+        if answer is None:
+            with self._lock:
+                self.misses += 1
+        return answer, scope
+
+    def _lookup(self, scope: Scope, variant: str, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get((scope, variant, key))
+            if entry is not None:
+                self._entries.move_to_end((scope, variant, key))
+                self.exact_hits += 1
+                return entry["answer"]
+            if not self.similarity_threshold:
+                return None
+
+        embedding = self._embed(key)
+        with self._lock:
+            best, best_score = None, self.similarity_threshold
+            for entry_key, entry in self._entries.items():
+                if entry_key[:2] != (scope, variant) or entry["embedding"] is None:
+                    continue
+                score = float(entry["embedding"] @ embedding)
+                if score >= best_score:
+                    best, best_score = entry_key, score
+            if best is None:
+                return None
+            self._entries.move_to_end(best)
+            self.similar_hits += 1
+            return self._entries[best]["answer"]
+
+    def put(self, query: str, scope: Scope, answer: Dict, variant: str = "") -> bool:
+        """
+        Cache the answer to a query under the scope returned by get(),
+        evicting the least recently used entries beyond the bound. The
+        answer is not stored when the scope's version changed since.
+
+        Returns:
+            bool: Whether the answer was stored.
+        """
+        key = normalize_query(query)
+        embedding = self._embed(key)
+        with self._lock:
+            if self._versions.get(scope[0]) != scope[1]:
+                self.stale_puts += 1
+                return False
+            self._entries[(scope, variant, key)] = {"answer": answer, "embedding": embedding}
+            self._entries.move_to_end((scope, variant, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def set_version(self, doc_id: str, version: str):
+        """
+        Record the current version of a document, dropping the answers cached
+        for other versions of it and for queries over all documents; the
+        corpus version is read again on the next lookup over all documents.
+        """
+        with self._lock:
+            if self._versions.get(doc_id) == version:
+                return
+            self._drop(doc_id)
+            self._versions[doc_id] = version
+
+    def invalidate(self, doc_id: str):
+        """
+        Forget a document, e.g. after it was deleted.
+        """
+        with self._lock:
+            self._versions.pop(doc_id, None)
+            self._drop(doc_id)
+
+    def _drop(self, doc_id: Optional[str]):
+        # Answers over all documents depend on every document
+        self._versions.pop(None, None)
+        stale = [key for key in self._entries if key[0][0] in (doc_id, None)]
+        for key in stale:
+            del self._entries[key]
+        self.invalidations += 1
+        logger.info(f"Answer cache: dropped {len(stale)} answers after a change to {doc_id}")
+
+    def clear(self):
+        """
+        Remove every cached answer.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def stats(self) -> Dict:
+        """
+        Hit/miss counters and current size of the cache.
+        """
+        hits = self.exact_hits + self.similar_hits
+        lookups = hits + self.misses
+        return {
+            "hits": hits,
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_puts": self.stale_puts,
+        }
@@ -0,0 +1,538 @@
+"""
+Benchmarks for the retrieval and ingestion hot paths.
+
+Run against a populated Neo4j instance, e.g.:
+
+    python bench.py enrichment --query "Can they terminate my account?" --k 10
+    python bench.py precision --precision int8 --rescore
+    python bench.py segmentation terms.pdf privacy.html
+    python bench.py chunking --fragments 100000
+    python bench.py embedding terms.pdf privacy.html --threads 4
+    python bench.py onnx terms.pdf --quantize
+    python bench.py load --url http://localhost:8000/query --concurrency 1 8 32 128
+    python bench.py triples --chunks 500 --triples-per-chunk 10
+    python bench.py retrieval --queries "binding arbitration" "class action waiver" --k 3
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+
+def _time_runs(fn: Callable[[], object], runs: int) -> List[float]:
+    timings = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return timings
+
+
+def _report(label: str, timings: List[float], round_trips: Optional[int] = None):
+    trips = f"round trips: {round_trips:<4} " if round_trips is not None else ""
+    print(
+        f"{label:<10} {trips}"
+        f"median: {statistics.median(timings) * 1000:8.2f} ms  "
+        f"p95: {sorted(timings)[int(0.95 * (len(timings) - 1))] * 1000:8.2f} ms"
+    )
+
+
+def bench_enrichment(args):
+    """
+    Compare the original retrieval path (a vector-only search, then one
+    triple query per retrieved chunk) with vector retrieval fetching the
+    triples inside the search query.
+    """
+    from langchain_setup import get_driver, get_embedding_service
+    from retrieve import get_similar_chunks
+
+    chunks = get_similar_chunks(args.query, k=args.k, doc_id=args.doc_id, mode="vector")
+    if not chunks:
+        print("No chunks found, ingest a document first.")
+        return
+
+    def per_chunk():
+        query_embedding = get_embedding_service().encode_query(args.query).tolist()
+        with get_driver().session() as session:
+            if args.doc_id is None:
+                found = session.run(
+                    """
+                    CALL db.index.vector.queryNodes('chunk_embeddings', $k, $query_embedding)
+                    YIELD node, score
+                    RETURN node.text AS text, node.id AS chunk_id, score
+                    ORDER BY score DESC
+                    """,
+                    k=args.k, query_embedding=query_embedding
+                ).data()
+            else:
+                found = session.run(
+                    """
+                    MATCH (:Document {id: $doc_id})-[:HAS_CHUNK]->(c:Chunk)
+                    WITH c, vector.similarity.cosine(c.embedding, $query_embedding) AS score
+                    RETURN c.text AS text, c.id AS chunk_id, score
+                    ORDER BY score DESC
+                    LIMIT $k
+                    """,
+                    doc_id=args.doc_id, k=args.k, query_embedding=query_embedding
+                ).data()
+            for chunk in found:
+                list(session.run(
+                    """
+                    MATCH (sub:Entity)-[rel]->(obj:Entity)-[:MENTIONED_IN]->(c:Chunk {id: $chunk_id})
+                    WHERE rel.chunk_id = $chunk_id
+                    RETURN sub.name AS subject, type(rel) AS relation, obj.name AS object
+                    """,
+                    chunk_id=chunk["chunk_id"]
+                ))
+
+    def fused():
+        get_similar_chunks(args.query, k=args.k, doc_id=args.doc_id, mode="vector")
+
+    print(f"Enrichment of {len(chunks)} retrieved chunks over {args.runs} runs")
+    _report("per-chunk", _time_runs(per_chunk, args.runs), 1 + len(chunks))
+    _report("fused", _time_runs(fused, args.runs), 1)
+
+
+def _stored_embeddings(limit: int):
+    import numpy as np
+    from langchain_setup import get_driver
+    from vector_store import decode_embedding
+
+    with get_driver().session() as session:
+        records = session.run(
+            """
+            MATCH (c:Chunk)
+            WHERE c.embedding IS NOT NULL OR c.embedding_q IS NOT NULL
+            RETURN c.embedding AS embedding, c.embedding_q AS embedding_q,
+                   c.embedding_dtype AS embedding_dtype, c.embedding_scale AS embedding_scale
+            LIMIT $limit
+            """,
+            limit=limit,
+        ).data()
+    return np.array([
+        r["embedding"] if r["embedding"] is not None
+        else decode_embedding(r["embedding_q"], r["embedding_dtype"], r["embedding_scale"])
+        for r in records
+    ], dtype=np.float32)
+
+
+def bench_precision(args):
+    """
+    Recall@k and bytes per vector of a reduced precision LocalVectorStore
+    against exact float32 search. Exits non-zero when the recall drop exceeds
+    the tolerance, so it can gate a change of EMBEDDING_PRECISION.
+    """
+    import numpy as np
+    from langchain_setup import EMBEDDING_RECALL_TOLERANCE
+    from vector_store import LocalVectorStore
+
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(args.synthetic, args.dim)).astype(np.float32)
+    else:
+        embeddings = _stored_embeddings(args.limit)
+    if len(embeddings) <= args.queries:
+        print("Not enough embeddings, ingest documents or use --synthetic.")
+        return
+
+    # Held-out vectors, slightly perturbed, stand in for queries
+    rng = np.random.default_rng(1)
+    queries = embeddings[:args.queries] + 0.1 * rng.normal(size=(args.queries, embeddings.shape[1])) * embeddings.std()
+    corpus = embeddings[args.queries:]
+    chunk_ids = [str(i) for i in range(len(corpus))]
+
+    def build(precision, rescore):
+        store = LocalVectorStore(
+            tempfile.mkdtemp(prefix="bench-vectors-"),
+            hnsw_threshold=len(corpus) + 1,
+            precision=precision,
+            rescore=rescore,
+            rescore_factor=args.rescore_factor,
+        )
+        store.add(chunk_ids, corpus)
+        return store
+
+    exact = build("float32", False)
+    candidate = build(args.precision, args.rescore)
+    truth = [{c for c, _ in exact.search(q, args.k)} for q in queries]
+
+    recalls = []
+    timings = []
+    for query, expected in zip(queries, truth):
+        t0 = time.perf_counter()
+        found = {c for c, _ in candidate.search(query, args.k)}
+        timings.append(time.perf_counter() - t0)
+        recalls.append(len(found & expected) / len(expected))
+    recall = statistics.mean(recalls)
+    tolerance = args.tolerance if args.tolerance is not None else EMBEDDING_RECALL_TOLERANCE
+
+    label = args.precision + ("+rescore" if args.rescore else "")
+    print(f"{len(corpus)} vectors of dim {corpus.shape[1]}, {len(queries)} queries, k={args.k}")
+    print(
+        f"float32 bytes/vector: {exact.bytes_per_vector():<6} "
+        f"{label} bytes/vector: {candidate.bytes_per_vector():<6} "
+        f"ratio: {exact.bytes_per_vector() / candidate.bytes_per_vector():.1f}x"
+    )
+    _report(label, timings)
+    print(f"recall@{args.k}: {recall:.4f} (tolerance {tolerance})")
+    if recall < 1.0 - tolerance:
+        print("Recall below tolerance")
+        sys.exit(1)
+
+
+def bench_segmentation(args):
+    """
+    Sentence segmentation throughput (chars/sec) of each engine against the
+    full spaCy pipeline, and how many of the full pipeline's chunks each
+    engine reproduces exactly.
+    """
+    import text_processor as tp
+    from langchain_setup import get_nlp, load_segmenter
+
+    texts = [tp.load_text(path) for path in args.files]
+    total_chars = sum(len(text) for text in texts)
+
+    def chunk_sets(sentence_lists):
+        return [
+            set(tp._assemble_chunks([s.strip() for s in sents], args.max_chunk_size, 1))
+            for sents in sentence_lists
+        ]
+
+    def run(nlp, n_process, disable=()):
+        docs = nlp.pipe(texts, batch_size=args.batch_size, n_process=n_process, disable=disable)
+        return [[sent.text for sent in doc.sents] for doc in docs]
+
+    reference = chunk_sets(run(get_nlp(), 1))
+    print(f"{len(texts)} documents, {total_chars} chars, {args.runs} runs")
+
+    pipelines = [("full", (get_nlp(), []), 1)] + [
+        (engine, load_segmenter(engine), args.processes) for engine in args.engines
+    ]
+    for label, (nlp, disable), n_process in pipelines:
+        sentences = []
+        timings = _time_runs(lambda: sentences.append(run(nlp, n_process, disable)), args.runs)
+        chunks = chunk_sets(sentences[-1])
+        same = sum(len(ref & got) for ref, got in zip(reference, chunks))
+        print(
+            f"{label:<12} {total_chars / statistics.median(timings):>12,.0f} chars/sec  "
+            f"identical chunks: {same}/{sum(len(ref) for ref in reference)}"
+        )
+
+
+def bench_chunking(args):
+    """
+    Time character-mode chunk assembly against the original quadratic
+    implementation (test_text_processor.reference_chunks) on a
+    fragment-heavy document. Their parity is checked by the same test module.
+    """
+    import text_processor as tp
+    from test_text_processor import reference_chunks
+
+    # List-heavy sections: many short fragments per chunk
+    fragments = [f"({i % 26 + 1})" for i in range(args.fragments)]
+    print(f"{len(fragments)} short fragments, max_chunk_size={args.max_chunk_size}")
+    _report("reference", _time_runs(lambda: reference_chunks(fragments, args.max_chunk_size, 1), args.runs))
+    _report("linear", _time_runs(lambda: list(tp._assemble_chunks(fragments, args.max_chunk_size, 1)), args.runs))
+
+
+def bench_embedding(args):
+    """
+    Chunk embedding throughput (chunks/sec): one default encode() call per
+    document against length-sorted, fixed-size batches across documents.
+    """
+    import text_processor as tp
+    from langchain_setup import get_embedding_model
+
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+    documents = [
+        [item["chunk"] for item in tp.chunk_text_stream(tp.iter_text(path))] for path in args.files
+    ] * args.repeat
+    chunks = [chunk for doc in documents for chunk in doc]
+    model = get_embedding_model()
+    model.encode(chunks[:8], convert_to_numpy=True)  # warm-up
+
+    def per_document():
+        for doc in documents:
+            model.encode(doc, convert_to_numpy=True, show_progress_bar=False)
+
+    def cross_document():
+        tp.embed_chunks(chunks, batch_size=args.batch_size)
+
+    print(f"{len(documents)} documents, {len(chunks)} chunks, batch size {args.batch_size}, {args.runs} runs")
+    for label, fn in (("per-doc", per_document), ("batched", cross_document)):
+        timings = _time_runs(fn, args.runs)
+        _report(label, timings)
+        print(f"{'':<10} {len(chunks) / statistics.median(timings):,.1f} chunks/sec")
+
+
+def bench_onnx(args):
+    """
+    Parity and speed of the ONNX Runtime embedder against the PyTorch model:
+    cosine similarity between the two embeddings of every chunk, and the
+    encode speedup. Exits non-zero when any cosine is below --min-cosine.
+    """
+    import numpy as np
+    import text_processor as tp
+    from langchain_setup import load_onnx_embedder, load_torch_embedder
+
+    chunks = [item["chunk"] for path in args.files for item in tp.chunk_text_stream(tp.iter_text(path))]
+    torch_model = load_torch_embedder()
+    onnx_model = load_onnx_embedder(quantize=args.quantize)
+
+    def encode(model):
+        return model.encode(chunks, batch_size=args.batch_size, convert_to_numpy=True, show_progress_bar=False)
+
+    reference, candidate = encode(torch_model), encode(onnx_model)
+    cosine = (reference * candidate).sum(axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    )
+    label = "onnx-int8" if args.quantize else "onnx"
+    print(f"{len(chunks)} chunks, batch size {args.batch_size}, {args.runs} runs")
+    torch_timings = _time_runs(lambda: encode(torch_model), args.runs)
+    onnx_timings = _time_runs(lambda: encode(onnx_model), args.runs)
+    _report("torch", torch_timings)
+    _report(label, onnx_timings)
+    print(f"speedup: {statistics.median(torch_timings) / statistics.median(onnx_timings):.2f}x")
+    print(f"cosine vs torch: min {cosine.min():.5f} mean {cosine.mean():.5f} (threshold {args.min_cosine})")
+    if cosine.min() < args.min_cosine:
+        print("Cosine similarity below threshold")
+        sys.exit(1)
+
+
+def bench_load(args):
+    """
+    Load test of a running API: throughput and latency of /query at
+    increasing numbers of concurrent clients.
+    """
+    import asyncio
+    import httpx
+
+    async def level(concurrency: int):
+        counter = iter(range(args.requests))
+        latencies: List[float] = []
+        errors = 0
+
+        async def client(http):
+            nonlocal errors
+            for i in counter:
+                # A distinct query per request bypasses the answer cache
+                query = f"{args.query} ({i})" if args.vary else args.query
+                t0 = time.perf_counter()
+                try:
+                    response = await http.post(args.url, json={"query": query, "doc_id": args.doc_id})
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - t0)
+                except httpx.HTTPError:
+                    errors += 1
+
+        t0 = time.perf_counter()
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as http:
+            await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+        if latencies:
+            _report(f"c={concurrency}", latencies)
+        print(f"{'':<10} {len(latencies) / elapsed:8.2f} req/s  errors: {errors}")
+
+    print(f"{args.requests} requests per level against {args.url}")
+    for concurrency in args.concurrency:
+        asyncio.run(level(concurrency))
+
+
+def _reference_write_triples(tx, batch):
+    # The original writer: one MERGE statement per triple
+    from ingest import sanitize_relation_name
+    for chunk_id, triples in batch:
+        for s, r, o in triples:
+            tx.run(
+                f"""
+                MATCH (c:Chunk {{id: $chunk_id}})
+                WITH c, coalesce(c.doc_id, '') AS doc_id
+                MERGE (sub:Entity {{doc_id: doc_id, name: $subj}})
+                MERGE (obj:Entity {{doc_id: doc_id, name: $obj}})
+                MERGE (sub)-[:`{sanitize_relation_name(r)}` {{chunk_id: $chunk_id}}]->(obj)
+                MERGE (sub)-[:MENTIONED_IN]->(c)
+                MERGE (obj)-[:MENTIONED_IN]->(c)
+                """,
+                subj=s, obj=o, chunk_id=chunk_id
+            )
+
+
+def bench_triples(args):
+    """
+    Triple write throughput of the per-triple writer against the writer
+    grouping triples by relation type into UNWIND statements, on synthetic
+    documents written to (and removed from) the configured Neo4j.
+    """
+    import random
+    from ingest import TRIPLE_WRITE_BATCH_SIZE, _merge_triples
+    from langchain_setup import get_driver
+    from schema import ensure_schema
+
+    ensure_schema(get_driver())
+    rng = random.Random(0)
+    relations = [f"relation {i}" for i in range(args.relations)]
+
+    def document(doc_id):
+        chunk_ids = [f"{doc_id}:{i}" for i in range(args.chunks)]
+        with get_driver().session() as session:
+            session.run(
+                """
+                UNWIND $ids AS id
+                CREATE (:Chunk {id: id, doc_id: $doc_id, text: ''})
+                """,
+                ids=chunk_ids, doc_id=doc_id,
+            ).consume()
+        return [
+            (chunk_id, [
+                (f"entity {rng.randrange(args.entities)}", rng.choice(relations),
+                 f"entity {rng.randrange(args.entities)}")
+                for _ in range(args.triples_per_chunk)
+            ])
+            for chunk_id in chunk_ids
+        ]
+
+    def remove(doc_id):
+        with get_driver().session() as session:
+            session.run("MATCH (c:Chunk {doc_id: $doc_id}) DETACH DELETE c", doc_id=doc_id).consume()
+            session.run("MATCH (e:Entity {doc_id: $doc_id}) DETACH DELETE e", doc_id=doc_id).consume()
+
+    total = args.chunks * args.triples_per_chunk
+    print(f"{total} triples over {args.chunks} chunks, {args.relations} relation types, "
+          f"{TRIPLE_WRITE_BATCH_SIZE} chunks per transaction")
+    for label, writer in (("per-triple", _reference_write_triples), ("grouped", _merge_triples)):
+        doc_id = f"__bench_triples_{label}"
+        remove(doc_id)
+        batches = document(doc_id)
+        t0 = time.perf_counter()
+        with get_driver().session() as session:
+            for start in range(0, len(batches), TRIPLE_WRITE_BATCH_SIZE):
+                session.execute_write(writer, batches[start:start + TRIPLE_WRITE_BATCH_SIZE])
+        elapsed = time.perf_counter() - t0
+        print(f"{label:<10} {elapsed:8.2f} s  {total / elapsed:10,.0f} triples/sec")
+        remove(doc_id)
+
+
+def bench_retrieval(args):
+    """
+    Compare the retrieval modes on phrase queries: share of the top k chunks
+    containing the exact phrase, prompt tokens of the retrieved text and latency.
+    """
+    from retrieve import RETRIEVAL_MODES, get_similar_chunks
+    from text_processor import estimate_tokens
+
+    print(f"{len(args.queries)} phrase queries, k = {args.k}, {args.runs} runs")
+    for mode in RETRIEVAL_MODES:
+        matching, retrieved, tokens = 0, 0, 0
+        for query in args.queries:
+            chunks = get_similar_chunks(query, k=args.k, doc_id=args.doc_id, mode=mode)
+            retrieved += len(chunks)
+            matching += sum(query.lower() in chunk["text"].lower() for chunk in chunks)
+            tokens += sum(estimate_tokens(chunk["text"]) for chunk in chunks)
+        timings = _time_runs(
+            lambda: [get_similar_chunks(q, k=args.k, doc_id=args.doc_id, mode=mode) for q in args.queries],
+            args.runs,
+        )
+        print(
+            f"{mode:<10} phrase precision: {matching / retrieved if retrieved else 0.0:.3f}  "
+            f"prompt tokens/query: {tokens / len(args.queries):7.1f}"
+        )
+        _report(mode, [t / len(args.queries) for t in timings])
+
+
+BENCHMARKS: Dict[str, Callable] = {
+    "enrichment": bench_enrichment,
+    "precision": bench_precision,
+    "segmentation": bench_segmentation,
+    "chunking": bench_chunking,
+    "embedding": bench_embedding,
+    "onnx": bench_onnx,
+    "load": bench_load,
+    "triples": bench_triples,
+    "retrieval": bench_retrieval,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+
+    p = sub.add_parser("enrichment", help="Triple enrichment round trips and latency")
+    p.add_argument("--query", default="Can the company terminate my account without notice?")
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--doc-id", default=None)
+    p.add_argument("--runs", type=int, default=20)
+
+    p = sub.add_parser("precision", help="Recall and size of reduced precision embeddings")
+    p.add_argument("--precision", choices=["float32", "float16", "int8"], default="int8")
+    p.add_argument("--rescore", action="store_true")
+    p.add_argument("--rescore-factor", type=int, default=4)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--limit", type=int, default=100000, help="Chunk embeddings read from Neo4j")
+    p.add_argument("--synthetic", type=int, default=0, help="Use N random vectors instead of Neo4j")
+    p.add_argument("--dim", type=int, default=512)
+    p.add_argument("--tolerance", type=float, default=None)
+
+    p = sub.add_parser("segmentation", help="Sentence segmentation throughput per engine")
+    p.add_argument("files", nargs="+", help="Documents (pdf, html or txt) to segment")
+    p.add_argument("--engines", nargs="+", choices=["parser", "senter", "sentencizer"],
+                   default=["parser", "senter", "sentencizer"])
+    p.add_argument("--batch-size", type=int, default=16)
+    p.add_argument("--processes", type=int, default=1)
+    p.add_argument("--max-chunk-size", type=int, default=500)
+    p.add_argument("--runs", type=int, default=3)
+
+    p = sub.add_parser("chunking", help="Chunk assembly speed against the original loop")
+    p.add_argument("--fragments", type=int, default=50000)
+    p.add_argument("--max-chunk-size", type=int, default=4000)
+    p.add_argument("--runs", type=int, default=5)
+
+    p = sub.add_parser("embedding", help="Chunk embedding throughput, per document vs batched")
+    p.add_argument("files", nargs="+", help="Documents (pdf, html or txt) whose chunks are embedded")
+    p.add_argument("--repeat", type=int, default=1, help="Repeat the documents to grow the corpus")
+    p.add_argument("--batch-size", type=int, default=64)
+    p.add_argument("--threads", type=int, default=0)
+    p.add_argument("--runs", type=int, default=3)
+
+    p = sub.add_parser("onnx", help="ONNX Runtime embedder parity and speedup against PyTorch")
+    p.add_argument("files", nargs="+", help="Documents (pdf, html or txt) whose chunks are embedded")
+    p.add_argument("--quantize", action="store_true", help="Use int8 dynamically quantized weights")
+    p.add_argument("--min-cosine", type=float, default=0.99)
+    p.add_argument("--batch-size", type=int, default=64)
+    p.add_argument("--runs", type=int, default=3)
+
+    p = sub.add_parser("load", help="Concurrent /query load test against a running API")
+    p.add_argument("--url", default="http://localhost:8000/query")
+    p.add_argument("--query", default="Can the company terminate my account without notice?")
+    p.add_argument("--doc-id", default=None)
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    p.add_argument("--requests", type=int, default=256)
+    p.add_argument("--vary", action="store_true", help="Make every query distinct")
+    p.add_argument("--timeout", type=float, default=300)
+
+    p = sub.add_parser("triples", help="Triple write throughput, per-triple vs grouped UNWIND")
+    p.add_argument("--chunks", type=int, default=500)
+    p.add_argument("--triples-per-chunk", type=int, default=10)
+    p.add_argument("--relations", type=int, default=30)
+    p.add_argument("--entities", type=int, default=2000)
+
+    p = sub.add_parser("retrieval", help="Phrase precision and latency per retrieval mode")
+    p.add_argument("--queries", nargs="+", default=[
+        "binding arbitration", "class action waiver", "terminate your account", "personal data",
+    ])
+    p.add_argument("--k", type=int, default=3)
+    p.add_argument("--doc-id", default=None)
+    p.add_argument("--runs", type=int, default=5)
+
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
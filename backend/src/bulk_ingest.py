@@ -0,0 +1,379 @@
+"""
+Bulk corpus ingestion.
+
+Walks a directory of ToS / privacy policy files and ingests every document:
+files are parsed and chunked in a process pool, new chunks of all documents
+are embedded together in fixed-size batches, and each document is written to
+the graph as soon as its embeddings are ready. A file that fails is recorded
+in the report and the run continues, including a file that crashes its
+parsing worker.
+
+Usage:
+
+    python bulk_ingest.py ../../Dataset --workers 4
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional
+
+from ingest import (
+    CHUNK_MAX_CHARS,
+    CHUNK_MAX_TOKENS,
+    apply_chunks,
+    document_id_from_path,
+    ensure_document,
+    fetch_chunk_state,
+    fingerprint_chunk,
+    make_chunk_id,
+)
+from langchain_setup import get_driver
+from schema import ensure_schema
+import text_processor as tp
+
+# Worker processes parsing and chunking files
+BULK_PARSE_WORKERS = int(os.getenv("BULK_PARSE_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# Chunks embedded per forward pass, across documents
+BULK_EMBED_BATCH_SIZE = int(os.getenv("BULK_EMBED_BATCH_SIZE", "256"))
+# Directory the bulk ingestion API is allowed to read from
+BULK_INGEST_ROOT = os.getenv("BULK_INGEST_ROOT", "./corpus")
+
+SUPPORTED_EXTENSIONS = (".pdf", ".html", ".txt")
+
+# Stages timed in the report, in pipeline order
+BULK_STAGES = ("parse", "embed", "store", "extract", "cleanup")
+
+logger = logging.getLogger(__name__)
+
+
+def find_documents(root: str) -> List[str]:
+    """
+    List the supported files under a directory, recursively and in a stable order.
+    """
+    paths = []
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                paths.append(os.path.join(directory, name))
+    return sorted(paths)
+
+
+def parse_document(path: str) -> Dict:
+    """
+    Load and chunk one file. Runs in a worker process, so errors are
+    returned rather than raised.
+    """
+    t0 = time.perf_counter()
+    try:
+        chunks = [
+            item["chunk"]
+            # Parallelism is across documents already
+            for item in tp.chunk_text_stream(
+                tp.iter_text(path), max_chunk_size=CHUNK_MAX_CHARS, max_tokens=CHUNK_MAX_TOKENS or None, n_process=1
+            )
+        ]
+    except Exception as e:
+        return {"path": path, "error": f"{type(e).__name__}: {e}", "seconds": time.perf_counter() - t0}
+    return {"path": path, "chunks": chunks, "seconds": time.perf_counter() - t0}
+
+
+class _Document:
+    """
+    A parsed document waiting for its new chunks to be embedded and stored.
+
+    Args:
+        path (str): Path of the file.
+        doc_id (str): Document ID.
+        chunks (List[str]): Chunk texts, in document order.
+        stored (Dict[str, bool]): Snapshot of the stored chunks (see
+        fetch_chunk_state) deciding what to embed ahead of time; apply_chunks
+        reads the state again under the document lock before anything is written.
+    """
+
+    def __init__(self, path: str, doc_id: str, chunks: List[str], stored: Dict[str, bool]):
+        self.path = path
+        self.doc_id = doc_id
+        # Identical chunks within a document collapse to one node
+        self.chunk_texts: Dict[str, str] = {}
+        for chunk in chunks:
+            self.chunk_texts.setdefault(make_chunk_id(doc_id, fingerprint_chunk(chunk)), chunk)
+        self.new_ids = [cid for cid in self.chunk_texts if cid not in stored]
+        self.unembedded = len(self.new_ids)
+        self.embedded: Dict[str, object] = {}
+
+
+class BulkIngestor:
+    """
+    Ingests many documents, batching embeddings across them.
+
+    Args:
+        root (str): Corpus root; document IDs derive from paths relative to it.
+        workers (int): Worker processes parsing and chunking files.
+        embed_batch_size (int): Number of new chunks embedded per batch.
+        extract (bool): Extract and store triples for each document.
+        on_progress (Optional[Callable[[int, int], None]]): Called with the
+        number of files done and the total.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        workers: int = BULK_PARSE_WORKERS,
+        embed_batch_size: int = BULK_EMBED_BATCH_SIZE,
+        extract: bool = True,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+    ):
+        self.root = root
+        self.workers = max(1, workers)
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.extract = extract
+        self.on_progress = on_progress
+        self.timings: Dict[str, float] = {stage: 0.0 for stage in BULK_STAGES}
+        self.succeeded: List[Dict] = []
+        self.failed: List[Dict] = []
+        self._queue: List[tuple] = []  # (document, chunk ID) awaiting embedding
+        self._total = 0
+
+    def _timed(self, stage: str, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.timings[stage] += time.perf_counter() - t0
+
+    def _fail(self, path: str, stage: str, error: str):
+        logger.error(f"Bulk ingestion of {path} failed during {stage}: {error}")
+        self.failed.append({"path": path, "stage": stage, "error": error})
+        self._report_progress()
+
+    def _report_progress(self):
+        if self.on_progress:
+            self.on_progress(len(self.succeeded) + len(self.failed), self._total)
+
+    def _accept(self, parsed: Dict):
+        path = parsed["path"]
+        self.timings["parse"] += parsed["seconds"]
+        if "error" in parsed:
+            self._fail(path, "parse", parsed["error"])
+            return
+        try:
+            doc_id = document_id_from_path(path, self.root)
+            ensure_document(doc_id, os.path.basename(path))
+            doc = _Document(path, doc_id, parsed["chunks"], fetch_chunk_state(doc_id))
+        except Exception as e:
+            self._fail(path, "store", str(e))
+            return
+        if not doc.new_ids:
+            self._finish(doc)
+            return
+        self._queue.extend((doc, cid) for cid in doc.new_ids)
+        while len(self._queue) >= self.embed_batch_size:
+            self._embed_batch()
+
+    def _embed_batch(self):
+        batch, self._queue = self._queue[:self.embed_batch_size], self._queue[self.embed_batch_size:]
+        if not batch:
+            return
+        try:
+            embeddings = self._timed("embed", tp.embed_chunks, [doc.chunk_texts[cid] for doc, cid in batch])
+        except Exception as e:
+            for doc in {id(doc): doc for doc, _ in batch}.values():
+                self._drop(doc, "embed", str(e))
+            return
+
+        ready = {}
+        for (doc, cid), embedding in zip(batch, embeddings):
+            doc.embedded[cid] = embedding
+            doc.unembedded -= 1
+            if doc.unembedded == 0:
+                ready[id(doc)] = doc
+        for doc in ready.values():
+            self._finish(doc)
+
+    def _drop(self, doc: _Document, stage: str, error: str):
+        # Forget the document's other queued chunks, it is not retried within the run
+        self._queue = [(d, cid) for d, cid in self._queue if d is not doc]
+        self._fail(doc.path, stage, error)
+
+    def _finish(self, doc: _Document):
+        current = {"stage": "store", "started": time.perf_counter()}
+
+        def close_stage(now: float):
+            self.timings[current["stage"]] += now - current["started"]
+
+        def progress(stage: str, fraction: float = 0.0):
+            if stage != current["stage"]:
+                now = time.perf_counter()
+                close_stage(now)
+                current["stage"], current["started"] = stage, now
+
+        try:
+            applied = apply_chunks(doc.doc_id, doc.chunk_texts, doc.embedded, self.extract, progress)
+        except Exception as e:
+            self._fail(doc.path, current["stage"], str(e))
+            return
+        finally:
+            close_stage(time.perf_counter())
+        doc.embedded.clear()
+        self.succeeded.append(
+            {
+                "path": doc.path,
+                "doc_id": doc.doc_id,
+                "chunks": applied["chunks"],
+                "new": applied["new"],
+                "merged_entities": applied["merged_entities"],
+            }
+        )
+        self._report_progress()
+
+    def _parse_all(self, paths, context) -> List[str]:
+        """
+        Parse files in a process pool and accept them as they complete.
+
+        Returns:
+            List[str]: The files in flight when a worker died and broke the
+            pool, empty when every file was parsed. The files not submitted yet
+            are left in `paths`.
+        """
+        in_flight: Dict[Future, str] = {}
+        crashed: List[str] = []
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+
+            def submit_next():
+                path = next(paths, None)
+                if path is None:
+                    return
+                try:
+                    in_flight[pool.submit(parse_document, path)] = path
+                except BrokenProcessPool:
+                    crashed.append(path)
+
+            # Bound the parsed documents waiting in memory
+            for _ in range(4 * self.workers):
+                submit_next()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = in_flight.pop(future)
+                    try:
+                        parsed = future.result()
+                    except BrokenProcessPool:
+                        crashed.append(path)
+                        continue
+                    except Exception as e:
+                        parsed = {"path": path, "error": f"{type(e).__name__}: {e}", "seconds": 0.0}
+                    if not crashed:
+                        submit_next()
+                    self._accept(parsed)
+        return crashed
+
+    def _parse_isolated(self, path: str, context) -> Dict:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            try:
+                return pool.submit(parse_document, path).result()
+            except Exception as e:
+                return {"path": path, "error": f"{type(e).__name__}: {e}", "seconds": 0.0}
+
+    def run(self, paths: List[str]) -> Dict:
+        """
+        Ingest the given files.
+
+        Returns:
+            Dict: Counts, docs/sec, per-stage timings (seconds, summed over
+            workers for parsing) and the per-file failures.
+        """
+        self._total = len(paths)
+        t0 = time.perf_counter()
+        # spawn: the parent may hold driver connections and threads that must not be forked
+        context = multiprocessing.get_context("spawn")
+        remaining = iter(paths)
+        suspects: List[str] = []
+        while True:
+            crashed = self._parse_all(remaining, context)
+            if not crashed:
+                break
+            suspects.extend(crashed)
+        # One of the files in flight when a worker died crashed it; parse each
+        # of them alone so only that file fails
+        for path in suspects:
+            self._accept(self._parse_isolated(path, context))
+        while self._queue:
+            self._embed_batch()
+
+        elapsed = time.perf_counter() - t0
+        report = {
+            "documents": len(paths),
+            "succeeded": len(self.succeeded),
+            "failed": len(self.failed),
+            "chunks": sum(doc["chunks"] for doc in self.succeeded),
+            "new_chunks": sum(doc["new"] for doc in self.succeeded),
+            "merged_entities": sum(doc["merged_entities"] for doc in self.succeeded),
+            "seconds": round(elapsed, 3),
+            "docs_per_sec": round(len(paths) / elapsed, 3) if elapsed else 0.0,
+            "timings": {stage: round(seconds, 3) for stage, seconds in self.timings.items()},
+            "failures": self.failed,
+        }
+        logger.info(
+            f"Bulk ingestion of {len(paths)} files: {report['succeeded']} succeeded, "
+            f"{report['failed']} failed, {report['docs_per_sec']} docs/sec"
+        )
+        return report
+
+
+def bulk_ingest(
+    root: str,
+    workers: int = BULK_PARSE_WORKERS,
+    embed_batch_size: int = BULK_EMBED_BATCH_SIZE,
+    extract: bool = True,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    corpus_root: Optional[str] = None,
+) -> Dict:
+    """
+    Ingest every supported file under a directory.
+
+    Args:
+        root (str): Directory to walk.
+        workers (int): Worker processes parsing and chunking files.
+        embed_batch_size (int): Number of new chunks embedded per batch.
+        extract (bool): Extract and store triples for each document.
+        on_progress (Optional[Callable[[int, int], None]]): Called with the
+        number of files done and the total.
+        corpus_root (Optional[str]): Directory document IDs are derived
+        relative to, when `root` is a subdirectory of the corpus. Defaults to `root`.
+
+    Returns:
+        Dict: The run report (see BulkIngestor.run).
+    """
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f"Directory not found: {root}")
+    paths = find_documents(root)
+    logger.info(f"Bulk ingestion of {len(paths)} files under {root}")
+    ingestor = BulkIngestor(corpus_root or root, workers, embed_batch_size, extract, on_progress)
+    return ingestor.run(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="Directory of pdf, html and txt files")
+    parser.add_argument("--workers", type=int, default=BULK_PARSE_WORKERS)
+    parser.add_argument("--embed-batch-size", type=int, default=BULK_EMBED_BATCH_SIZE)
+    parser.add_argument("--no-extract", action="store_true", help="Skip triple extraction")
+    args = parser.parse_args()
+
+    def progress(done: int, total: int):
+        print(f"\r{done}/{total} files", end="", flush=True)
+
+    ensure_schema(get_driver())
+    report = bulk_ingest(args.root, args.workers, args.embed_batch_size, not args.no_extract, progress)
+    print()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Query embedding service.
+
+Sits in front of the sentence embedding model for query-time encoding:
+- an LRU cache of normalized query embeddings, so repeated questions skip
+  the forward pass entirely;
+- a micro-batcher that groups encode requests arriving within a few
+  milliseconds of each other into one batched forward pass.
+"""
+
+import asyncio
+import logging
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normalize a query for caching. Legal-BERT is uncased, so lowercasing
+    does not change the embedding.
+    """
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class EmbeddingService:
+    """
+    Cached, micro-batched query encoder.
+
+    Args:
+        model_getter (Callable[[], Any]): Returns the model exposing `encode`.
+        cache_size (int): Maximum number of cached query embeddings.
+        batch_window_ms (float): How long the batcher waits for more requests
+        after the first one of a batch arrives.
+        max_batch_size (int): Maximum number of queries per forward pass.
+    """
+
+    def __init__(
+        self,
+        model_getter: Callable[[], Any],
+        cache_size: int = 2048,
+        batch_window_ms: float = 5.0,
+        max_batch_size: int = 32,
+    ):
+        self._model_getter = model_getter
+        self.cache_size = cache_size
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._requests: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._worker: threading.Thread = None  # type: ignore
+        self._worker_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.batched_queries = 0
+        self.max_observed_batch = 0
+
+    def _cache_get(self, key: str):
+        with self._cache_lock:
+            embedding = self._cache.get(key)
+            if embedding is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return embedding
+
+    def _cache_put(self, key: str, embedding: np.ndarray):
+        with self._cache_lock:
+            self._cache[key] = embedding
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def _collect_batch(self) -> List[Tuple[str, Future]]:
+        batch = [self._requests.get()]
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # Identical queries in one batch share a single row of the forward pass
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                embeddings = self._model_getter().encode(
+                    texts, convert_to_numpy=True, batch_size=len(texts)
+                )
+            except Exception as e:
+                logger.error(f"Batched query encoding failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            by_text: Dict[str, np.ndarray] = {}
+            for text, embedding in zip(texts, embeddings):
+                embedding = np.asarray(embedding, dtype=np.float32)
+                embedding.setflags(write=False)
+                by_text[text] = embedding
+                self._cache_put(text, embedding)
+
+            self.batches += 1
+            self.batched_queries += len(batch)
+            self.max_observed_batch = max(self.max_observed_batch, len(batch))
+            for text, future in batch:
+                future.set_result(by_text[text])
+
+    def encode_query(self, text: str) -> np.ndarray:
+        """
+        Encode a single query, using the cache when possible.
+
+        Returns:
+            np.ndarray: The (read-only) float32 query embedding.
+        """
+        key = normalize_query(text)
+        embedding = self._cache_get(key)
+        if embedding is not None:
+            return embedding
+
+        self._ensure_worker()
+        future: Future = Future()
+        self._requests.put((key, future))
+        return future.result()
+
+    async def aencode_query(self, text: str) -> np.ndarray:
+        """
+        Async variant of encode_query: waits for the batcher without blocking
+        the event loop.
+        """
+        key = normalize_query(text)
+        embedding = self._cache_get(key)
+        if embedding is not None:
+            return embedding
+
+        self._ensure_worker()
+        future: Future = Future()
+        self._requests.put((key, future))
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict:
+        """
+        Cache hit rate and batching metrics.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._cache),
+            "batches": self.batches,
+            "avg_batch_size": self.batched_queries / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_observed_batch,
+        }
@@ -0,0 +1,287 @@
+"""
+Entity canonicalization.
+
+Triple extraction produces several surface forms for the same entity
+("User", "Users", "the user", "you"). Before triples are written, every
+entity name is mapped to a canonical name, in three steps:
+
+1. normalization: lowercasing, dropping leading determiners and possessives,
+   and lemmatizing with the spaCy pipeline ("Users" -> "user");
+2. an alias table mapping normalized forms to a canonical one
+   ("you" -> "User", "we" -> "Company");
+3. optionally, clustering by embedding: a normalized form not seen before
+   joins the most similar known entity of the document when their name
+   embeddings are close enough, otherwise it starts a new entity. Off by
+   default: the chunk embedding model is not trained for short-phrase
+   similarity, so a threshold has to be measured on real entity names first.
+
+The per-document index is seeded with the entity names already stored for
+the document, so re-ingestion reuses the existing nodes. Their embeddings
+are only computed when a form actually needs clustering, and are cached
+across ingestions.
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Normalized form -> canonical name; extended with ENTITY_ALIASES_PATH.
+# Only forms that always denote the same party belong here: "service
+# providers", for instance, are usually third-party processors, and merging
+# them into Company would erase who data is shared with. "customer" (not the
+# end user in B2B terms) and "us" (also "US" once lowercased) are left to
+# ENTITY_ALIASES_PATH for corpora where they are safe.
+DEFAULT_ALIASES: Dict[str, str] = {
+    "you": "User",
+    "yourself": "User",
+    "user": "User",
+    "end user": "User",
+    "subscriber": "User",
+    "account holder": "User",
+    "we": "Company",
+    "company": "Company",
+    "third party": "Third Party",
+    "third-party": "Third Party",
+    "personal datum": "Personal Data",
+    "personal data": "Personal Data",
+    "personal information": "Personal Data",
+}
+
+# Leading words dropped before lemmatization
+_LEADING_WORDS = {"the", "a", "an", "our", "your", "their", "its", "his", "her", "any", "all", "such"}
+
+Triple = Tuple[str, str, str]
+
+
+def load_aliases(path: Optional[str]) -> Dict[str, str]:
+    """
+    The default alias table, extended with a JSON object of
+    normalized form -> canonical name read from `path` when given.
+    """
+    aliases = dict(DEFAULT_ALIASES)
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            aliases.update({key.lower(): value for key, value in json.load(f).items()})
+    return aliases
+
+
+class EntityCanonicalizer:
+    """
+    Shared normalization state: the spaCy pipeline, the embedding model and
+    the alias table. Per-document indexes come from for_document().
+
+    Args:
+        nlp_getter (Callable[[], Any]): Returns the spaCy pipeline.
+        encoder (Callable[[List[str]], np.ndarray]): Embeds entity names.
+        aliases (Dict[str, str]): Normalized form -> canonical name.
+        similarity_threshold (float): Minimum cosine similarity to join an
+        existing entity. 0 disables clustering.
+        cache_size (int): Entries kept in each of the normalization and
+        embedding LRU caches.
+    """
+
+    def __init__(
+        self,
+        nlp_getter: Callable[[], Any],
+        encoder: Callable[[List[str]], np.ndarray],
+        aliases: Dict[str, str],
+        similarity_threshold: float = 0.0,
+        cache_size: int = 50000,
+    ):
+        self._nlp_getter = nlp_getter
+        self._encoder = encoder
+        self.aliases = aliases
+        self.similarity_threshold = similarity_threshold
+        self.cache_size = cache_size
+        self._normalized: "OrderedDict[str, str]" = OrderedDict()
+        self._embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def normalize(self, names: List[str]) -> List[str]:
+        """
+        Normalized forms of entity names, lemmatized in one nlp.pipe pass.
+        """
+        with self._lock:
+            forms = {name: self._normalized[name] for name in names if name in self._normalized}
+        missing = list(dict.fromkeys(name for name in names if name not in forms))
+        if missing:
+            nlp = self._nlp_getter()
+            # Only the lemmatizer and what it depends on are needed
+            disabled = [name for name in ("parser", "ner") if name in nlp.pipe_names]
+            for name, doc in zip(missing, nlp.pipe([name.lower() for name in missing], disable=disabled)):
+                words = [token for token in doc if not token.is_punct and not token.is_space]
+                while len(words) > 1 and words[0].lower_ in _LEADING_WORDS:
+                    words = words[1:]
+                forms[name] = " ".join((token.lemma_ or token.text).lower() for token in words) or name.strip().lower()
+        with self._lock:
+            for name in names:
+                self._normalized[name] = forms[name]
+                self._normalized.move_to_end(name)
+            while len(self._normalized) > self.cache_size:
+                self._normalized.popitem(last=False)
+        return [forms[name] for name in names]
+
+    def embed(self, forms: List[str]) -> np.ndarray:
+        """
+        L2-normalized embeddings of normalized forms, encoding only the
+        forms missing from the LRU cache.
+        """
+        with self._lock:
+            missing = list(dict.fromkeys(form for form in forms if form not in self._embeddings))
+        if missing:
+            embeddings = np.asarray(self._encoder(missing), dtype=np.float32).reshape(len(missing), -1)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.where(norms == 0, 1, norms)
+        with self._lock:
+            if missing:
+                self._embeddings.update(zip(missing, embeddings))
+            result = np.stack([self._embeddings[form] for form in forms])
+            for form in forms:
+                self._embeddings.move_to_end(form)
+            while len(self._embeddings) > self.cache_size:
+                self._embeddings.popitem(last=False)
+        return result
+
+    def for_document(self, doc_id: str, existing_names: Optional[List[str]] = None) -> "DocumentEntities":
+        """
+        A canonicalization index for one document, seeded with its stored entity names.
+        """
+        entities = DocumentEntities(self, doc_id)
+        if existing_names:
+            entities.seed(existing_names)
+        return entities
+
+
+class DocumentEntities:
+    """
+    In-memory index of a document's canonical entities.
+    Not thread-safe; used by the single triple writer of an ingestion.
+    """
+
+    def __init__(self, canonicalizer: EntityCanonicalizer, doc_id: str):
+        self.canonicalizer = canonicalizer
+        self.doc_id = doc_id
+        self._canonical_of_form: Dict[str, str] = {}
+        self._canonical_of_name: Dict[str, str] = {}
+        # Embedding index over the normalized forms that started an entity;
+        # seeded entities are only embedded once clustering is needed
+        self._unindexed: List[Tuple[str, str]] = []
+        self._index_forms: List[str] = []
+        self._index_canonical: List[str] = []
+        self._index = np.zeros((0, 0), dtype=np.float32)
+        # Canonical name -> surface forms mapped onto it during this ingestion
+        self.merges: Dict[str, Set[str]] = {}
+        # Triples dropped because subject and object became the same entity
+        self.self_loops = 0
+
+    def seed(self, names: List[str]):
+        """
+        Register stored entity names as canonical entities.
+        """
+        forms = self.canonicalizer.normalize(names)
+        new = []
+        for name, form in zip(names, forms):
+            if form not in self._canonical_of_form:
+                self._canonical_of_form[form] = self.canonicalizer.aliases.get(form, name)
+                new.append((form, self._canonical_of_form[form]))
+            self._canonical_of_name[name] = self._canonical_of_form[form]
+        if self.canonicalizer.similarity_threshold:
+            self._unindexed.extend(new)
+
+    def _index_seeded(self):
+        entries, self._unindexed = self._unindexed, []
+        if not entries:
+            return
+        embeddings = self.canonicalizer.embed([form for form, _ in entries])
+        self._index = embeddings if self._index.size == 0 else np.vstack([self._index, embeddings])
+        self._index_forms.extend(form for form, _ in entries)
+        self._index_canonical.extend(name for _, name in entries)
+
+    def _resolve(self, names: List[str]):
+        names = [name for name in dict.fromkeys(names) if name not in self._canonical_of_name]
+        if not names:
+            return
+        name_forms = self.canonicalizer.normalize(names)
+        unresolved: Dict[str, str] = {}
+        for name, form in zip(names, name_forms):
+            canonical = self._canonical_of_form.get(form) or self.canonicalizer.aliases.get(form)
+            if canonical is not None:
+                self._canonical_of_form.setdefault(form, canonical)
+                self._canonical_of_name[name] = canonical
+            else:
+                unresolved.setdefault(form, name)
+
+        # Cluster the remaining forms against the index, one at a time so
+        # forms of the same batch can join each other
+        forms = list(unresolved)
+        embeddings = None
+        if forms and self.canonicalizer.similarity_threshold:
+            self._index_seeded()
+            embeddings = self.canonicalizer.embed(forms)
+        for i, form in enumerate(forms):
+            canonical = None
+            if embeddings is not None and self._index.size:
+                scores = self._index @ embeddings[i]
+                best = int(np.argmax(scores))
+                if scores[best] >= self.canonicalizer.similarity_threshold:
+                    canonical = self._index_canonical[best]
+            if canonical is None:
+                canonical = unresolved[form]
+                if embeddings is not None:
+                    self._index = embeddings[i:i + 1] if self._index.size == 0 else np.vstack([self._index, embeddings[i:i + 1]])
+                    self._index_forms.append(form)
+                    self._index_canonical.append(canonical)
+            self._canonical_of_form[form] = canonical
+
+        for name, form in zip(names, name_forms):
+            self._canonical_of_name.setdefault(name, self._canonical_of_form[form])
+
+    def canonicalize(self, triples: List[Triple]) -> List[Triple]:
+        """
+        Map the subject and object of every triple to their canonical names,
+        dropping triples that became duplicates or self-loops.
+        """
+        self._resolve([name for s, _, o in triples for name in (s, o) if name])
+        seen = set()
+        result = []
+        for s, r, o in triples:
+            if s:
+                s = self._record(s)
+            if o:
+                o = self._record(o)
+            if s and s == o:
+                self.self_loops += 1
+                continue
+            if (s, r, o) not in seen:
+                seen.add((s, r, o))
+                result.append((s, r, o))
+        return result
+
+    def _record(self, name: str) -> str:
+        canonical = self._canonical_of_name[name]
+        if canonical != name:
+            self.merges.setdefault(canonical, set()).add(name)
+        return canonical
+
+    def canonicalize_batch(self, batch: List[Tuple[str, List[Triple]]]) -> List[Tuple[str, List[Triple]]]:
+        """
+        canonicalize() over the (chunk_id, triples) pairs of a write batch.
+        """
+        return [(chunk_id, self.canonicalize(triples)) for chunk_id, triples in batch]
+
+    def report(self) -> Dict:
+        """
+        Surface forms merged into each canonical entity during this ingestion.
+        """
+        return {
+            "doc_id": self.doc_id,
+            "merged_forms": sum(len(forms) for forms in self.merges.values()),
+            "dropped_self_loops": self.self_loops,
+            "merges": {canonical: sorted(forms) for canonical, forms in sorted(self.merges.items())},
+        }
@@ -1,45 +1,205 @@
 """
 Ingestion Utility for uploaded documents
 """
-from langchain_setup import driver
+import hashlib
 import json
+import os
+import queue
+import threading
+import time
 import uuid
 import re
-from typing import List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
 
 from retrieve import generate_initial_analysis
-import spacy
-from langchain_setup import driver, llm
+from langchain_setup import (
+    EMBEDDING_PRECISION,
+    get_answer_cache,
+    get_driver,
+    get_entity_canonicalizer,
+    get_lexical_index,
+    get_vector_store,
+    llm_text,
+)
+from entity_canonicalizer import DocumentEntities
+from vector_store import decode_embedding, encode_embedding
 import text_processor as tp
 
-nlp = spacy.load("en_core_web_sm")
 TRIPLE_PATTERN = re.compile(r"^\(.+?,.+?,.+?\)$")
 
+# Chunk size budget: embedding tokenizer tokens when CHUNK_MAX_TOKENS > 0, else characters
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "500"))
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "0"))
+# Number of chunks written per UNWIND transaction
+CHUNK_WRITE_BATCH_SIZE = int(os.getenv("CHUNK_WRITE_BATCH_SIZE", "256"))
+# Size of the triple extraction worker pool
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "4"))
+# Maximum number of chunks whose triples are written per transaction
+TRIPLE_WRITE_BATCH_SIZE = int(os.getenv("TRIPLE_WRITE_BATCH_SIZE", "16"))
+# Maximum number of triples sent in one UNWIND statement
+TRIPLE_WRITE_ROWS = int(os.getenv("TRIPLE_WRITE_ROWS", "1000"))
+# "batched" packs several chunks into one extraction prompt, "single" sends one prompt per chunk
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "batched").lower()
+# Approximate document tokens and maximum chunks packed into one batched prompt
+EXTRACTION_BATCH_TOKENS = int(os.getenv("EXTRACTION_BATCH_TOKENS", "1500"))
+EXTRACTION_BATCH_MAX_CHUNKS = int(os.getenv("EXTRACTION_BATCH_MAX_CHUNKS", "8"))
+
+_EXTRACTION_DONE = object()
+
+# Stages reported by ingest() and their share of the total ingestion time
+INGEST_STAGE_WEIGHTS = {
+    "load": 0.05,
+    "chunk": 0.05,
+    "embed": 0.07,
+    "store": 0.03,
+    "extract": 0.55,
+    "cleanup": 0.05,
+    "analysis": 0.20,
+}
+
+_document_locks: Dict[str, threading.RLock] = {}
+_document_locks_guard = threading.Lock()
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-def store_chunks_in_neo4j(chunks: List[str], embeddings: List) -> List[str]:
+def fingerprint_chunk(text: str) -> str:
+    """
+    Content hash identifying a chunk independently of where it was ingested.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_chunk_id(doc_id: str, fingerprint: str) -> str:
+    """
+    Build the document scoped ID of a chunk from its fingerprint.
+    """
+    return f"{doc_id}:{fingerprint[:32]}"
+
+
+def _write_chunk_batch(tx, rows: List[dict]):
+    """
+    Write one batch of chunks with a single UNWIND statement.
+    Embeddings are stored through setNodeVectorProperty so Neo4j keeps
+    them as a float32 vector instead of a list of 64-bit floats.
+    """
+    tx.run(
+        """
+        UNWIND $rows AS row
+        MERGE (c:Chunk {id: row.id})
+        SET c.text = row.text, c.doc_id = row.doc_id,
+            c.fingerprint = row.fingerprint, c.position = row.position
+        WITH c, row
+        CALL db.create.setNodeVectorProperty(c, 'embedding', row.embedding)
+        WITH c, row
+        OPTIONAL MATCH (d:Document {id: row.doc_id})
+        FOREACH (_ IN CASE WHEN d IS NULL THEN [] ELSE [1] END | MERGE (d)-[:HAS_CHUNK]->(c))
+        """,
+        rows=rows
+    )
+
+
+def _write_compact_chunk_batch(tx, rows: List[dict]):
+    """
+    Same as _write_chunk_batch, but the embedding is stored as a byte array at
+    EMBEDDING_PRECISION (plus its int8 scale). Used when the vector index lives
+    outside Neo4j, so the graph only keeps the embedding to rebuild it.
+    """
+    tx.run(
+        """
+        UNWIND $rows AS row
+        MERGE (c:Chunk {id: row.id})
+        SET c.text = row.text, c.doc_id = row.doc_id,
+            c.fingerprint = row.fingerprint, c.position = row.position,
+            c.embedding_q = row.embedding_q, c.embedding_dtype = row.embedding_dtype,
+            c.embedding_scale = row.embedding_scale
+        REMOVE c.embedding
+        WITH c, row
+        OPTIONAL MATCH (d:Document {id: row.doc_id})
+        FOREACH (_ IN CASE WHEN d IS NULL THEN [] ELSE [1] END | MERGE (d)-[:HAS_CHUNK]->(c))
+        """,
+        rows=rows
+    )
+
+
+def _embedding_fields(embedding, compact: bool) -> dict:
+    if not compact:
+        return {"embedding": np.asarray(embedding, dtype=np.float32).tolist()}
+    data, scale = encode_embedding(embedding, EMBEDDING_PRECISION)
+    return {"embedding_q": data, "embedding_dtype": EMBEDDING_PRECISION, "embedding_scale": scale}
+
+
+def store_chunks_in_neo4j(
+    chunks: List[str],
+    embeddings: List,
+    batch_size: int = CHUNK_WRITE_BATCH_SIZE,
+    doc_id: Optional[str] = None,
+    positions: Optional[List[int]] = None,
+) -> List[str]:
     """
     Store chunks as Chunk nodes in Neo4j.
 
+    Chunks are written in batches of `batch_size`, each batch being one UNWIND
+    statement inside its own write transaction. When `doc_id` is given, chunk
+    IDs are derived from the document and the chunk's content hash, so writing
+    the same chunk again updates the existing node.
+
+    Args:
+        chunks (List[str]): Chunk texts.
+        embeddings (List): Embeddings for each chunk, in the same order.
+        batch_size (int): Number of chunks sent per transaction.
+        doc_id (Optional[str]): Document the chunks belong to.
+        positions (Optional[List[int]]): Position of each chunk in the document.
+
     Returns:
-        List[str]: List of generated chunk IDs.
+        List[str]: List of chunk IDs.
     """
-    chunk_ids = []
-    with driver.session() as session:
-        for i, (chunk, emb) in enumerate(zip(chunks, embeddings)):
-            chunk_id = str(uuid.uuid4())
-            session.run(
-                """
-                CREATE (c:Chunk {id: $id, text: $text, embedding: $embedding})
-                """,
-                id=chunk_id,
-                text=chunk,
-                embedding=emb.tolist() if hasattr(emb, "tolist") else emb
+    fingerprints = [fingerprint_chunk(chunk) for chunk in chunks]
+    if doc_id is None:
+        chunk_ids = [str(uuid.uuid4()) for _ in chunks]
+    else:
+        chunk_ids = [make_chunk_id(doc_id, fp) for fp in fingerprints]
+    if positions is None:
+        positions = list(range(len(chunks)))
+    batch_size = max(1, batch_size)
+    store = get_vector_store()
+    # Neo4j's vector index only reads float vectors, so compact storage is for the local backend
+    compact = not store.in_graph
+    write_batch = _write_compact_chunk_batch if compact else _write_chunk_batch
+
+    with get_driver().session() as session:
+        for start in range(0, len(chunks), batch_size):
+            end = start + batch_size
+            rows = [
+                {
+                    "id": chunk_id,
+                    "doc_id": doc_id,
+                    "fingerprint": fp,
+                    "position": position,
+                    "text": chunk,
+                    **_embedding_fields(emb, compact),
+                }
+                for chunk_id, fp, position, chunk, emb in zip(
+                    chunk_ids[start:end],
+                    fingerprints[start:end],
+                    positions[start:end],
+                    chunks[start:end],
+                    embeddings[start:end],
+                )
+            ]
+            t0 = time.perf_counter()
+            session.execute_write(write_batch, rows)
+            logger.info(
+                f"Stored chunk batch {start // batch_size + 1} "
+                f"({len(rows)} chunks) in {time.perf_counter() - t0:.3f}s"
             )
-            chunk_ids.append(chunk_id)
+    store.add(chunk_ids, embeddings, doc_id=doc_id)
+    get_lexical_index().add(chunk_ids, chunks, doc_id=doc_id)
     return chunk_ids
 
 
@@ -53,23 +213,7 @@ def sanitize_relation_name(rel: str) -> str:
     return rel
 
 
-def extract_triples_from_chunk(chunk_text: str) -> List[Tuple[str, str, str]]:
-    """
-    Generate subject-relation-object triples from text using the LLM.
-    """
-    prompt = f"""
-You are an information extraction system specialized in Terms of Service.
-
-Your task: From the given text, extract all factual subject–relation–object triples.
-
-Rules:
-- Output ONLY in this exact format, one triple per line:
-  (SUBJECT, RELATION, OBJECT)
-- No explanations, bullet points, numbering, or extra words.
-- Keep SUBJECT, RELATION, and OBJECT concise.
-- If no valid triples exist, return nothing.
-
-Examples:
+_EXTRACTION_EXAMPLES = """Examples:
 
 Text:
 "Marie Curie discovered radium and polonium."
@@ -105,22 +249,54 @@ Text:
 Output:
 (User, violates, rules)
 (Company, may_suspend, account)
+"""
+
+_BATCH_TAG_PATTERN = re.compile(r"^\[C(\d+)\]\s*(\(.*\))$")
+
 
+def _parse_triple(line: str) -> Optional[Tuple[str, str, str]]:
+    """
+    Parse a single "(S, R, O)" line, returning None if it is not a valid triple.
+    """
+    if not TRIPLE_PATTERN.match(line):
+        return None
+    parts = [x.strip() for x in line[1:-1].split(",")]
+    if len(parts) != 3:
+        return None
+    s, r, o = parts
+    if not (s and r and o):  # Skip empty parts
+        return None
+    return s, r, o
+
+
+def extract_triples_from_chunk(chunk_text: str) -> List[Tuple[str, str, str]]:
+    """
+    Generate subject-relation-object triples from text using the LLM.
+    """
+    prompt = f"""
+You are an information extraction system specialized in Terms of Service.
+
+Your task: From the given text, extract all factual subject–relation–object triples.
+
+Rules:
+- Output ONLY in this exact format, one triple per line:
+  (SUBJECT, RELATION, OBJECT)
+- No explanations, bullet points, numbering, or extra words.
+- Keep SUBJECT, RELATION, and OBJECT concise.
+- If no valid triples exist, return nothing.
+
+{_EXTRACTION_EXAMPLES}
 Now extract triples from this text:
 \"\"\"{chunk_text}\"\"\"
 """
-    response = llm.invoke(prompt)
-    text_out = response.content if isinstance(response.content, str) else str(response.content) #type:ignore
+    text_out = llm_text(prompt)
     triples: List[Tuple[str, str, str]] = []
 
     for line in text_out.splitlines():
         line = line.strip()
-        if TRIPLE_PATTERN.match(line):
-            parts = [x.strip() for x in line[1:-1].split(",")]
-            if len(parts) == 3:
-                s, r, o = parts
-                if s and r and o:  # Skip empty parts
-                    triples.append((s, r, o))
+        triple = _parse_triple(line)
+        if triple:
+            triples.append(triple)
         elif line:
             print(f"Skipping line: {line}. Does not match pattern.")
 
@@ -129,71 +305,763 @@ Now extract triples from this text:
     return triples
 
 
-def store_triples(triples: List[Tuple[str, str, str]], chunk_id: str):
+def extract_triples_from_chunks(chunk_texts: List[str]) -> Optional[List[List[Tuple[str, str, str]]]]:
     """
-    Store triples in Neo4j with chunk_id as a property and link them to Chunk node.
+    Generate triples for several chunks with a single LLM call.
+
+    Every chunk is tagged as [C<n>] in the prompt and the model is asked to
+    prefix each output triple with the tag of the chunk it came from.
+
+    Args:
+        chunk_texts (List[str]): Texts of the chunks packed into the prompt.
+
+    Returns:
+        Optional[List[List[Tuple[str, str, str]]]]: Triples for each chunk, in
+        the same order, or None if some triples could not be attributed to a chunk.
     """
-    with driver.session() as session:
+    tagged = "\n\n".join(
+        f"[C{i}]\n\"\"\"{text}\"\"\"" for i, text in enumerate(chunk_texts, start=1)
+    )
+    prompt = f"""
+You are an information extraction system specialized in Terms of Service.
+
+Your task: You are given several texts, each preceded by a tag like [C1], [C2], ...
+From each text, extract all factual subject–relation–object triples.
+
+Rules:
+- Output ONLY in this exact format, one triple per line, prefixed with the tag of the text it came from:
+  [C<n>] (SUBJECT, RELATION, OBJECT)
+- No explanations, bullet points, numbering, or extra words.
+- Keep SUBJECT, RELATION, and OBJECT concise.
+- Never mix facts from different texts in one triple.
+- If a text has no valid triples, output nothing for it.
+
+The examples below show single untagged texts; in your answer every triple must carry its tag, e.g.
+[C1] (User, agrees_to, Terms of Service)
+
+{_EXTRACTION_EXAMPLES}
+Now extract triples from these texts:
+
+{tagged}
+"""
+    text_out = llm_text(prompt)
+    per_chunk: List[List[Tuple[str, str, str]]] = [[] for _ in chunk_texts]
+
+    for line in text_out.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = _BATCH_TAG_PATTERN.match(line)
+        if match:
+            index = int(match.group(1)) - 1
+            triple = _parse_triple(match.group(2).strip())
+            if not 0 <= index < len(chunk_texts):
+                logger.debug(f"Unknown chunk tag in line: {line}")
+                return None
+            if triple:
+                per_chunk[index].append(triple)
+        elif _parse_triple(line):
+            # A triple we cannot attribute to any chunk
+            logger.debug(f"Untagged triple in batched output: {line}")
+            return None
+        else:
+            print(f"Skipping line: {line}. Does not match pattern.")
+
+    # No triples at all is a valid answer (boilerplate chunks), not a failure
+    return per_chunk
+
+
+def pack_extraction_batches(
+    chunk_ids: List[str],
+    chunk_texts: List[str],
+    token_budget: int = EXTRACTION_BATCH_TOKENS,
+    max_chunks: int = EXTRACTION_BATCH_MAX_CHUNKS,
+) -> List[List[Tuple[str, str]]]:
+    """
+    Greedily pack chunks into extraction batches under a token budget.
+
+    Args:
+        chunk_ids (List[str]): IDs of the chunks.
+        chunk_texts (List[str]): Texts of the chunks, in the same order.
+        token_budget (int): Approximate document tokens allowed per prompt.
+        max_chunks (int): Maximum number of chunks per prompt.
+
+    Returns:
+        List[List[Tuple[str, str]]]: Batches of (chunk_id, text) pairs.
+    """
+    batches: List[List[Tuple[str, str]]] = []
+    current: List[Tuple[str, str]] = []
+    current_tokens = 0
+
+    for chunk_id, text in zip(chunk_ids, chunk_texts):
+        tokens = tp.estimate_tokens(text)
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_chunks):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append((chunk_id, text))
+        current_tokens += tokens
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _extract_batch(batch: List[Tuple[str, str]]) -> List[Tuple[str, List[Tuple[str, str, str]]]]:
+    """
+    Extract triples for one packed batch, falling back to per-chunk calls when
+    the batched output cannot be attributed.
+    """
+    if len(batch) > 1:
+        per_chunk = extract_triples_from_chunks([text for _, text in batch])
+        if per_chunk is not None:
+            return [(chunk_id, triples) for (chunk_id, _), triples in zip(batch, per_chunk)]
+        logger.info(f"Could not attribute batched extraction output, retrying {len(batch)} chunks individually")
+    return [(chunk_id, extract_triples_from_chunk(text)) for chunk_id, text in batch]
+
+
+def _triple_rows_by_relation(
+    batch: List[Tuple[str, List[Tuple[str, str, str]]]]
+) -> Dict[str, List[dict]]:
+    """
+    Group the triples of several chunks by sanitized relation type, dropping
+    triples with an empty entity and duplicates within a chunk.
+    """
+    groups: Dict[str, Dict[tuple, dict]] = {}
+    for chunk_id, triples in batch:
         for s, r, o in triples:
             # Skip empty entities
             if not s or not o:
                 continue
+            rel = sanitize_relation_name(r)
+            groups.setdefault(rel, {}).setdefault(
+                (chunk_id, s, o), {"chunk_id": chunk_id, "subj": s, "obj": o}
+            )
+    return {rel: list(rows.values()) for rel, rows in groups.items()}
 
-            safe_rel = sanitize_relation_name(r)
-            session.run(
+
+def _merge_triples(tx, batch: List[Tuple[str, List[Tuple[str, str, str]]]], rows_per_query: int = TRIPLE_WRITE_ROWS):
+    """
+    Write the triples of several chunks inside an open transaction, with one
+    UNWIND statement per relation type (and per `rows_per_query` triples).
+    A relationship type cannot be a parameter, but grouping keeps the number
+    of distinct query texts to the number of relation types, so their plans
+    stay cached. Entities are scoped to the document owning the chunk.
+    """
+    for rel, rows in _triple_rows_by_relation(batch).items():
+        for start in range(0, len(rows), rows_per_query):
+            tx.run(
                 f"""
-                MERGE (sub:Entity {{name: $subj}})
-                MERGE (obj:Entity {{name: $obj}})
-                MERGE (c:Chunk {{id: $chunk_id}})
-                MERGE (sub)-[:`{safe_rel}` {{chunk_id: $chunk_id}}]->(obj)
+                UNWIND $rows AS row
+                MATCH (c:Chunk {{id: row.chunk_id}})
+                WITH c, row, coalesce(c.doc_id, '') AS doc_id
+                MERGE (sub:Entity {{doc_id: doc_id, name: row.subj}})
+                MERGE (obj:Entity {{doc_id: doc_id, name: row.obj}})
+                MERGE (sub)-[:`{rel}` {{chunk_id: row.chunk_id}}]->(obj)
                 MERGE (sub)-[:MENTIONED_IN]->(c)
                 MERGE (obj)-[:MENTIONED_IN]->(c)
                 """,#type:ignore
-                subj=s,
-                obj=o,
-                chunk_id=chunk_id
+                rows=rows[start:start + rows_per_query]
             )
 
-def clear_neo4j():
+
+def _write_triples_batch(tx, batch: List[Tuple[str, List[Tuple[str, str, str]]]]):
+    _merge_triples(tx, batch)
+    # Chunks whose extraction never completed are picked up again on re-ingestion
+    tx.run(
+        "MATCH (c:Chunk) WHERE c.id IN $ids SET c.extracted = true",
+        ids=[chunk_id for chunk_id, _ in batch]
+    )
+
+
+def store_triples_batch(batch: List[Tuple[str, List[Tuple[str, str, str]]]]):
     """
-    Deletes all existing Chunk nodes, Entity nodes, and triples in the database.
+    Store the triples of several chunks in a single write transaction.
+
+    Args:
+        batch (List[Tuple[str, List[Tuple[str, str, str]]]]): Pairs of
+        (chunk_id, triples).
     """
-    with driver.session() as session:
-        session.run("MATCH (n) DETACH DELETE n")
+    with get_driver().session() as session:
+        session.execute_write(_write_triples_batch, batch)
 
-def ingest(filepath: str):
+
+def extract_and_store_triples(
+    chunk_ids: List[str],
+    chunk_texts: List[str],
+    workers: int = EXTRACTION_WORKERS,
+    write_batch_size: int = TRIPLE_WRITE_BATCH_SIZE,
+    batched: bool = EXTRACTION_MODE == "batched",
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    entities: Optional[DocumentEntities] = None,
+) -> Optional[Dict]:
     """
-    Full ingestion pipeline:
-    1. Clear Neo4j
-    2. Load text
-    3. Chunk text
-    4. Generate embeddings
-    5. Store chunks in Neo4j
-    6. Extract triples and store in Neo4j
+    Pipelined triple extraction stage.
+
+    A pool of `workers` threads runs the LLM extraction concurrently, while a
+    separate writer thread drains finished results into Neo4j in batches of up
+    to `write_batch_size` chunks, so LLM time and DB time overlap. The number of
+    requests actually in flight against Ollama is further capped by the LLM
+    client itself (LLM_MAX_INFLIGHT).
+
+    In batched mode, several chunks are packed into each extraction prompt
+    (see pack_extraction_batches); otherwise each chunk gets its own call.
+
+    Args:
+        chunk_ids (List[str]): IDs of the stored Chunk nodes.
+        chunk_texts (List[str]): Texts of the chunks, in the same order.
+        workers (int): Size of the extraction worker pool.
+        write_batch_size (int): Maximum number of chunks per write transaction.
+        batched (bool): Whether to pack several chunks into one prompt.
+        on_progress (Optional[Callable[[int, int], None]]): Called with
+        (chunks processed, total chunks) as extraction batches complete.
+        entities (Optional[DocumentEntities]): Entity index of the document;
+        entity names are canonicalized by the writer before each batch is stored.
+
+    Returns:
+        Optional[Dict]: The entity merges of this extraction, when `entities` is given.
     """
-    clear_neo4j()
-    text = tp.load_text(filepath)
-    chunks_list = tp.chunk_text_spacy(text)
-    chunks = [item["chunk"] for item in chunks_list]
-    embeddings = tp.embed_chunks(chunks)
+    results: "queue.Queue" = queue.Queue()
+    writer_errors: List[Exception] = []
 
-    # Store chunks & get IDs
-    chunk_ids = store_chunks_in_neo4j(chunks, embeddings)
+    def writer():
+        pending = []
+        while True:
+            item = results.get()
+            done = item is _EXTRACTION_DONE
+            if not done:
+                pending.append(item)
+            # Flush when the batch is full, when nothing else is ready yet, or at the end
+            if pending and (done or len(pending) >= write_batch_size or results.empty()):
+                try:
+                    if entities is not None:
+                        pending = entities.canonicalize_batch(pending)
+                    store_triples_batch(pending)
+                except Exception as e:
+                    logger.error(f"Failed to store triples for {len(pending)} chunks: {e}")
+                    writer_errors.append(e)
+                pending = []
+            if done:
+                return
 
-    for chunk, chunk_id in zip(chunks_list, chunk_ids):
-        chunk_text = chunk["chunk"]
-        triples = extract_triples_from_chunk(chunk_text)
-        store_triples(triples, chunk_id)
+    writer_thread = threading.Thread(target=writer, name="triple-writer", daemon=True)
+    writer_thread.start()
 
-    logger.info(f"Ingestion Complete for {filepath}")
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="triple-extract") as pool:
+        if batched:
+            batches = pack_extraction_batches(chunk_ids, chunk_texts)
+        else:
+            batches = [[pair] for pair in zip(chunk_ids, chunk_texts)]
+        futures = {pool.submit(_extract_batch, batch): batch for batch in batches}
+        processed = 0
+        for future in as_completed(futures):
+            batch = futures[future]
+            processed += len(batch)
+            if on_progress:
+                on_progress(processed, len(chunk_ids))
+            try:
+                extracted = future.result()
+            except Exception as e:
+                logger.error(f"Triple extraction failed for {len(batch)} chunks: {e}")
+                continue
+            for item in extracted:
+                results.put(item)
+
+    results.put(_EXTRACTION_DONE)
+    writer_thread.join()
+    logger.info(f"Extracted triples for {len(chunk_ids)} chunks in {time.perf_counter() - t0:.2f}s")
+
+    if writer_errors:
+        raise writer_errors[0]
+
+    if entities is None:
+        return None
+    report = entities.report()
+    logger.info(
+        f"Document {entities.doc_id}: merged {report['merged_forms']} entity surface forms, "
+        f"dropped {report['dropped_self_loops']} self-loop triples"
+    )
+    return report
 
-    # --- Fetch all chunks from Neo4j ---
-    with driver.session() as session:
+
+def document_entities(doc_id: str) -> Optional[DocumentEntities]:
+    """
+    Entity canonicalization index of a document, seeded with the entity
+    names already stored for it. None when canonicalization is disabled.
+    """
+    canonicalizer = get_entity_canonicalizer()
+    if canonicalizer is None:
+        return None
+    with get_driver().session() as session:
+        result = session.run("MATCH (e:Entity {doc_id: $doc_id}) RETURN e.name AS name", doc_id=doc_id)
+        names = [record["name"] for record in result]
+    return canonicalizer.for_document(doc_id, names)
+
+
+def _document_lock(doc_id: str) -> threading.RLock:
+    """
+    Lock serializing ingestions of the same document. Reentrant, so an
+    ingestion holding it can call apply_chunks.
+    """
+    with _document_locks_guard:
+        return _document_locks.setdefault(doc_id, threading.RLock())
+
+
+def ensure_document(doc_id: str, source: Optional[str] = None):
+    """
+    Create the Document node owning a document's chunks, or refresh its metadata.
+    """
+    with get_driver().session() as session:
+        session.run(
+            """
+            MERGE (d:Document {id: $doc_id})
+            ON CREATE SET d.created_at = datetime()
+            SET d.updated_at = datetime(), d.source = coalesce($source, d.source)
+            """,
+            doc_id=doc_id,
+            source=source
+        )
+
+
+def set_document_version(doc_id: str, chunk_ids: List[str]) -> str:
+    """
+    Store the version of a document, a hash of its chunks in order, and
+    report it to the answer cache so answers about older versions are dropped.
+
+    Returns:
+        str: The document version.
+    """
+    version = hashlib.sha256("\n".join(chunk_ids).encode("utf-8")).hexdigest()[:16]
+    with get_driver().session() as session:
+        session.run("MATCH (d:Document {id: $doc_id}) SET d.version = $version", doc_id=doc_id, version=version)
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        answer_cache.set_version(doc_id, version)
+    return version
+
+
+def list_documents() -> List[Dict]:
+    """
+    List the ingested documents with their number of chunks.
+    """
+    with get_driver().session() as session:
+        result = session.run(
+            """
+            MATCH (d:Document)
+            OPTIONAL MATCH (d)-[:HAS_CHUNK]->(c:Chunk)
+            RETURN d.id AS doc_id, d.source AS source, toString(d.updated_at) AS updated_at,
+                   d.version AS version, count(c) AS chunks
+            ORDER BY d.updated_at DESC
+            """
+        )
+        return [record.data() for record in result]
+
+
+def delete_document(doc_id: str) -> bool:
+    """
+    Delete a document together with its chunks, triples and entities.
+
+    Returns:
+        bool: Whether the document existed.
+    """
+    with _document_lock(doc_id):
+        with get_driver().session() as session:
+            record = session.run(
+                "MATCH (d:Document {id: $doc_id}) RETURN count(d) AS n", doc_id=doc_id
+            ).single()
+            session.run("MATCH (c:Chunk {doc_id: $doc_id}) DETACH DELETE c", doc_id=doc_id)
+            session.run("MATCH (e:Entity {doc_id: $doc_id}) DETACH DELETE e", doc_id=doc_id)
+            session.run("MATCH (d:Document {id: $doc_id}) DETACH DELETE d", doc_id=doc_id)
+        get_vector_store().delete_document(doc_id)
+        get_lexical_index().delete_document(doc_id)
+        answer_cache = get_answer_cache()
+        if answer_cache is not None:
+            answer_cache.invalidate(doc_id)
+    return bool(record and record["n"])
+
+
+def rebuild_vector_store(batch_size: int = CHUNK_WRITE_BATCH_SIZE) -> int:
+    """
+    Load every chunk embedding stored in Neo4j into the configured vector
+    store, e.g. after switching to the local backend.
+
+    Returns:
+        int: Number of chunks loaded.
+    """
+    store = get_vector_store()
+    if store.in_graph:
+        return 0
+    store.clear()
+    loaded = 0
+    with get_driver().session() as session:
         result = session.run(
             """
             MATCH (c:Chunk)
-            RETURN c.id AS chunk_id, c.text AS text
+            WHERE c.embedding IS NOT NULL OR c.embedding_q IS NOT NULL
+            RETURN c.id AS chunk_id, c.doc_id AS doc_id, c.embedding AS embedding,
+                   c.embedding_q AS embedding_q, c.embedding_dtype AS embedding_dtype,
+                   c.embedding_scale AS embedding_scale
+            ORDER BY c.doc_id
+            """
+        )
+        batch: List[dict] = []
+        for record in result:
+            batch.append(record.data())
+            if len(batch) >= batch_size:
+                loaded += _add_to_store(store, batch)
+                batch = []
+        loaded += _add_to_store(store, batch)
+    logger.info(f"Loaded {loaded} chunk embeddings into the vector store")
+    return loaded
+
+
+def sync_lexical_index(batch_size: int = CHUNK_WRITE_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Reconcile the lexical index with the chunks stored in Neo4j: index the
+    chunks it misses (ingested before it existed, by a process that crashed
+    between the two writes, ...) and drop the ones no longer in the graph.
+
+    Returns:
+        Dict[str, int]: Number of chunks added and removed.
+    """
+    index = get_lexical_index()
+    indexed = index.chunk_ids()
+    with get_driver().session() as session:
+        stored = {record["chunk_id"] for record in session.run("MATCH (c:Chunk) RETURN c.id AS chunk_id")}
+        missing = [chunk_id for chunk_id in stored if chunk_id not in indexed]
+        for start in range(0, len(missing), batch_size):
+            result = session.run(
+                """
+                UNWIND $ids AS id
+                MATCH (c:Chunk {id: id})
+                WHERE c.text IS NOT NULL
+                RETURN c.id AS chunk_id, c.doc_id AS doc_id, c.text AS text
+                """,
+                ids=missing[start:start + batch_size],
+            )
+            _add_to_lexical_index(index, [record.data() for record in result])
+    removed = [chunk_id for chunk_id in indexed if chunk_id not in stored]
+    index.delete(removed)
+    logger.info(f"Lexical index synced: {len(missing)} chunks added, {len(removed)} removed")
+    return {"added": len(missing), "removed": len(removed)}
+
+
+def _add_to_lexical_index(index, rows: List[dict]) -> int:
+    by_doc: Dict[Optional[str], List[dict]] = {}
+    for row in rows:
+        by_doc.setdefault(row["doc_id"], []).append(row)
+    for doc_id, doc_rows in by_doc.items():
+        index.add([r["chunk_id"] for r in doc_rows], [r["text"] for r in doc_rows], doc_id=doc_id)
+    return len(rows)
+
+
+def _add_to_store(store, rows: List[dict]) -> int:
+    # The store takes one document per call
+    by_doc: Dict[Optional[str], List[dict]] = {}
+    for row in rows:
+        by_doc.setdefault(row["doc_id"], []).append(row)
+    for doc_id, doc_rows in by_doc.items():
+        embeddings = [
+            r["embedding"] if r["embedding"] is not None
+            else decode_embedding(r["embedding_q"], r["embedding_dtype"], r["embedding_scale"])
+            for r in doc_rows
+        ]
+        store.add([r["chunk_id"] for r in doc_rows], embeddings, doc_id=doc_id)
+    return len(rows)
+
+
+def document_id_from_name(name: str) -> str:
+    """
+    Readable document ID prefix derived from a file name (its sanitized stem).
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", stem) or "document"
+
+
+def new_document_id(name: str) -> str:
+    """
+    A new document ID for an upload: the file name plus a random suffix, so
+    unrelated uploads with the same name stay separate documents. A new
+    version of a document is ingested by passing its ID explicitly.
+    """
+    return f"{document_id_from_name(name)}-{uuid.uuid4().hex[:12]}"
+
+
+def document_id_from_path(path: str, root: str) -> str:
+    """
+    Stable document ID of a corpus file, derived from its path relative to
+    the corpus root (extension included), so re-running a bulk ingestion
+    updates the same documents and files sharing a name stay apart.
+    """
+    relative = os.path.relpath(path, root).replace(os.sep, "/")
+    readable = re.sub(r"[^A-Za-z0-9_.-]", "_", relative)
+    return f"{readable}-{hashlib.sha256(relative.encode('utf-8')).hexdigest()[:8]}"
+
+
+def fetch_chunk_state(doc_id: str) -> Dict[str, bool]:
+    """
+    Fetch the chunks currently stored for a document.
+
+    Returns:
+        Dict[str, bool]: Chunk ID -> whether its triples were extracted.
+    """
+    with get_driver().session() as session:
+        result = session.run(
             """
+            MATCH (c:Chunk {doc_id: $doc_id})
+            RETURN c.id AS chunk_id, coalesce(c.extracted, false) AS extracted
+            """,
+            doc_id=doc_id
+        )
+        return {record["chunk_id"]: record["extracted"] for record in result}
+
+
+def _update_positions(tx, rows: List[dict]):
+    tx.run(
+        """
+        UNWIND $rows AS row
+        MATCH (c:Chunk {id: row.id})
+        WHERE c.position IS NULL OR c.position <> row.position
+        SET c.position = row.position
+        """,
+        rows=rows
+    )
+
+
+def _delete_chunks(tx, chunk_ids: List[str]):
+    # Triples carry the chunk they were extracted from
+    tx.run(
+        """
+        MATCH (e:Entity)-[:MENTIONED_IN]->(c:Chunk)
+        WHERE c.id IN $ids
+        WITH DISTINCT e
+        MATCH (e)-[r]->(:Entity)
+        WHERE r.chunk_id IN $ids
+        DELETE r
+        """,
+        ids=chunk_ids
+    )
+    # Remove the chunks, then entities no longer mentioned by any chunk
+    tx.run(
+        """
+        MATCH (c:Chunk)
+        WHERE c.id IN $ids
+        OPTIONAL MATCH (e:Entity)-[:MENTIONED_IN]->(c)
+        WITH collect(DISTINCT c) AS chunks, collect(DISTINCT e) AS entities
+        FOREACH (c IN chunks | DETACH DELETE c)
+        WITH entities
+        UNWIND entities AS e
+        WITH e
+        WHERE NOT (e)-[:MENTIONED_IN]->()
+        DETACH DELETE e
+        """,
+        ids=chunk_ids
+    )
+
+
+def delete_chunks(chunk_ids: List[str]):
+    """
+    Delete chunks together with their triples and orphaned entities.
+    """
+    if not chunk_ids:
+        return
+    with get_driver().session() as session:
+        session.execute_write(_delete_chunks, chunk_ids)
+    get_vector_store().delete(chunk_ids)
+    get_lexical_index().delete(chunk_ids)
+
+
+def apply_chunks(
+    doc_id: str,
+    chunk_texts: Dict[str, str],
+    embeddings: Optional[Dict[str, object]] = None,
+    extract: bool = True,
+    progress: Optional[Callable[[str, float], None]] = None,
+) -> Dict:
+    """
+    Bring the stored chunks of a document in line with its current chunk list.
+
+    Under the document lock, the stored chunks are read again and diffed
+    against `chunk_texts`: chunks not stored yet are embedded and written,
+    chunks already stored get their new position, triples are extracted for
+    every chunk that does not have them yet, chunks no longer part of the
+    document are deleted and the document version is updated.
+
+    Args:
+        doc_id (str): Document the chunks belong to.
+        chunk_texts (Dict[str, str]): Chunk ID -> text, in document order.
+        embeddings (Optional[Dict[str, object]]): Embeddings computed ahead of
+        time, by chunk ID. New chunks missing from it are embedded here.
+        extract (bool): Extract and store triples for unfinished chunks.
+        progress (Optional[Callable[[str, float], None]]): Called with the
+        current stage (embed, store, extract, cleanup) and the fraction of
+        that stage completed.
+
+    Returns:
+        Dict: Number of chunks, new chunks, chunks sent to extraction, removed
+        chunks and merged entity forms, and the document version.
+    """
+    def report(stage: str, fraction: float = 0.0):
+        if progress:
+            progress(stage, fraction)
+
+    embeddings = embeddings or {}
+    with _document_lock(doc_id):
+        stored = fetch_chunk_state(doc_id)
+        chunk_ids = list(chunk_texts)
+        new_ids = [cid for cid in chunk_ids if cid not in stored]
+        pending_ids = [cid for cid in chunk_ids if not stored.get(cid, False)] if extract else []
+        orphan_ids = [cid for cid in stored if cid not in chunk_texts]
+
+        # Chunks removed by another ingestion since the caller embedded its chunks
+        unembedded = [cid for cid in new_ids if cid not in embeddings]
+        if unembedded:
+            report("embed")
+            embedded = tp.embed_chunks([chunk_texts[cid] for cid in unembedded])
+            embeddings = {**embeddings, **dict(zip(unembedded, embedded))}
+
+        report("store")
+        position_of = {cid: i for i, cid in enumerate(chunk_ids)}
+        if new_ids:
+            store_chunks_in_neo4j(
+                [chunk_texts[cid] for cid in new_ids],
+                [embeddings[cid] for cid in new_ids],
+                doc_id=doc_id,
+                positions=[position_of[cid] for cid in new_ids],
+            )
+        kept = [{"id": cid, "position": position_of[cid]} for cid in chunk_ids if cid in stored]
+        if kept:
+            with get_driver().session() as session:
+                session.execute_write(_update_positions, kept)
+
+        report("extract")
+        merges = None
+        if pending_ids:
+            merges = extract_and_store_triples(
+                pending_ids,
+                [chunk_texts[cid] for cid in pending_ids],
+                on_progress=lambda done, total: report("extract", done / total),
+                entities=document_entities(doc_id),
+            )
+            if merges and merges["merged_forms"]:
+                logger.info(f"Entity merges for {doc_id}: {json.dumps(merges['merges'])}")
+
+        report("cleanup")
+        delete_chunks(orphan_ids)
+        version = set_document_version(doc_id, chunk_ids)
+
+    return {
+        "chunks": len(chunk_ids),
+        "new": len(new_ids),
+        "extracted": len(pending_ids),
+        "removed": len(orphan_ids),
+        "merged_entities": merges["merged_forms"] if merges else 0,
+        "version": version,
+    }
+
+
+def ingest(
+    filepath: str,
+    doc_id: Optional[str] = None,
+    source: Optional[str] = None,
+    progress: Optional[Callable[[str, float], None]] = None,
+):
+    """
+    Incremental ingestion pipeline for a single document:
+    1. Stream the text page by page
+    2. Chunk it incrementally and fingerprint every chunk
+    3. Diff fingerprints against the chunks already stored for the document
+    4. Generate embeddings and store only new chunks in Neo4j, in batches as
+       they come out of the chunker
+    5. Extract triples for new (or previously unfinished) chunks and store in Neo4j
+    6. Delete chunks that are no longer part of the document
+    Steps 5 and 6 are apply_chunks, shared with bulk ingestion.
+
+    Only the document's own subgraph is touched, so different documents can be
+    ingested concurrently; ingestions of the same document are serialized.
+
+    Args:
+        filepath (str): Path of the document to ingest.
+        doc_id (Optional[str]): Document to ingest into. Defaults to a new
+        document (see new_document_id).
+        source (Optional[str]): Original name of the uploaded file.
+        progress (Optional[Callable[[str, float], None]]): Called with the
+        current stage (see INGEST_STAGE_WEIGHTS) and the fraction of that stage
+        completed.
+    """
+    def report(stage: str, fraction: float = 0.0):
+        if progress:
+            progress(stage, fraction)
+
+    doc_id = doc_id or new_document_id(filepath)
+
+    with _document_lock(doc_id):
+        ensure_document(doc_id, source)
+        stored = fetch_chunk_state(doc_id)
+
+        # Chunks are embedded and stored while the file is still being read
+        report("load")
+        chunk_texts: Dict[str, str] = {}
+        position_of: Dict[str, int] = {}
+        new_ids: List[str] = []
+        unstored: List[str] = []
+
+        def flush_new(stage_after: Optional[str] = None):
+            if not unstored:
+                return
+            report("embed")
+            new_chunks = [chunk_texts[cid] for cid in unstored]
+            embeddings = tp.embed_chunks(new_chunks)
+            report("store")
+            store_chunks_in_neo4j(
+                new_chunks, embeddings, doc_id=doc_id,
+                positions=[position_of[cid] for cid in unstored],
+            )
+            unstored.clear()
+            if stage_after:
+                report(stage_after)
+
+        chunk_stream = tp.chunk_text_stream(
+            tp.iter_text(filepath), max_chunk_size=CHUNK_MAX_CHARS, max_tokens=CHUNK_MAX_TOKENS or None
+        )
+        for item in chunk_stream:
+            if not chunk_texts:
+                report("chunk")
+            # Identical chunks within a document collapse to one node
+            chunk_id = make_chunk_id(doc_id, fingerprint_chunk(item["chunk"]))
+            if chunk_id in chunk_texts:
+                continue
+            chunk_texts[chunk_id] = item["chunk"]
+            position_of[chunk_id] = len(position_of)
+            if chunk_id not in stored:
+                new_ids.append(chunk_id)
+                unstored.append(chunk_id)
+                if len(unstored) >= CHUNK_WRITE_BATCH_SIZE:
+                    # Batches embedded mid-stream are timed as "embed" too
+                    flush_new(stage_after="chunk")
+
+        report("embed")
+        flush_new()
+
+        # Chunks streamed above are stored already, only their triples are left
+        applied = apply_chunks(doc_id, chunk_texts, progress=progress)
+        logger.info(
+            f"Document {doc_id}: {applied['chunks']} chunks, {len(new_ids)} new, "
+            f"{applied['extracted'] - len(new_ids)} unfinished, {applied['removed']} removed"
+        )
+
+    logger.info(f"Ingestion Complete for {filepath}")
+
+    # --- Fetch all chunks of the document from Neo4j ---
+    report("analysis")
+    with get_driver().session() as session:
+        result = session.run(
+            """
+            MATCH (:Document {id: $doc_id})-[:HAS_CHUNK]->(c:Chunk)
+            RETURN c.id AS chunk_id, c.text AS text
+            ORDER BY c.position
+            """,
+            doc_id=doc_id
         )
         chunk_dicts = [record.data() for record in result]
 
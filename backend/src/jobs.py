@@ -0,0 +1,211 @@
+"""
+Background job queue.
+
+Long running work such as document ingestion is submitted as a job and run on
+a local worker pool. Job state (stage, progress, per-stage timings, result) is
+persisted in a SQLite database so it survives a restart; jobs that were queued
+or running when the process stopped are queued again on startup.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# A handler receives the job parameters and a progress(stage, fraction) callback
+JobHandler = Callable[[Dict, Callable[[str, float], None]], Any]
+
+
+class JobManager:
+    """
+    Runs registered job handlers on a thread pool and tracks their state.
+
+    Args:
+        path (str): Location of the SQLite database holding job state.
+        workers (int): Number of jobs run concurrently.
+    """
+
+    def __init__(self, path: str, workers: int = 2):
+        self.path = path
+        self._handlers: Dict[str, JobHandler] = {}
+        self._stage_weights: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job")
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                percent REAL NOT NULL DEFAULT 0,
+                timings TEXT NOT NULL DEFAULT '{}',
+                params TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def register(self, kind: str, handler: JobHandler, stage_weights: Optional[Dict[str, float]] = None):
+        """
+        Register the handler run for jobs of the given kind.
+
+        Args:
+            kind (str): Job kind.
+            handler (JobHandler): Function running the job.
+            stage_weights (Optional[Dict[str, float]]): Share of the total work
+            taken by each stage, in order, used to compute percent complete.
+        """
+        self._handlers[kind] = handler
+        self._stage_weights[kind] = stage_weights or {}
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def submit(self, kind: str, params: Dict) -> str:
+        """
+        Queue a new job.
+
+        Returns:
+            str: The job ID.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, params, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(params), now, now),
+            )
+            self._conn.commit()
+        self._executor.submit(self._run, job_id, kind, params)
+        return job_id
+
+    def _run(self, job_id: str, kind: str, params: Dict):
+        weights = self._stage_weights.get(kind, {})
+        stages = list(weights)
+        timings: Dict[str, float] = {}
+        current = {"stage": None, "started": time.perf_counter(), "percent": 0.0}
+
+        def close_stage(now: float):
+            # Stages may interleave (chunking and embedding), so their times add up
+            if current["stage"] is not None:
+                elapsed = timings.get(current["stage"], 0.0) + now - current["started"]
+                timings[current["stage"]] = round(elapsed, 3)
+
+        def progress(stage: str, fraction: float = 0.0):
+            now = time.perf_counter()
+            if stage != current["stage"]:
+                close_stage(now)
+                current["stage"], current["started"] = stage, now
+            # Completed stages plus the finished share of the current one,
+            # never moving backwards when an earlier stage is re-entered
+            done = sum(weights[s] for s in stages[:stages.index(stage)]) if stage in weights else 0.0
+            percent = 100.0 * (done + weights.get(stage, 0.0) * min(max(fraction, 0.0), 1.0))
+            current["percent"] = max(current["percent"], percent)
+            self._update(job_id, stage=stage, percent=round(current["percent"], 1), timings=json.dumps(timings))
+
+        self._update(job_id, status=RUNNING, error=None)
+        try:
+            result = self._handlers[kind](params, progress)
+        except Exception as e:
+            logger.error(f"Job {job_id} ({kind}) failed: {e}")
+            close_stage(time.perf_counter())
+            self._update(job_id, status=FAILED, error=str(e), timings=json.dumps(timings))
+            return
+
+        close_stage(time.perf_counter())
+        self._update(
+            job_id,
+            status=SUCCEEDED,
+            stage="done",
+            percent=100.0,
+            timings=json.dumps(timings),
+            result=json.dumps(result),
+        )
+        logger.info(f"Job {job_id} ({kind}) finished")
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        Fetch the state of a job, or None if it does not exist.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT id, kind, status, stage, percent, timings, params, error, created_at, updated_at
+                FROM jobs WHERE id = ?
+                """,
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "stage": row[3],
+            "percent": row[4],
+            "timings": json.loads(row[5]),
+            "params": json.loads(row[6]),
+            "error": row[7],
+            "created_at": row[8],
+            "updated_at": row[9],
+        }
+
+    def result(self, job_id: str) -> Any:
+        """
+        Fetch the result of a finished job.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def resume(self):
+        """
+        Queue again the jobs that were queued or running when the process stopped.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, params FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchall()
+        for job_id, kind, params in rows:
+            if kind not in self._handlers:
+                self._update(job_id, status=FAILED, error=f"Unknown job kind: {kind}")
+                continue
+            logger.info(f"Resuming job {job_id} ({kind})")
+            self._update(job_id, status=QUEUED)
+            self._executor.submit(self._run, job_id, kind, json.loads(params))
+
+    def shutdown(self):
+        """
+        Stop accepting jobs and cancel the queued ones, which stay queued in
+        the database and are resumed on the next start. Running jobs are not
+        interrupted: the interpreter waits for them to finish before exiting.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
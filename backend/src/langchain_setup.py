@@ -1,18 +1,83 @@
+"""
+Shared clients and models.
+
+Models and clients are loaded lazily, once per process, on first use through
+the get_* accessors below. Loading is thread-safe and timed in the logs;
+warm_up() can be used to load them ahead of the first request.
+"""
+import asyncio
+import contextlib
+import logging
 import os
-import spacy
-from sentence_transformers import SentenceTransformer
+import queue
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
 from pathlib import Path
 from dotenv import load_dotenv
-from neo4j import GraphDatabase   # ← Disabled for now
-from ollama import Client as OllamaClient  # ← NEW
-from langchain_google_genai import ChatGoogleGenerativeAI
+from neo4j import AsyncGraphDatabase, GraphDatabase
+from ollama import AsyncClient as AsyncOllamaClient, Client as OllamaClient
+from llm_cache import LLMCache, make_key
+
+logger = logging.getLogger(__name__)
+
+_STREAM_END = object()
+
+# deepseek-r1 emits its reasoning before the answer
+_REASONING_PATTERN = re.compile(r"<think>.*?</think>", flags=re.DOTALL)
 
 # Load .env from parent folder
 env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
-nlp = spacy.load("en_core_web_sm")
-embedding_model = SentenceTransformer("nlpaueb/legal-bert-small-uncased")
+SPACY_MODEL = os.getenv("SPACY_MODEL", "en_core_web_sm")
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "nlpaueb/legal-bert-small-uncased")
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "deepseek-r1:7b")
+
+# Sentence segmentation used for chunking: "parser" (dependency parse, exact
+# same boundaries as the full pipeline), "senter" (statistical sentence
+# recognizer) or "sentencizer" (punctuation rules)
+SEGMENTATION_ENGINE = os.getenv("SEGMENTATION_ENGINE", "parser").lower()
+SEGMENTATION_BATCH_SIZE = int(os.getenv("SEGMENTATION_BATCH_SIZE", "16"))
+# Processes used by nlp.pipe when segmenting many texts at once
+SEGMENTATION_PROCESSES = int(os.getenv("SEGMENTATION_PROCESSES", "1"))
+
+# Chunk embedding: device, CPU threads used by torch (0 keeps torch's default)
+# and chunks per forward pass
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "cpu")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+# Embedding inference backend: "torch" (SentenceTransformer) or "onnx" (ONNX Runtime,
+# exported on first use under EMBEDDING_ONNX_PATH, int8 weights with EMBEDDING_ONNX_QUANTIZE)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH", "./cache/onnx")
+EMBEDDING_ONNX_QUANTIZE = os.getenv("EMBEDDING_ONNX_QUANTIZE", "false").lower() in ("1", "true", "yes")
+
+# Query embedding cache size and micro-batching window
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+QUERY_EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("QUERY_EMBEDDING_BATCH_WINDOW_MS", "5"))
+QUERY_EMBEDDING_MAX_BATCH = int(os.getenv("QUERY_EMBEDDING_MAX_BATCH", "32"))
+
+# Vector search backend: "neo4j" (chunk_embeddings index) or "local" (in-process index)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "neo4j").lower()
+VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "./cache/vectors")
+VECTOR_HNSW_THRESHOLD = int(os.getenv("VECTOR_HNSW_THRESHOLD", "50000"))
+# Lexical (BM25) index over chunk text, maintained alongside the vector store
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "./cache/lexical")
+# Default retrieval mode: "vector", "lexical" or "hybrid" (reciprocal rank fusion of both).
+# Deployments opt in to the lexical modes; requests may also pick one per query
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+# RRF rank constant, and candidates fetched from each ranking per requested chunk
+RRF_K = int(os.getenv("RRF_K", "60"))
+HYBRID_CANDIDATE_FACTOR = int(os.getenv("HYBRID_CANDIDATE_FACTOR", "4"))
+# Storage precision of chunk embeddings: float32, float16 or int8 (per-vector scale)
+EMBEDDING_PRECISION = os.getenv("EMBEDDING_PRECISION", "float32").lower()
+# Re-score the top EMBEDDING_RESCORE_FACTOR * k candidates with float32 vectors
+EMBEDDING_RESCORE = os.getenv("EMBEDDING_RESCORE", "false").lower() in ("1", "true", "yes")
+EMBEDDING_RESCORE_FACTOR = int(os.getenv("EMBEDDING_RESCORE_FACTOR", "4"))
+# Largest recall@k drop against float32 accepted by `bench.py precision`
+EMBEDDING_RECALL_TOLERANCE = float(os.getenv("EMBEDDING_RECALL_TOLERANCE", "0.02"))
 
 # Read API key
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -20,11 +85,321 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 NEO4J_URI = os.getenv("NEO4J_URL", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "your_password")
+# Connection pool of each Neo4j driver (sync and async)
+NEO4J_MAX_POOL_SIZE = int(os.getenv("NEO4J_MAX_POOL_SIZE", "100"))
+NEO4J_ACQUISITION_TIMEOUT = float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "30"))
+NEO4J_MAX_CONNECTION_LIFETIME = float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "3600"))
+# Serve /query with the async Neo4j and Ollama clients instead of the sync ones
+# in worker threads. Opt-in until `bench.py load` has been run against a live stack
+QUERY_ASYNC_CLIENTS = os.getenv("QUERY_ASYNC_CLIENTS", "false").lower() in ("1", "true", "yes")
+
+# Maximum number of concurrent requests sent to the Ollama host by this process
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "4"))
+
+# Persistent LLM response cache
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./cache/llm_cache.db")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# In-memory answer cache for /query; similarity matching of query embeddings
+# is enabled by a threshold above 0 (cosine, e.g. 0.95)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0"))
+
+# Canonicalization of extracted entity names before they are written.
+# Clustering of name embeddings is off (0) until a threshold has been
+# measured: the chunk embedding model scores short unrelated names high
+ENTITY_CANONICALIZATION = os.getenv("ENTITY_CANONICALIZATION", "true").lower() == "true"
+ENTITY_CLUSTER_THRESHOLD = float(os.getenv("ENTITY_CLUSTER_THRESHOLD", "0"))
+# Optional JSON object of normalized form -> canonical name extending the default aliases
+ENTITY_ALIASES_PATH = os.getenv("ENTITY_ALIASES_PATH")
+
+_models: Dict[str, Any] = {}
+_load_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_load(name: str, loader: Callable[[], Any]) -> Any:
+    """
+    Return the model registered under `name`, loading it on first use.
+    Concurrent callers wait for a single load; different models load independently.
+    """
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _registry_lock:
+        lock = _load_locks.setdefault(name, threading.Lock())
+    with lock:
+        model = _models.get(name)
+        if model is None:
+            t0 = time.perf_counter()
+            model = loader()
+            _models[name] = model
+            logger.info(f"Loaded {name} in {time.perf_counter() - t0:.2f}s")
+    return model
+
+
+def get_nlp():
+    """
+    The spaCy pipeline.
+    """
+    def load():
+        import spacy
+        return spacy.load(SPACY_MODEL)
+    return _get_or_load("spacy", load)
+
+
+def load_segmenter(engine: str):
+    """
+    Build the spaCy pipeline that sets sentence boundaries.
+
+    Args:
+        engine (str): "parser" runs tok2vec and the dependency parser of the
+        shared pipeline (see get_nlp), so boundaries match the full pipeline
+        exactly; "senter" runs only the model's sentence recognizer;
+        "sentencizer" is the rule-based splitter.
+
+    Returns:
+        Tuple[Language, List[str]]: The pipeline and the components to
+        disable when segmenting with it.
+    """
+    import spacy
+    if engine == "parser":
+        nlp = get_nlp()
+        return nlp, [name for name in nlp.pipe_names if name not in ("tok2vec", "parser")]
+    if engine == "senter":
+        nlp = spacy.load(SPACY_MODEL, enable=["senter"])
+        for name in list(nlp.component_names):
+            if name != "senter":
+                nlp.remove_pipe(name)
+        return nlp, []
+    if engine == "sentencizer":
+        nlp = spacy.blank("en")
+        nlp.add_pipe("sentencizer")
+        return nlp, []
+    raise ValueError(f"Unknown segmentation engine: {engine}")
+
+
+def get_segmenter():
+    """
+    The sentence segmentation pipeline and the components it runs without
+    (see SEGMENTATION_ENGINE and load_segmenter).
+    """
+    return _get_or_load("segmenter", lambda: load_segmenter(SEGMENTATION_ENGINE))
+
+
+def load_torch_embedder():
+    """
+    Load the SentenceTransformer embedding model.
+    """
+    from sentence_transformers import SentenceTransformer
+    if EMBEDDING_THREADS > 0:
+        import torch
+        torch.set_num_threads(EMBEDDING_THREADS)
+    return SentenceTransformer(EMBEDDING_MODEL_NAME, device=EMBEDDING_DEVICE)
+
+
+def load_onnx_embedder(quantize: bool = EMBEDDING_ONNX_QUANTIZE):
+    """
+    Load the ONNX Runtime embedding model, exporting it first if needed.
+    """
+    from onnx_embedder import OnnxEmbedder, export_onnx, model_dir
+    directory = model_dir(EMBEDDING_ONNX_PATH, EMBEDDING_MODEL_NAME)
+    filename = "model.int8.onnx" if quantize else "model.onnx"
+    if not os.path.exists(os.path.join(directory, filename)):
+        export_onnx(EMBEDDING_MODEL_NAME, directory, quantize=quantize)
+    return OnnxEmbedder(directory, quantized=quantize, threads=EMBEDDING_THREADS)
+
+
+def get_embedding_model():
+    """
+    The Legal-BERT sentence embedding model (see EMBEDDING_BACKEND).
+    """
+    def load():
+        if EMBEDDING_BACKEND == "onnx":
+            return load_onnx_embedder()
+        return load_torch_embedder()
+    return _get_or_load("embedding_model", load)
+
+
+def get_embedding_service():
+    """
+    The cached, micro-batched query encoder in front of the embedding model.
+    """
+    def load():
+        from embedding_service import EmbeddingService
+        return EmbeddingService(
+            get_embedding_model,
+            cache_size=QUERY_EMBEDDING_CACHE_SIZE,
+            batch_window_ms=QUERY_EMBEDDING_BATCH_WINDOW_MS,
+            max_batch_size=QUERY_EMBEDDING_MAX_BATCH,
+        )
+    return _get_or_load("embedding_service", load)
+
+
+def _driver_config() -> Dict[str, Any]:
+    return {
+        "auth": (NEO4J_USER, NEO4J_PASSWORD),
+        "max_connection_pool_size": NEO4J_MAX_POOL_SIZE,
+        "connection_acquisition_timeout": NEO4J_ACQUISITION_TIMEOUT,
+        "max_connection_lifetime": NEO4J_MAX_CONNECTION_LIFETIME,
+    }
+
+
+def get_driver():
+    """
+    The Neo4j driver.
+    """
+    return _get_or_load("neo4j_driver", lambda: GraphDatabase.driver(NEO4J_URI, **_driver_config()))
+
+
+def get_async_driver():
+    """
+    The async Neo4j driver, used by the request path. It belongs to the event
+    loop it is first used on (the server's).
+    """
+    return _get_or_load("neo4j_async_driver", lambda: AsyncGraphDatabase.driver(NEO4J_URI, **_driver_config()))
+
+
+def get_vector_store():
+    """
+    The configured chunk vector store (see VECTOR_BACKEND).
+    """
+    def load():
+        from vector_store import LocalVectorStore, Neo4jVectorStore
+        if VECTOR_BACKEND == "local":
+            return LocalVectorStore(
+                VECTOR_STORE_PATH,
+                hnsw_threshold=VECTOR_HNSW_THRESHOLD,
+                precision=EMBEDDING_PRECISION,
+                rescore=EMBEDDING_RESCORE,
+                rescore_factor=EMBEDDING_RESCORE_FACTOR,
+            )
+        return Neo4jVectorStore(get_driver)
+    return _get_or_load("vector_store", load)
+
+
+def get_lexical_index():
+    """
+    The BM25 index over chunk text.
+    """
+    def load():
+        from lexical_index import LexicalIndex
+        return LexicalIndex(LEXICAL_INDEX_PATH)
+    return _get_or_load("lexical_index", load)
+
+
+def get_llm_cache() -> Optional["LLMCache"]:
+    """
+    The persistent LLM response cache, or None when disabled.
+    """
+    if not LLM_CACHE_ENABLED:
+        return None
+    return _get_or_load(
+        "llm_cache",
+        lambda: LLMCache(LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES, ttl_seconds=LLM_CACHE_TTL_SECONDS),
+    )
+
+
+def get_answer_cache():
+    """
+    The /query answer cache, or None when disabled.
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None
+
+    def load():
+        from answer_cache import AnswerCache
+        return AnswerCache(
+            get_driver,
+            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+            similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+            encoder=lambda text: get_embedding_service().encode_query(text),
+        )
+    return _get_or_load("answer_cache", load)
+
+
+def get_entity_canonicalizer():
+    """
+    The entity name canonicalizer, or None when disabled.
+    """
+    if not ENTITY_CANONICALIZATION:
+        return None
+
+    def load():
+        from entity_canonicalizer import EntityCanonicalizer, load_aliases
+        return EntityCanonicalizer(
+            get_nlp,
+            lambda names: get_embedding_model().encode(names, convert_to_numpy=True, normalize_embeddings=True),
+            load_aliases(ENTITY_ALIASES_PATH),
+            similarity_threshold=ENTITY_CLUSTER_THRESHOLD,
+        )
+    return _get_or_load("entity_canonicalizer", load)
+
+
+def get_llm() -> "LocalLLM":
+    """
+    The local LLM client.
+    """
+    return _get_or_load("llm", lambda: LocalLLM(model_name=LLM_MODEL_NAME, cache=get_llm_cache()))
+
+
+def llm_text(prompt: str) -> str:
+    """
+    Completion of a prompt by the local LLM, with the model's reasoning removed.
+    """
+    response = get_llm().invoke(prompt)
+    text_out = response.content if isinstance(response.content, str) else str(response.content) #type:ignore
+    return _REASONING_PATTERN.sub("", text_out)
+
+
+_WARMUP_LOADERS: Dict[str, Callable[[], Any]] = {
+    "spacy": get_nlp,
+    "segmenter": get_segmenter,
+    "embedding_model": get_embedding_model,
+    "neo4j_driver": get_driver,
+    "vector_store": get_vector_store,
+    "llm": get_llm,
+}
+
+
+def warm_up(names: Optional[Iterable[str]] = None):
+    """
+    Load models ahead of their first use.
+
+    Args:
+        names (Optional[Iterable[str]]): Models to load, any of "spacy",
+        "segmenter", "embedding_model", "neo4j_driver", "vector_store" and
+        "llm". Loads all when omitted.
+    """
+    t0 = time.perf_counter()
+    for name in names or _WARMUP_LOADERS:
+        _WARMUP_LOADERS[name]()
+    logger.info(f"Warm-up finished in {time.perf_counter() - t0:.2f}s")
+
+
+def close():
+    """
+    Release the clients holding connections.
+    """
+    driver = _models.pop("neo4j_driver", None)
+    if driver is not None:
+        driver.close()
+
+
+async def aclose():
+    """
+    Release the async clients; run on the event loop that used them.
+    """
+    driver = _models.pop("neo4j_async_driver", None)
+    if driver is not None:
+        await driver.close()
 
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
 
 def test_neo4j_connection():
-    with driver.session() as session:
+    with get_driver().session() as session:
         result = session.run("RETURN 'Neo4j connection OK' AS msg")
         record = result.single()
         if record is not None:
@@ -33,6 +408,7 @@ def test_neo4j_connection():
             print("No result returned")
 
 # # ───── Gemini test ─────
+# from langchain_google_genai import ChatGoogleGenerativeAI
 # llm = ChatGoogleGenerativeAI(
 #     model="gemini-1.5-flash",
 #     temperature=0.2,
@@ -40,18 +416,119 @@ def test_neo4j_connection():
 # )
 
 class LocalLLM:
-    def __init__(self, model_name="deepseek-r1:7b"):
+    def __init__(self, model_name="deepseek-r1:7b", max_inflight=LLM_MAX_INFLIGHT, options=None, cache=None):
         self.client = OllamaClient()
         self.model_name = model_name
+        # Generation parameters forwarded to Ollama; part of the cache key
+        self.options = options
+        self.cache = cache
+        # Caps in-flight requests across every thread and coroutine sharing this client
+        self._inflight = threading.BoundedSemaphore(max(1, max_inflight))
+        # Async client, created on the event loop on first use
+        self._async_client = None
 
     def invoke(self, prompt: str):
-        response = self.client.generate(model=self.model_name, prompt=prompt)
+        key = make_key(self.model_name, prompt, self.options) if self.cache else None
+        content = self.cache.get(key) if self.cache else None
+
+        if content is None:
+            with self._inflight:
+                response = self.client.generate(model=self.model_name, prompt=prompt, options=self.options)
+            content = response['response'] #type:ignore
+            if self.cache:
+                self.cache.put(key, content) #type:ignore
+
         class Resp: pass
         r = Resp()
-        r.content = response['response'] #type:ignore
+        r.content = content #type:ignore
         return r
 
-llm = LocalLLM(model_name="deepseek-r1:7b")
+    def stream(self, prompt: str) -> Iterator[str]:
+        """
+        Yield the completion piece by piece as Ollama generates it.
+        Cached completions are yielded in one piece.
+
+        Generation runs in its own thread that buffers the pieces, so the
+        in-flight slot is released when Ollama finishes rather than when a
+        slow consumer has read the last piece.
+        """
+        key = make_key(self.model_name, prompt, self.options) if self.cache else None
+        cached = self.cache.get(key) if self.cache else None
+        if cached is not None:
+            yield cached
+            return
+
+        pieces: "queue.Queue" = queue.Queue()
+
+        def generate():
+            parts = []
+            try:
+                with self._inflight:
+                    for part in self.client.generate(model=self.model_name, prompt=prompt, options=self.options, stream=True):
+                        token = part['response'] #type:ignore
+                        parts.append(token)
+                        pieces.put(token)
+                # Only complete generations are cached
+                if self.cache:
+                    self.cache.put(key, "".join(parts)) #type:ignore
+            except Exception as e:
+                pieces.put(e)
+            pieces.put(_STREAM_END)
+
+        threading.Thread(target=generate, name="llm-stream", daemon=True).start()
+        while True:
+            piece = pieces.get()
+            if piece is _STREAM_END:
+                return
+            if isinstance(piece, Exception):
+                raise piece
+            yield piece
+
+    def _get_async_client(self):
+        if self._async_client is None:
+            self._async_client = AsyncOllamaClient()
+        return self._async_client
+
+    @contextlib.asynccontextmanager
+    async def _async_slot(self):
+        """
+        Hold one of the in-flight slots shared with the sync path. Waiting for
+        a free slot happens in a worker thread, not on the event loop.
+        """
+        if not self._inflight.acquire(blocking=False):
+            acquire = asyncio.ensure_future(asyncio.to_thread(self._inflight.acquire))
+            try:
+                await asyncio.shield(acquire)
+            except asyncio.CancelledError:
+                # The worker thread still takes the slot; hand it back once it has
+                acquire.add_done_callback(lambda _: self._inflight.release())
+                raise
+        try:
+            yield
+        finally:
+            self._inflight.release()
+
+    async def ainvoke(self, prompt: str):
+        """
+        Async variant of invoke. Waiting for Ollama does not hold a thread;
+        cache lookups run in a worker thread. Shares the LLM_MAX_INFLIGHT
+        budget with invoke and stream.
+        """
+        key = make_key(self.model_name, prompt, self.options) if self.cache else None
+        content = await asyncio.to_thread(self.cache.get, key) if self.cache else None
+
+        if content is None:
+            client = self._get_async_client()
+            async with self._async_slot():
+                response = await client.generate(model=self.model_name, prompt=prompt, options=self.options)
+            content = response['response'] #type:ignore
+            if self.cache:
+                await asyncio.to_thread(self.cache.put, key, content) #type:ignore
+
+        class Resp: pass
+        r = Resp()
+        r.content = content #type:ignore
+        return r
 
 
 if __name__ == "__main__":
@@ -59,5 +536,5 @@ if __name__ == "__main__":
     test_neo4j_connection()
 
     print("Testing Local LLM...")
-    response = llm.invoke("Explain what Neo4j is in one short sentence.")
+    response = get_llm().invoke("Explain what Neo4j is in one short sentence.")
     print("Local LLM says:", response.content) #type:ignore
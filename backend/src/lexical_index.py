@@ -0,0 +1,296 @@
+"""
+Lexical (BM25) index over chunk text.
+
+Dense retrieval ranks exact legal phrases ("binding arbitration", "class
+action waiver") below loosely related chunks. This inverted index scores
+chunks with Okapi BM25 over lowercased word tokens and adjacent word pairs,
+so exact phrases weigh in; retrieve.py fuses its ranking with the vector
+ranking (reciprocal rank fusion).
+
+The index lives in a single SQLite file. Postings are (term, row, tf)
+integer triples in a WITHOUT ROWID table clustered by term, so a query term
+is one range scan and integers are stored in their variable-length encoding.
+Chunks are added incrementally during ingestion; removed chunks are
+tombstoned and their postings purged once they make up a large enough share
+of the index.
+
+Several processes (the API server and the bulk_ingest CLI) may share the
+file: writes run in IMMEDIATE transactions that allocate rows in SQLite, and
+each process reloads its in-memory view of the chunks when another one has
+committed (PRAGMA data_version).
+"""
+
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Dropped from the index; pairs are formed over the remaining words
+STOPWORDS = frozenset(
+    """
+    a an and are as at be been but by can do for from has have if in into is it its
+    may of on or our shall such that the their then there these this those to was
+    we were which will with you your
+    """.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Index terms of a text: its words, minus stopwords, followed by each pair
+    of adjacent remaining words ("class action", "action waiver").
+    """
+    words = [word for word in _TOKEN_PATTERN.findall(text.lower()) if word not in STOPWORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class LexicalIndex:
+    """
+    Incrementally built BM25 index of chunk texts.
+
+    Args:
+        path (str): Directory holding the index file.
+        k1 (float): BM25 term frequency saturation.
+        b (float): BM25 length normalization.
+        purge_ratio (float): Share of tombstoned chunks above which their
+        postings are purged.
+    """
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75, purge_ratio: float = 0.25):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.purge_ratio = purge_ratio
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+        # Transactions are managed explicitly (see _transaction)
+        self._db = sqlite3.connect(
+            os.path.join(path, "lexical.db"), check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, term TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL,
+                doc_id TEXT,
+                length INTEGER NOT NULL,
+                alive INTEGER NOT NULL DEFAULT 1
+            );
+            CREATE INDEX IF NOT EXISTS chunks_chunk ON chunks (chunk_id);
+            CREATE TABLE IF NOT EXISTS postings (
+                term INTEGER NOT NULL,
+                row INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, row)
+            ) WITHOUT ROWID;
+            """
+        )
+        self._load()
+
+    def _load(self):
+        """
+        Rebuild the in-memory view of the chunk metadata from the file.
+        """
+        # Read first: a commit made while loading triggers another reload
+        self._data_version = self._read_data_version()
+        # Term ID cache, filled on lookup
+        self._term_ids: Dict[str, int] = {}
+        self._lengths: Dict[int, int] = {}
+        self._row_docs: Dict[int, Optional[str]] = {}
+        self._row_of: Dict[str, int] = {}
+        self._chunk_of: Dict[int, str] = {}
+        self._dead = 0
+        for row, chunk_id, doc_id, length, alive in self._db.execute(
+            "SELECT row, chunk_id, doc_id, length, alive FROM chunks"
+        ):
+            if alive:
+                self._add_row(row, chunk_id, doc_id, length)
+            else:
+                self._dead += 1
+        self._total_length = sum(self._lengths.values())
+
+    def _read_data_version(self) -> int:
+        return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _sync(self):
+        # data_version changes when another connection commits
+        if self._read_data_version() != self._data_version:
+            self._load()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Write transaction holding the database lock from the start, on an
+        in-memory view synced with the other writers.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._sync()
+                yield
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                # The in-memory view may hold the rolled back changes
+                self._load()
+                raise
+
+    def _add_row(self, row: int, chunk_id: str, doc_id: Optional[str], length: int):
+        self._lengths[row] = length
+        self._row_docs[row] = doc_id
+        self._row_of[chunk_id] = row
+        self._chunk_of[row] = chunk_id
+
+    @property
+    def size(self) -> int:
+        """
+        Number of indexed chunks.
+        """
+        with self._lock:
+            self._sync()
+            return len(self._row_of)
+
+    def chunk_ids(self) -> Set[str]:
+        """
+        IDs of the indexed chunks.
+        """
+        with self._lock:
+            self._sync()
+            return set(self._row_of)
+
+    def _lookup_term(self, term: str) -> Optional[int]:
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            row = self._db.execute("SELECT id FROM terms WHERE term = ?", (term,)).fetchone()
+            if row is not None:
+                term_id = self._term_ids[term] = row[0]
+        return term_id
+
+    def _term_id(self, term: str) -> int:
+        term_id = self._lookup_term(term)
+        if term_id is None:
+            term_id = self._db.execute("INSERT INTO terms (term) VALUES (?)", (term,)).lastrowid
+            self._term_ids[term] = term_id  # type: ignore
+        return term_id  # type: ignore
+
+    def _tombstone(self, chunk_ids: Sequence[str]):
+        rows = [self._row_of.pop(chunk_id) for chunk_id in chunk_ids if chunk_id in self._row_of]
+        for row in rows:
+            self._total_length -= self._lengths.pop(row)
+            del self._row_docs[row], self._chunk_of[row]
+        if rows:
+            self._db.executemany("UPDATE chunks SET alive = 0 WHERE row = ?", [(row,) for row in rows])
+            self._dead += len(rows)
+
+    def _maybe_purge(self):
+        if self._dead and self._dead > self.purge_ratio * (self._dead + len(self._row_of)):
+            self._db.execute("DELETE FROM postings WHERE row IN (SELECT row FROM chunks WHERE alive = 0)")
+            self._db.execute("DELETE FROM chunks WHERE alive = 0")
+            logger.info(f"Purged the postings of {self._dead} removed chunks from the lexical index")
+            self._dead = 0
+
+    def add(self, chunk_ids: Sequence[str], texts: Sequence[str], doc_id: Optional[str] = None):
+        """
+        Index (or re-index) chunks.
+        """
+        if len(chunk_ids) == 0:
+            return
+        with self._transaction():
+            # Re-indexed chunks get a fresh row
+            self._tombstone(chunk_ids)
+            postings = []
+            for chunk_id, text in zip(chunk_ids, texts):
+                # Document length counts words, not pairs
+                length = len(_TOKEN_PATTERN.findall(text.lower()))
+                row = self._db.execute(
+                    "INSERT INTO chunks (chunk_id, doc_id, length) VALUES (?, ?, ?)", (chunk_id, doc_id, length)
+                ).lastrowid
+                postings.extend((self._term_id(term), row, tf) for term, tf in Counter(tokenize(text)).items())
+                self._add_row(row, chunk_id, doc_id, length)  # type: ignore
+                self._total_length += length
+            self._db.executemany("INSERT INTO postings (term, row, tf) VALUES (?, ?, ?)", postings)
+            self._maybe_purge()
+
+    def delete(self, chunk_ids: Sequence[str]):
+        """
+        Remove chunks from the index.
+        """
+        with self._transaction():
+            self._tombstone(chunk_ids)
+            self._maybe_purge()
+
+    def delete_document(self, doc_id: str):
+        """
+        Remove every chunk of a document from the index.
+        """
+        with self._transaction():
+            self._tombstone([self._chunk_of[row] for row, d in self._row_docs.items() if d == doc_id])
+            self._maybe_purge()
+
+    def clear(self):
+        """
+        Remove everything from the index.
+        """
+        with self._transaction():
+            self._db.execute("DELETE FROM postings")
+            self._db.execute("DELETE FROM chunks")
+            self._db.execute("DELETE FROM terms")
+            self._term_ids.clear()
+            self._lengths.clear()
+            self._row_docs.clear()
+            self._row_of.clear()
+            self._chunk_of.clear()
+            self._total_length = 0
+            self._dead = 0
+
+    def search(self, query: str, k: int, doc_id: Optional[str] = None) -> List[Tuple[str, float]]:
+        """
+        Find the k chunks with the highest BM25 score for the query.
+
+        Args:
+            query (str): Query text.
+            k (int): Number of chunks to return.
+            doc_id (Optional[str]): Restrict the search to one document.
+
+        Returns:
+            List[Tuple[str, float]]: (chunk_id, score) pairs, best first.
+        """
+        with self._lock:
+            self._sync()
+            n = len(self._row_of)
+            if n == 0:
+                return []
+            avg_length = self._total_length / n or 1.0
+            scores: Dict[int, float] = {}
+            for term in set(tokenize(query)):
+                term_id = self._lookup_term(term)
+                if term_id is None:
+                    continue
+                postings = [
+                    (row, tf)
+                    for row, tf in self._db.execute("SELECT row, tf FROM postings WHERE term = ?", (term_id,))
+                    if row in self._lengths
+                ]
+                if not postings:
+                    continue
+                # Document frequency over the whole corpus, also for scoped searches
+                idf = math.log(1.0 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for row, tf in postings:
+                    if doc_id is not None and self._row_docs[row] != doc_id:
+                        continue
+                    norm = self.k1 * (1.0 - self.b + self.b * self._lengths[row] / avg_length)
+                    scores[row] = scores.get(row, 0.0) + idf * tf * (self.k1 + 1.0) / (tf + norm)
+            best = sorted(scores.items(), key=lambda item: -item[1])[:k]
+            return [(self._chunk_of[row], score) for row, score in best]
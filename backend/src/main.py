@@ -5,30 +5,139 @@ This module instantiates the FastAPI application, configures CORS middleware, ma
 all required endpoints with different functionalities that are required for the application.
 """
 
+import asyncio
 import logging
+import time
 import uuid
 import os
 import json
 import shutil
+import threading
 
 from datetime import datetime
-from ingest import ingest as ingested
+from ingest import (
+    ingest as ingested, new_document_id, list_documents, delete_document, rebuild_vector_store,
+    sync_lexical_index, INGEST_STAGE_WEIGHTS,
+)
+from typing import List, Optional
 
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
-from langchain_setup import test_neo4j_connection
-from models import ChatOut, QueryIn
-from retrieve import generate_initial_analysis, get_similar_chunks, generate_rag_response
+from langchain_setup import (
+    test_neo4j_connection, get_answer_cache, get_driver, get_embedding_service, get_llm_cache, get_vector_store, warm_up,
+    QUERY_ASYNC_CLIENTS, RETRIEVAL_MODE,
+    aclose as aclose_clients, close as close_clients,
+)
+from bulk_ingest import BULK_INGEST_ROOT, bulk_ingest
+from jobs import JobManager, SUCCEEDED, FAILED
+from schema import ensure_schema
+from models import BulkIngestIn, ChatOut, DocumentOut, JobOut, QueryIn
+from retrieve import (
+    agenerate_rag_response, aget_similar_chunks, generate_rag_response, get_similar_chunks, stream_rag_response,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+_process_start = time.perf_counter()
+
+# Load models at startup rather than on first use
+WARMUP_MODELS = os.getenv("WARMUP_MODELS", "false").lower() == "true"
+
 # Set the upload directory for the various ToS uploads
 UPLOAD_DIR = "./uploads"
 
+# Background ingestion jobs
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(UPLOAD_DIR, "jobs.db"))
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "2"))
+
+# Chunks retrieved per query
+QUERY_TOP_K = int(os.getenv("QUERY_TOP_K", "10"))
+
+
+def _retrieval_variant(q: QueryIn) -> str:
+    """
+    Answer cache variant of a query: the retrieval settings its answer depends on.
+    """
+    return f"{q.mode or RETRIEVAL_MODE}:{QUERY_TOP_K}"
+
+
+# Whether the lexical index was reconciled with Neo4j in this process
+_lexical_index_synced = False
+_lexical_sync_lock = threading.Lock()
+
+
+def ensure_lexical_index(mode: Optional[str]):
+    """
+    Reconcile the lexical index with the chunks stored in Neo4j before the
+    first lexical or hybrid retrieval of this process, so a request asking
+    for one of these modes does not search a stale index while the default
+    mode is "vector".
+    """
+    global _lexical_index_synced
+    if _lexical_index_synced or (mode or RETRIEVAL_MODE) == "vector":
+        return
+    with _lexical_sync_lock:
+        if not _lexical_index_synced:
+            # Chunks written by other processes, before the index existed or
+            # lost in a crash between the graph and index writes
+            sync_lexical_index()
+            _lexical_index_synced = True
+
+
+def run_ingest_job(params: dict, progress):
+    """
+    Job handler running the ingestion pipeline for an uploaded file.
+    """
+    json_analysis = ingested(
+        params["filepath"], doc_id=params["doc_id"], source=params.get("source"), progress=progress
+    )
+    return json.loads(json_analysis)
+
+
+def run_bulk_ingest_job(params: dict, progress):
+    """
+    Job handler ingesting every file of a corpus directory.
+    """
+    return bulk_ingest(
+        params["root"],
+        extract=params.get("extract", True),
+        on_progress=lambda done, total: progress("ingest", done / total if total else 1.0),
+        corpus_root=params.get("corpus_root"),
+    )
+
+
+def create_job_manager() -> JobManager:
+    """
+    Job manager with the ingestion handlers registered. Created on startup,
+    so importing this module does not create the jobs database.
+    """
+    manager = JobManager(JOBS_DB_PATH, workers=INGEST_JOB_WORKERS)
+    manager.register("ingest", run_ingest_job, INGEST_STAGE_WEIGHTS)
+    manager.register("bulk_ingest", run_bulk_ingest_job, {"ingest": 1.0})
+    return manager
+
+
+# Set by the lifespan handler
+job_manager: Optional[JobManager] = None
+
+
+def save_upload(file: UploadFile) -> str:
+    """
+    Saves an uploaded file under a unique name and returns its path.
+    """
+    ext = os.path.splitext(file.filename)[1]  # type: ignore
+    dest = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}{ext}")
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    with open(dest, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+    logger.info(f"File {file.filename} saved as {dest}")
+    return dest
+
 # -----------------------------
 # Lifespan handler
 # -----------------------------
@@ -37,15 +146,39 @@ async def check_neo4j(app: FastAPI):
     """
     Startup event to check connection to Neo4j database.
     Calls the test_connection function from the langchain_setup script,
-    and prints the status to the container logs.
+    and prints the status to the container logs, then creates the missing
+    constraints and indexes. With WARMUP_MODELS set,
+    models are loaded before the first request instead of on first use.
+    Finally it starts the job manager and resumes the unfinished jobs.
     """
+    global job_manager
     try:
         test_neo4j_connection()
         logger.info("✅ Neo4j connection established.")
+        await asyncio.to_thread(ensure_schema, get_driver())
     except Exception as e:
         logger.error(f"❌ Neo4j connection failed: {e}")
+    if WARMUP_MODELS:
+        await asyncio.to_thread(warm_up)
+    try:
+        store = get_vector_store()
+        # An empty in-process index is filled from the embeddings stored in Neo4j
+        if not store.in_graph and store.size == 0:
+            await asyncio.to_thread(rebuild_vector_store)
+    except Exception as e:
+        logger.error(f"Failed to load the vector store: {e}")
+    if RETRIEVAL_MODE != "vector":
+        try:
+            await asyncio.to_thread(ensure_lexical_index, RETRIEVAL_MODE)
+        except Exception as e:
+            logger.error(f"Failed to load the lexical index: {e}")
+    logger.info(f"Startup complete in {time.perf_counter() - _process_start:.2f}s")
+    job_manager = create_job_manager()
+    job_manager.resume()
     yield
-    # (You could close the driver here if you have a global driver instance)
+    job_manager.shutdown()
+    await aclose_clients()
+    close_clients()
 
 
 # -----------------------------
@@ -60,8 +193,9 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173", "http://localhost:3000"],
     allow_credentials=True,
-    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
     allow_headers=["Content-Type", "Accept"],
+    expose_headers=["X-Document-Id"],
 )
 
 
@@ -81,21 +215,20 @@ def get_root():
 
 
 @app.post("/ingest")
-def ingest(file: UploadFile = File(...)):
+def ingest(response: Response, file: UploadFile = File(...), doc_id: Optional[str] = Form(None)):
     """
     Ingestion endpoint of the API.
     Uploads a document, assigns it a unique identifier, and saves it.
+    Each upload becomes a new document unless an existing doc_id is passed,
+    in which case only the chunks that changed are re-processed. The
+    document ID is returned in the X-Document-Id header.
     """
 
-    doc_id = str(uuid.uuid4())
     try:
-        ext = os.path.splitext(file.filename)[1]  # type: ignore
-        dest = os.path.join(UPLOAD_DIR, f"{doc_id}{ext}")
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        with open(dest, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        logger.info(f"File {file.filename} saved as {dest}")
-        json_analysis = ingested(dest)
+        dest = save_upload(file)
+        doc_id = doc_id or new_document_id(file.filename)  # type: ignore
+        json_analysis = ingested(dest, doc_id=doc_id, source=file.filename)
+        response.headers["X-Document-Id"] = doc_id
         analysis_data = json.loads(json_analysis)
         return analysis_data
 
@@ -106,19 +239,111 @@ def ingest(file: UploadFile = File(...)):
         logger.error(f"Failed to ingest file: {e}")
         raise HTTPException(status_code=422, detail=str(e))
 
+@app.post("/ingest/jobs", status_code=202)
+def submit_ingest_job(file: UploadFile = File(...), doc_id: Optional[str] = Form(None)):
+    """
+    Background ingestion endpoint of the API.
+    Saves the uploaded document and queues its ingestion, returning a job ID
+    right away. Progress is reported by GET /ingest/jobs/{job_id}. As with
+    /ingest, a new document is created unless doc_id is passed.
+    """
+    try:
+        dest = save_upload(file)
+    except Exception as e:
+        logger.error(f"Failed to save upload: {e}")
+        raise HTTPException(status_code=422, detail=str(e))
+
+    doc_id = doc_id or new_document_id(file.filename)  # type: ignore
+    job_id = job_manager.submit("ingest", {"filepath": dest, "doc_id": doc_id, "source": file.filename})  # type: ignore
+    return {"job_id": job_id, "doc_id": doc_id}
+
+
+@app.post("/ingest/bulk", status_code=202)
+def submit_bulk_ingest_job(request: BulkIngestIn):
+    """
+    Bulk ingestion endpoint of the API.
+    Queues the ingestion of every pdf, html and txt file under a directory
+    of BULK_INGEST_ROOT. The job result reports docs/sec, per-stage timings
+    and the files that failed.
+    """
+    root = os.path.realpath(BULK_INGEST_ROOT)
+    path = os.path.realpath(os.path.join(root, request.path))
+    if os.path.commonpath([root, path]) != root:
+        raise HTTPException(status_code=400, detail="Path must be inside the bulk ingestion root")
+    if not os.path.isdir(path):
+        raise HTTPException(status_code=404, detail=f"Directory {request.path} not found")
+
+    job_id = job_manager.submit("bulk_ingest", {"root": path, "corpus_root": root, "extract": request.extract})  # type: ignore
+    return {"job_id": job_id}
+
+
+@app.get("/ingest/jobs/{job_id}", response_model=JobOut)
+def ingest_job_status(job_id: str):
+    """
+    Reports the stage, percent complete and per-stage timings of a job.
+    """
+    job = job_manager.get(job_id)  # type: ignore
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@app.get("/ingest/jobs/{job_id}/result")
+def ingest_job_result(job_id: str):
+    """
+    Returns the result of a finished job: the analysis for an ingestion job,
+    the run report for a bulk ingestion job.
+    """
+    job = job_manager.get(job_id)  # type: ignore
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if job["status"] == FAILED:
+        raise HTTPException(status_code=422, detail=job["error"])
+    if job["status"] != SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job['status']}")
+    return job_manager.result(job_id)  # type: ignore
+
+
 @app.post("/query")
-def query(q: QueryIn):
+async def query(q: QueryIn):
     """
     Querying endpoint of the RAG API.
     This endpoint queries the LLM, which uses RAG to give accurate answers.
+    Answers are cached per document version, so repeated questions skip
+    retrieval and generation. With QUERY_ASYNC_CLIENTS, retrieval and
+    generation run on the event loop with the async Neo4j and Ollama clients,
+    so waiting queries do not hold threads; otherwise the sync clients run in
+    worker threads.
     """
     try:
-        retrieved_chunks = get_similar_chunks(q.query, k = 10)
+        answer_cache = get_answer_cache()
+        variant = _retrieval_variant(q)
+        cached, scope = (
+            await asyncio.to_thread(answer_cache.get, q.query, q.doc_id, variant) if answer_cache else (None, None)
+        )
+        if cached is not None:
+            return ChatOut(**cached)
+
+        if not _lexical_index_synced:
+            await asyncio.to_thread(ensure_lexical_index, q.mode)
+        if QUERY_ASYNC_CLIENTS:
+            retrieved_chunks = await aget_similar_chunks(q.query, k = QUERY_TOP_K, doc_id=q.doc_id, mode=q.mode)
+        else:
+            retrieved_chunks = await asyncio.to_thread(
+                get_similar_chunks, q.query, k = QUERY_TOP_K, doc_id=q.doc_id, mode=q.mode
+            )
         if not retrieved_chunks:
             return []
 
-        response = generate_rag_response(q.query, retrieved_chunks)
+        if QUERY_ASYNC_CLIENTS:
+            response = await agenerate_rag_response(q.query, retrieved_chunks)
+        else:
+            response = await asyncio.to_thread(generate_rag_response, q.query, retrieved_chunks)
 
+        if answer_cache:
+            await asyncio.to_thread(
+                answer_cache.put, q.query, scope, {"chunks": retrieved_chunks, "response": response}, variant
+            )
         return ChatOut(chunks= retrieved_chunks, response= response)
 
     except json.JSONDecodeError as e:
@@ -127,3 +352,91 @@ def query(q: QueryIn):
     except Exception as e:
         logger.error(f"Query failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def sse_event(event: str, data) -> str:
+    """
+    Formats a server-sent event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/query/stream")
+def query_stream(q: QueryIn):
+    """
+    Streaming variant of the querying endpoint, using server-sent events.
+    The retrieved chunks are sent first as a `chunks` event, followed by the
+    response as `token` events and a final `done` event. A cached answer is
+    sent as a single `token` event.
+    """
+    try:
+        answer_cache = get_answer_cache()
+        variant = _retrieval_variant(q)
+        cached, scope = answer_cache.get(q.query, q.doc_id, variant) if answer_cache else (None, None)
+        if not cached:
+            ensure_lexical_index(q.mode)
+        retrieved_chunks = (
+            cached["chunks"] if cached
+            else get_similar_chunks(q.query, k = QUERY_TOP_K, doc_id=q.doc_id, mode=q.mode)
+        )
+    except Exception as e:
+        logger.error(f"Query failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    def events():
+        yield sse_event("chunks", retrieved_chunks)
+        if cached:
+            yield sse_event("token", cached["response"])
+        elif retrieved_chunks:
+            tokens = []
+            try:
+                for token in stream_rag_response(q.query, retrieved_chunks):
+                    tokens.append(token)
+                    yield sse_event("token", token)
+                if answer_cache:
+                    answer_cache.put(
+                        q.query, scope, {"chunks": retrieved_chunks, "response": "".join(tokens)}, variant
+                    )
+            except Exception as e:
+                logger.error(f"Streaming query failed: {e}")
+                yield sse_event("error", str(e))
+        yield sse_event("done", None)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/documents", response_model=List[DocumentOut])
+def documents():
+    """
+    Lists the ingested documents.
+    """
+    return list_documents()
+
+
+@app.delete("/documents/{doc_id}")
+def remove_document(doc_id: str):
+    """
+    Deletes a document and everything extracted from it.
+    """
+    if not delete_document(doc_id):
+        raise HTTPException(status_code=404, detail=f"Document {doc_id} not found")
+    return {"deleted": doc_id}
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """
+    Reports hit/miss counters of the LLM response cache, the answer cache
+    and the query embedding service.
+    """
+    llm_cache = get_llm_cache()
+    answer_cache = get_answer_cache()
+    return {
+        "llm": llm_cache.stats() if llm_cache else None,
+        "answers": answer_cache.stats() if answer_cache else None,
+        "query_embeddings": get_embedding_service().stats(),
+    }
@@ -5,12 +5,19 @@ This file defines the various input and output models that
 are used by the API.
 """
 
-from typing import List, Dict, Optional
+from typing import List, Dict, Literal, Optional
 
 from pydantic import BaseModel
 
 class QueryIn(BaseModel):
     query: str
+    doc_id: Optional[str] = None
+    # Retrieval mode; the server's RETRIEVAL_MODE when omitted
+    mode: Optional[Literal["vector", "lexical", "hybrid"]] = None
+
+class BulkIngestIn(BaseModel):
+    path: str = "."
+    extract: bool = True
 
 class QueryOut(BaseModel):
     clause_text: str
@@ -21,3 +28,22 @@ class QueryOut(BaseModel):
 class ChatOut(BaseModel):
     chunks: List[Dict]
     response: str
+
+class DocumentOut(BaseModel):
+    doc_id: str
+    source: Optional[str] = None
+    updated_at: Optional[str] = None
+    version: Optional[str] = None
+    chunks: int
+
+class JobOut(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    stage: Optional[str] = None
+    percent: float
+    timings: Dict[str, float]
+    params: Dict
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
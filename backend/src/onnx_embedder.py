@@ -0,0 +1,182 @@
+"""
+ONNX Runtime backend for the sentence embedding model.
+
+The SentenceTransformer's transformer is exported once to ONNX (optionally
+with dynamic int8 quantization of the weights) next to its tokenizer and
+pooling settings, then served by ONNX Runtime. OnnxEmbedder exposes the
+subset of the SentenceTransformer interface the rest of the code uses
+(`encode`, `get_sentence_embedding_dimension`, `tokenizer`), so it can be
+returned by get_embedding_model() in place of the PyTorch model.
+
+Requires the optional onnx and onnxruntime packages.
+"""
+
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_MODEL_FILE = "model.onnx"
+_QUANTIZED_FILE = "model.int8.onnx"
+_CONFIG_FILE = "embedder.json"
+_INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+def model_dir(root: str, model_name: str) -> str:
+    """
+    Directory holding the exported files of a model.
+    """
+    return os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+
+
+def export_onnx(model_name: str, out_dir: str, quantize: bool = False, opset: int = 14) -> str:
+    """
+    Export a SentenceTransformer model to ONNX.
+
+    Args:
+        model_name (str): Name or path of the SentenceTransformer model.
+        out_dir (str): Directory receiving the ONNX graph, tokenizer and config.
+        quantize (bool): Also write a copy with int8 dynamically quantized weights.
+        opset (int): ONNX opset version.
+
+    Returns:
+        str: Path of the model to load (the quantized one when `quantize`).
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+
+    os.makedirs(out_dir, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer = st[0]
+    pooling = next(module for module in st if isinstance(module, models.Pooling))
+
+    class _Encoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.model(
+                input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+            )[0]
+
+    dummy = transformer.tokenizer(["Export sample sentence."], return_tensors="pt")
+    path = os.path.join(out_dir, _MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            _Encoder(transformer.auto_model).eval(),
+            tuple(dummy[name] for name in _INPUT_NAMES),
+            path,
+            input_names=_INPUT_NAMES,
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                **{name: {0: "batch", 1: "sequence"} for name in _INPUT_NAMES},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=opset,
+        )
+    transformer.tokenizer.save_pretrained(out_dir)
+    with open(os.path.join(out_dir, _CONFIG_FILE), "w") as f:
+        json.dump(
+            {
+                "model_name": model_name,
+                "pooling": pooling.get_pooling_mode_str(),
+                "normalize": any(isinstance(module, models.Normalize) for module in st),
+                "max_seq_length": st.max_seq_length,
+                "dim": st.get_sentence_embedding_dimension(),
+            },
+            f,
+        )
+    logger.info(f"Exported {model_name} to {path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantized = os.path.join(out_dir, _QUANTIZED_FILE)
+        quantize_dynamic(path, quantized, weight_type=QuantType.QInt8)
+        logger.info(f"Quantized {model_name} to {quantized}")
+        return quantized
+    return path
+
+
+class OnnxEmbedder:
+    """
+    Sentence embedder running an exported model under ONNX Runtime.
+
+    Args:
+        model_dir (str): Directory written by export_onnx().
+        quantized (bool): Load the int8 quantized graph.
+        threads (int): Intra-op threads. 0 keeps ONNX Runtime's default.
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = False, threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, _CONFIG_FILE)) as f:
+            self.config: Dict = json.load(f)
+        self.max_seq_length = self.config["max_seq_length"]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        path = os.path.join(model_dir, _QUANTIZED_FILE if quantized else _MODEL_FILE)
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self._inputs = [i.name for i in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def _pool(self, hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        mode = self.config["pooling"]
+        if mode == "cls":
+            return hidden[:, 0]
+        if mode == "max":
+            return np.where(mask[..., None] > 0, hidden, -1e9).max(axis=1)
+        if mode == "mean":
+            mask = mask[..., None].astype(np.float32)
+            return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        raise ValueError(f"Unsupported pooling mode: {mode}")
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = 32,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+        **_,
+    ) -> np.ndarray:
+        """
+        Encode sentences like SentenceTransformer.encode.
+
+        Returns:
+            np.ndarray: (n, dim) float32 embeddings, or (dim,) for a single string.
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        out = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        batch_size = max(1, batch_size)
+
+        for start in range(0, len(texts), batch_size):
+            features = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feeds = {name: features[name].astype(np.int64) for name in self._inputs if name in features}
+            if "token_type_ids" in self._inputs and "token_type_ids" not in feeds:
+                feeds["token_type_ids"] = np.zeros_like(feeds["input_ids"])
+            hidden = self.session.run(None, feeds)[0]
+            out[start:start + len(hidden)] = self._pool(hidden, features["attention_mask"])
+
+        if normalize_embeddings or self.config["normalize"]:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
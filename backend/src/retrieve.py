@@ -2,37 +2,237 @@
 Retrieval and RAG utilities for Terms of Service documents.
 Combines vector DB retrieval and KG triples for context-aware LLM responses.
 """
+import asyncio
 import json
-from typing import List, Dict
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, List, Dict, Optional, Tuple
 import re
-from langchain_setup import driver, embedding_model, llm
+from langchain_setup import (
+    HYBRID_CANDIDATE_FACTOR,
+    RETRIEVAL_MODE,
+    RRF_K,
+    get_async_driver,
+    get_driver,
+    get_embedding_service,
+    get_lexical_index,
+    get_llm,
+    get_vector_store,
+    llm_text,
+)
+from text_processor import estimate_tokens
+
+# Approximate document tokens per analysis window, and windows analyzed concurrently
+ANALYSIS_WINDOW_TOKENS = int(os.getenv("ANALYSIS_WINDOW_TOKENS", "1500"))
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+
+
+# Collects the triples of `found_chunk` as [subject, relation, object] lists.
+# Canonical entities (User, Company) are mentioned by many chunks, so the
+# relationship itself must come from the chunk, not just its object
+_TRIPLES_SUBQUERY = """
+CALL {
+    WITH found_chunk
+    OPTIONAL MATCH (sub:Entity)-[rel]->(obj:Entity)-[:MENTIONED_IN]->(found_chunk)
+    WHERE rel.chunk_id = found_chunk.id
+    RETURN [t IN collect([sub.name, type(rel), obj.name]) WHERE t[0] IS NOT NULL] AS triples
+}
+"""
+
+
+def fetch_triples_for_chunks(chunk_ids: List[str], session=None) -> Dict[str, List[List[str]]]:
+    """
+    Fetch the KG triples of several chunks with a single query.
+
+    Args:
+        chunk_ids (List[str]): IDs of the chunks.
+        session: Optional open Neo4j session to run the query on.
+
+    Returns:
+        Dict[str, List[List[str]]]: Chunk ID -> [subject, relation, object] triples.
+    """
+    if not chunk_ids:
+        return {}
+
+    def run(s):
+        result = s.run(
+            """
+            UNWIND $chunk_ids AS chunk_id
+            MATCH (sub:Entity)-[rel]->(obj:Entity)-[:MENTIONED_IN]->(c:Chunk {id: chunk_id})
+            WHERE rel.chunk_id = chunk_id
+            RETURN chunk_id, collect([sub.name, type(rel), obj.name]) AS triples
+            """,
+            chunk_ids=list(chunk_ids)
+        )
+        return {record["chunk_id"]: record["triples"] for record in result}
+
+    if session is not None:
+        found = run(session)
+    else:
+        with get_driver().session() as s:
+            found = run(s)
+    return {chunk_id: found.get(chunk_id, []) for chunk_id in chunk_ids}
+
+
+def enrich_chunks(chunks: List[Dict]) -> List[List[str]]:
+    """
+    Formatted triples for each chunk, in order. Chunks that already carry
+    their triples (from get_similar_chunks) are not looked up again; the rest
+    are fetched in one batched query.
+
+    Args:
+        chunks (List[Dict]): Chunks with at least a chunk_id.
+
+    Returns:
+        List[List[str]]: "(subject, relation, object)" strings per chunk.
+    """
+    missing = [chunk["chunk_id"] for chunk in chunks if "triples" not in chunk]
+    fetched = fetch_triples_for_chunks(missing)
+    return [
+        [f"({s}, {r}, {o})" for s, r, o in (chunk["triples"] if "triples" in chunk else fetched[chunk["chunk_id"]])]
+        for chunk in chunks
+    ]
 
 
-def get_similar_chunks(query_text: str, k: int = 5) -> List[Dict]:
+def _similar_chunks_query(query_embedding, k: int, doc_id: Optional[str], hits=None):
     """
-    Perform vector similarity search to find relevant chunks.
+    Cypher query and parameters returning the retrieved chunks with their
+    triples. `hits` are the (chunk_id, score) results of an in-process search
+    (vector store, lexical index or their fusion), for which Neo4j only
+    supplies the text and triples.
+    """
+    if hits is not None:
+        return (
+            """
+            UNWIND $hits AS hit
+            MATCH (found_chunk:Chunk {id: hit.chunk_id})
+            WITH found_chunk, hit.score AS score
+            """ + _TRIPLES_SUBQUERY + """
+            RETURN found_chunk.text AS text, found_chunk.id AS chunk_id, score, triples
+            ORDER BY score DESC
+            """,
+            {"hits": [{"chunk_id": chunk_id, "score": score} for chunk_id, score in hits]},
+        )
+    if doc_id is None:
+        return (
+            """
+            CALL db.index.vector.queryNodes('chunk_embeddings', $k, $query_embedding)
+            YIELD node AS found_chunk, score
+            """ + _TRIPLES_SUBQUERY + """
+            RETURN found_chunk.text AS text, found_chunk.id AS chunk_id, score, triples
+            ORDER BY score DESC
+            """,
+            # safer to convert to list for Neo4j
+            {"k": k, "query_embedding": query_embedding.tolist()},
+        )
+    # Exact search over the document's own chunks; same score scale as the index
+    return (
+        """
+        MATCH (:Document {id: $doc_id})-[:HAS_CHUNK]->(found_chunk:Chunk)
+        WITH found_chunk, vector.similarity.cosine(found_chunk.embedding, $query_embedding) AS score
+        ORDER BY score DESC
+        LIMIT $k
+        """ + _TRIPLES_SUBQUERY + """
+        RETURN found_chunk.text AS text, found_chunk.id AS chunk_id, score, triples
+        ORDER BY score DESC
+        """,
+        {"doc_id": doc_id, "k": k, "query_embedding": query_embedding.tolist()},
+    )
+
+
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+
+
+def fuse_rankings(rankings: List[List[Tuple[str, float]]], k: int, rrf_k: int = RRF_K) -> List[Tuple[str, float]]:
+    """
+    Reciprocal rank fusion: each chunk scores sum(1 / (rrf_k + rank)) over
+    the rankings it appears in (rank starting at 1), so scores on different
+    scales (cosine, BM25) can be combined.
+
+    Args:
+        rankings (List[List[Tuple[str, float]]]): (chunk_id, score) lists, best first.
+        k (int): Number of fused results.
+        rrf_k (int): Rank constant damping the weight of the top ranks.
+
+    Returns:
+        List[Tuple[str, float]]: (chunk_id, fused score) pairs, best first.
+    """
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])[:k]
+
+
+def _check_mode(mode: Optional[str]) -> str:
+    mode = (mode or RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+    return mode
+
+
+def _lexical_hits(query_text: str, mode: str, k: int, doc_id: Optional[str]) -> Optional[List[Tuple[str, float]]]:
+    if mode == "vector":
+        return None
+    return get_lexical_index().search(query_text, k if mode == "lexical" else k * HYBRID_CANDIDATE_FACTOR, doc_id)
+
+
+def _retrieval_hits(mode: str, k: int, vector_hits, lexical_hits):
+    """
+    The (chunk_id, score) hits the graph query is run on, or None to let
+    Neo4j run the vector search itself.
+    """
+    if mode == "lexical":
+        return lexical_hits
+    if mode == "hybrid":
+        return fuse_rankings([vector_hits, lexical_hits], k)
+    return vector_hits
+
+
+def get_similar_chunks(
+    query_text: str, k: int = 5, doc_id: Optional[str] = None, mode: Optional[str] = None
+) -> List[Dict]:
+    """
+    Perform similarity search to find relevant chunks.
+
+    The vector search runs on the configured vector store (Neo4j index or
+    in-process index), the lexical search on the BM25 index over chunk text;
+    in hybrid mode both rankings are fused with reciprocal rank fusion. The
+    KG triples of each retrieved chunk are fetched in the same query as the
+    chunk text, so the chunks can be passed on to the RAG prompt without
+    further lookups.
 
     Args:
         query_text (str): User query.
         k (int): Number of top chunks to retrieve.
+        doc_id (Optional[str]): Restrict the search to one document. Searches
+        across all documents when omitted.
+        mode (Optional[str]): "vector", "lexical" or "hybrid". Defaults to
+        RETRIEVAL_MODE.
 
     Returns:
-        List[Dict]: Retrieved chunks with text, score, and chunk_id.
+        List[Dict]: Retrieved chunks with text, score, chunk_id and triples.
+        The score is the cosine score in vector mode, BM25 in lexical mode and
+        the fused score in hybrid mode.
     """
+    mode = _check_mode(mode)
     try:
-        # Encode query to vector
-        query_embedding = embedding_model.encode(query_text, convert_to_numpy=True)
-
-        with driver.session() as session:
-            result = session.run(
-                """
-                CALL db.index.vector.queryNodes('chunk_embeddings', $k, $query_embedding)
-                YIELD node AS found_chunk, score
-                RETURN found_chunk.text AS text, found_chunk.id AS chunk_id, score
-                """,
-                k=k,
-                query_embedding=query_embedding.tolist(),  # safer to convert to list for Neo4j
-            )
+        query_embedding = None
+        vector_hits = None
+        if mode != "lexical":
+            query_embedding = get_embedding_service().encode_query(query_text)
+            store = get_vector_store()
+            # Vectors are searched in-process unless the store is the Neo4j index,
+            # which only has to be queried separately when its ranking is fused
+            if not store.in_graph or mode == "hybrid":
+                fetch = k * HYBRID_CANDIDATE_FACTOR if mode == "hybrid" else k
+                vector_hits = store.search(query_embedding, fetch, doc_id=doc_id)
+        lexical_hits = _lexical_hits(query_text, mode, k, doc_id)
+        hits = _retrieval_hits(mode, k, vector_hits, lexical_hits)
+        query, params = _similar_chunks_query(query_embedding, k, doc_id, hits)
+
+        with get_driver().session() as session:
+            result = session.run(query, **params)
             return [record.data() for record in result]
 
     except Exception as e:
@@ -40,41 +240,69 @@ def get_similar_chunks(query_text: str, k: int = 5) -> List[Dict]:
         return []
 
 
+async def aget_similar_chunks(
+    query_text: str, k: int = 5, doc_id: Optional[str] = None, mode: Optional[str] = None
+) -> List[Dict]:
+    """
+    Async variant of get_similar_chunks for the event loop: the query is
+    encoded by the embedding service's batcher, the graph is queried with the
+    async Neo4j driver, and in-process vector and lexical searches run in
+    worker threads.
 
-def generate_rag_response(query_text: str, retrieved_chunks: List[Dict]) -> str:
+    Args:
+        query_text (str): User query.
+        k (int): Number of top chunks to retrieve.
+        doc_id (Optional[str]): Restrict the search to one document.
+        mode (Optional[str]): "vector", "lexical" or "hybrid". Defaults to
+        RETRIEVAL_MODE.
+
+    Returns:
+        List[Dict]: Retrieved chunks with text, score, chunk_id and triples.
     """
-    Generate LLM response grounded on retrieved chunks and KG triples.
+    mode = _check_mode(mode)
+    try:
+        query_embedding = None
+        vector_hits = None
+        if mode != "lexical":
+            query_embedding = await get_embedding_service().aencode_query(query_text)
+            store = get_vector_store()
+            if not store.in_graph or mode == "hybrid":
+                fetch = k * HYBRID_CANDIDATE_FACTOR if mode == "hybrid" else k
+                vector_hits = await asyncio.to_thread(store.search, query_embedding, fetch, doc_id)
+        lexical_hits = await asyncio.to_thread(_lexical_hits, query_text, mode, k, doc_id)
+        hits = _retrieval_hits(mode, k, vector_hits, lexical_hits)
+        query, params = _similar_chunks_query(query_embedding, k, doc_id, hits)
+
+        async with get_async_driver().session() as session:
+            result = await session.run(query, **params)
+            return await result.data()
+
+    except Exception as e:
+        print(f"Error during vector search: {e}")
+        return []
+
+
+
+def build_rag_prompt(query_text: str, retrieved_chunks: List[Dict]) -> str:
+    """
+    Build the RAG prompt from retrieved chunks enriched with their KG triples.
 
     Args:
         query_text (str): User query.
         retrieved_chunks (List[Dict]): Chunks returned from vector search.
 
     Returns:
-        str: LLM response.
+        str: The prompt sent to the LLM.
     """
     enriched_context = []
 
-    with driver.session() as session:
-        for chunk in retrieved_chunks:
-            chunk_text = chunk["text"]
-            chunk_id = chunk["chunk_id"]
-
-            # Fetch triples linked to this chunk
-            result = session.run(
-                """
-                MATCH (sub)-[rel]->(obj)-[:MENTIONED_IN]->(c:Chunk {id: $chunk_id})
-                RETURN sub.name AS subject, type(rel) AS relation, obj.name AS object
-                """,
-                chunk_id=chunk_id
-            )
-            triples = [f"({r['subject']}, {r['relation']}, {r['object']})" for r in result]
-
-            context_block = f"Chunk Text:\n{chunk_text}\nTriples:\n" + ("\n".join(triples) if triples else "None")
-            enriched_context.append(context_block)
+    for chunk, triples in zip(retrieved_chunks, enrich_chunks(retrieved_chunks)):
+        context_block = f"Chunk Text:\n{chunk['text']}\nTriples:\n" + ("\n".join(triples) if triples else "None")
+        enriched_context.append(context_block)
 
     context_str = "\n\n".join(enriched_context)
 
-    prompt = f"""
+    return f"""
 You are a helpful assistant specialized in Terms of Service documents.
 
 Use ONLY the provided context and triples to answer the user's query.
@@ -88,46 +316,74 @@ If the answer is not in the context, say you cannot answer.
 
 **Answer:**
 """
+
+
+def generate_rag_response(query_text: str, retrieved_chunks: List[Dict]) -> str:
+    """
+    Generate LLM response grounded on retrieved chunks and KG triples.
+
+    Args:
+        query_text (str): User query.
+        retrieved_chunks (List[Dict]): Chunks returned from vector search.
+
+    Returns:
+        str: LLM response.
+    """
+    prompt = build_rag_prompt(query_text, retrieved_chunks)
     try:
-        response = llm.invoke(prompt)
+        response = get_llm().invoke(prompt)
         return getattr(response, "content", str(response))
     except Exception as e:
         print(f"Error invoking LLM: {e}")
         return "An error occurred while generating a response"
 
 
-def generate_initial_analysis(retrieved_chunks: List[Dict]) -> str:
+async def agenerate_rag_response(query_text: str, retrieved_chunks: List[Dict]) -> str:
     """
-    Generate JSON-formatted analysis of risky clauses using KG and chunk context.
+    Async variant of generate_rag_response, using the async Ollama client.
 
     Args:
-        retrieved_chunks (List[Dict]): Chunks to analyze.
+        query_text (str): User query.
+        retrieved_chunks (List[Dict]): Chunks returned from vector search.
 
     Returns:
-        str: JSON string with structured analysis.
+        str: LLM response.
     """
-    enriched_text = []
+    if all("triples" in chunk for chunk in retrieved_chunks):
+        prompt = build_rag_prompt(query_text, retrieved_chunks)
+    else:
+        # Missing triples are looked up with the blocking driver
+        prompt = await asyncio.to_thread(build_rag_prompt, query_text, retrieved_chunks)
+    try:
+        response = await get_llm().ainvoke(prompt)
+        return getattr(response, "content", str(response))
+    except Exception as e:
+        print(f"Error invoking LLM: {e}")
+        return "An error occurred while generating a response"
+
+
+def stream_rag_response(query_text: str, retrieved_chunks: List[Dict]) -> Iterator[str]:
+    """
+    Streaming variant of generate_rag_response, yielding tokens as the LLM
+    produces them.
+
+    Args:
+        query_text (str): User query.
+        retrieved_chunks (List[Dict]): Chunks returned from vector search.
 
-    with driver.session() as session:
-        for chunk in retrieved_chunks:
-            chunk_text = chunk["text"]
-            chunk_id = chunk["chunk_id"]
-
-            result = session.run(
-                """
-                MATCH (sub)-[rel]->(obj)-[:MENTIONED_IN]->(c:Chunk {id: $chunk_id})
-                RETURN sub.name AS subject, type(rel) AS relation, obj.name AS object
-                """,
-                chunk_id=chunk_id
-            )
-            triples = [f"({r['subject']}, {r['relation']}, {r['object']})" for r in result]
-            enriched_text.append(
-                chunk_text + "\nTriples:\n" + ("\n".join(triples) if triples else "None")
-            )
-
-    document_text = "\n\n".join(enriched_text)
-
-    prompt = f"""
+    Yields:
+        str: Pieces of the LLM response.
+    """
+    prompt = build_rag_prompt(query_text, retrieved_chunks)
+    try:
+        yield from get_llm().stream(prompt)
+    except Exception as e:
+        print(f"Error invoking LLM: {e}")
+        yield "An error occurred while generating a response"
+
+
+# Filled in with str.replace, the JSON examples contain literal braces
+ANALYSIS_PROMPT = '''
 You are a legal analyst specializing in consumer protection law.
 Your task is to review a Terms of Service (ToS) document and identify clauses that are potentially unfair, disadvantageous, or risky for the user.
 
@@ -216,34 +472,118 @@ Output:
 
 Document to Analyze
 
-Now analyze the following Terms of Service text:    
+Now analyze the following Terms of Service text:
+
+"""{document_text}"""
+'''
 
-/"/"/"<insert document text here>/"/"/"
-"""
-    try:
-        response = llm.invoke(prompt)
-        raw = getattr(response, "content", str(response)).strip()
 
-        if not raw:
-            raise ValueError("LLM returned empty response")
+def _normalize_clause(text: str) -> str:
+    return re.sub(r"\W+", " ", text).strip().lower()
 
-        # Try to find all {...} blocks anywhere in the response
-        objects = re.findall(r"\{.*?\}", raw, flags=re.DOTALL)
 
-        if not objects:
-            # No valid JSON objects found
-            return json.dumps({"error": "No clauses found"})
+def _analyze_window(document_text: str) -> List[Dict]:
+    """
+    Run the clause analysis prompt over one window of the document.
+
+    Returns:
+        List[Dict]: The clause objects found in the LLM output.
+    """
+    raw = llm_text(ANALYSIS_PROMPT.replace("{document_text}", document_text)).strip()
 
-        # Join all objects into one JSON array
-        json_array = "[" + ",".join(objects) + "]"
+    if not raw:
+        raise ValueError("LLM returned empty response")
 
-        parsed = json.loads(json_array)
+    # Try to find all {...} blocks anywhere in the response
+    clauses = []
+    for obj in re.findall(r"\{.*?\}", raw, flags=re.DOTALL):
+        try:
+            parsed = json.loads(obj)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(parsed, dict) and parsed.get("clause_text"):
+            clauses.append(parsed)
+    return clauses
 
-        if isinstance(parsed, dict):
-            parsed = [parsed]
 
-        return json.dumps(parsed, ensure_ascii=False, indent=2)
+def pack_analysis_windows(blocks: List[str], token_budget: int = ANALYSIS_WINDOW_TOKENS) -> List[str]:
+    """
+    Group consecutive text blocks into windows of at most `token_budget`
+    approximate tokens. A block larger than the budget gets a window of its own.
 
-    except Exception as e:
-        print(f"Error invoking LLM for initial analysis: {e}")
+    Args:
+        blocks (List[str]): Enriched chunk texts, in document order.
+        token_budget (int): Approximate tokens of document text per window.
+
+    Returns:
+        List[str]: The text of each window.
+    """
+    windows: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+
+    for block in blocks:
+        tokens = estimate_tokens(block)
+        if current and current_tokens + tokens > token_budget:
+            windows.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(block)
+        current_tokens += tokens
+
+    if current:
+        windows.append("\n\n".join(current))
+    return windows
+
+
+def generate_initial_analysis(retrieved_chunks: List[Dict], workers: int = ANALYSIS_WORKERS) -> str:
+    """
+    Generate JSON-formatted analysis of risky clauses using KG and chunk context.
+
+    The document is analyzed map-reduce style: chunks are grouped into
+    token-budgeted windows that are analyzed in parallel, then the clauses of
+    every window are merged and deduplicated in document order.
+
+    Args:
+        retrieved_chunks (List[Dict]): Chunks to analyze.
+        workers (int): Number of windows analyzed concurrently.
+
+    Returns:
+        str: JSON string with structured analysis.
+    """
+    enriched_text = []
+
+    for chunk, triples in zip(retrieved_chunks, enrich_chunks(retrieved_chunks)):
+        enriched_text.append(
+            chunk["text"] + "\nTriples:\n" + ("\n".join(triples) if triples else "None")
+        )
+
+    windows = pack_analysis_windows(enriched_text)
+    if not windows:
+        return json.dumps({"error": "No clauses found"})
+
+    results: List[Optional[List[Dict]]] = [None] * len(windows)
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="analysis") as pool:
+        futures = {pool.submit(_analyze_window, window): i for i, window in enumerate(windows)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                print(f"Error invoking LLM for initial analysis of window {i + 1}/{len(windows)}: {e}")
+
+    if all(result is None for result in results):
         return json.dumps({"error": "Failed to generate analysis"})
+
+    # Merge windows in document order, dropping clauses reported twice
+    merged, seen = [], set()
+    for result in results:
+        for clause in result or []:
+            key = _normalize_clause(str(clause["clause_text"]))
+            if key not in seen:
+                seen.add(key)
+                merged.append(clause)
+
+    if not merged:
+        return json.dumps({"error": "No clauses found"})
+
+    return json.dumps(merged, ensure_ascii=False, indent=2)
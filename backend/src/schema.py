@@ -0,0 +1,66 @@
+"""
+Neo4j schema bootstrap.
+
+Creates the constraints and indexes the ingestion and retrieval queries rely
+on. Every statement is idempotent (IF NOT EXISTS), so ensure_schema() runs
+on every startup.
+"""
+
+import logging
+import os
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# Dimension of the chunk embeddings (Legal-BERT small)
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "512"))
+
+
+def schema_statements(embedding_dim: int = EMBEDDING_DIM) -> List[str]:
+    """
+    The schema statements, in the order they are applied.
+    """
+    return [
+        # MERGE on these keys becomes an index seek instead of a label scan
+        "CREATE CONSTRAINT chunk_id IF NOT EXISTS FOR (c:Chunk) REQUIRE c.id IS UNIQUE",
+        "CREATE CONSTRAINT document_id IF NOT EXISTS FOR (d:Document) REQUIRE d.id IS UNIQUE",
+        # Entities are scoped to their document
+        "CREATE CONSTRAINT entity_key IF NOT EXISTS FOR (e:Entity) REQUIRE (e.doc_id, e.name) IS UNIQUE",
+        # Per-document lookups and deletes
+        "CREATE INDEX chunk_doc_id IF NOT EXISTS FOR (c:Chunk) ON (c.doc_id)",
+        "CREATE INDEX entity_doc_id IF NOT EXISTS FOR (e:Entity) ON (e.doc_id)",
+        f"""
+        CREATE VECTOR INDEX chunk_embeddings IF NOT EXISTS
+        FOR (c:Chunk) ON (c.embedding)
+        OPTIONS {{indexConfig: {{
+            `vector.dimensions`: {int(embedding_dim)},
+            `vector.similarity_function`: 'cosine'
+        }}}}
+        """,
+    ]
+
+
+def ensure_schema(driver, embedding_dim: int = EMBEDDING_DIM) -> int:
+    """
+    Create the missing constraints and indexes.
+
+    A statement that fails (e.g. a uniqueness constraint over existing
+    duplicates) is logged and skipped, so the others are still applied.
+
+    Args:
+        driver: The Neo4j driver.
+        embedding_dim (int): Dimension of the chunk_embeddings vector index.
+
+    Returns:
+        int: Number of statements that failed.
+    """
+    failed = 0
+    with driver.session() as session:
+        for statement in schema_statements(embedding_dim):
+            try:
+                session.run(statement).consume()
+            except Exception as e:
+                failed += 1
+                logger.error(f"Schema statement failed: {' '.join(statement.split())}: {e}")
+    logger.info(f"Neo4j schema ready ({failed} statements failed)")
+    return failed
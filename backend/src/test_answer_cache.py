@@ -0,0 +1,148 @@
+"""
+Tests of the /query answer cache, against an in-memory stand-in for the
+Document versions stored in Neo4j.
+
+Run from backend/src with:
+
+    python -m pytest test_answer_cache.py
+"""
+
+import numpy as np
+import pytest
+
+from answer_cache import AnswerCache
+
+
+class _Result:
+    def __init__(self, record):
+        self._record = record
+
+    def single(self):
+        return self._record
+
+
+class _Session:
+    def __init__(self, graph: "_Graph"):
+        self.graph = graph
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query: str, doc_id=None):
+        self.graph.queries += 1
+        if doc_id is None:
+            versions = [f"{d}:{v}" for d, v in sorted(self.graph.versions.items())]
+            return _Result({"versions": versions})
+        if doc_id not in self.graph.versions:
+            return _Result(None)
+        return _Result({"version": self.graph.versions[doc_id]})
+
+
+class _Graph:
+    def __init__(self, **versions):
+        self.versions = dict(versions)
+        self.queries = 0
+
+    def session(self):
+        return _Session(self)
+
+
+@pytest.fixture
+def graph():
+    return _Graph(a="v1", b="v1")
+
+
+@pytest.fixture
+def cache(graph):
+    return AnswerCache(lambda: graph, max_entries=10)
+
+
+def _ask(cache: AnswerCache, query: str, doc_id=None, variant: str = "", answer=None):
+    cached, scope = cache.get(query, doc_id, variant)
+    if cached is None and answer is not None:
+        cache.put(query, scope, answer, variant)
+    return cached
+
+
+def test_answers_are_scoped_to_document_and_variant(cache):
+    _ask(cache, "Can they delete my account?", "a", "vector:10", {"response": "yes"})
+    # Normalized query text matches
+    assert _ask(cache, "  can they DELETE my account? ", "a", "vector:10") == {"response": "yes"}
+    assert _ask(cache, "Can they delete my account?", "b", "vector:10") is None
+    assert _ask(cache, "Can they delete my account?", "a", "hybrid:10") is None
+    assert _ask(cache, "Can they delete my account?", None, "vector:10") is None
+
+
+def test_new_document_version_makes_answers_unreachable(cache, graph):
+    _ask(cache, "q", "a", answer={"response": "old"})
+    graph.versions["a"] = "v2"
+    assert _ask(cache, "q", "a") is None
+
+
+def test_set_version_drops_the_document_and_corpus_answers(cache, graph):
+    _ask(cache, "q", "a", answer={"response": "a"})
+    _ask(cache, "q", "b", answer={"response": "b"})
+    _ask(cache, "q", None, answer={"response": "all"})
+    graph.versions["a"] = "v2"
+    cache.set_version("a", "v2")
+    assert cache.stats()["entries"] == 1
+    assert _ask(cache, "q", "b") == {"response": "b"}
+    assert _ask(cache, "q", None) is None
+
+
+def test_answer_for_an_older_version_is_not_stored(cache, graph):
+    cached, scope = cache.get("q", "a")
+    # The document is re-ingested while the answer is being generated
+    graph.versions["a"] = "v2"
+    cache.set_version("a", "v2")
+    assert not cache.put("q", scope, {"response": "stale"})
+    assert cache.stats()["stale_puts"] == 1
+    assert _ask(cache, "q", "a") is None
+
+
+def test_invalidate_forgets_a_deleted_document(cache, graph):
+    _ask(cache, "q", "a", answer={"response": "a"})
+    del graph.versions["a"]
+    cache.invalidate("a")
+    assert _ask(cache, "q", "a") is None
+
+
+def test_corpus_lookups_only_read_versions_on_a_miss(cache, graph):
+    _ask(cache, "q", None, answer={"response": "all"})
+    queries = graph.queries
+    for _ in range(5):
+        assert _ask(cache, "q", None) == {"response": "all"}
+    assert graph.queries == queries
+    # A miss reads the corpus version again and picks up outside changes
+    graph.versions["c"] = "v1"
+    assert _ask(cache, "other question", None) is None
+    assert graph.queries == queries + 1
+    assert _ask(cache, "q", None) is None
+
+
+def test_least_recently_used_answer_is_evicted(graph):
+    cache = AnswerCache(lambda: graph, max_entries=2)
+    _ask(cache, "first", "a", answer={"response": 1})
+    _ask(cache, "second", "a", answer={"response": 2})
+    assert _ask(cache, "first", "a") == {"response": 1}
+    _ask(cache, "third", "a", answer={"response": 3})
+    assert _ask(cache, "second", "a") is None
+    assert _ask(cache, "first", "a") == {"response": 1}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_similar_query_matches_above_threshold(graph):
+    vectors = {
+        "can they delete my account": np.array([1.0, 0.0]),
+        "may they remove my account": np.array([0.95, 0.31]),
+        "how is my data shared": np.array([0.0, 1.0]),
+    }
+    cache = AnswerCache(lambda: graph, similarity_threshold=0.9, encoder=lambda text: vectors[text])
+    _ask(cache, "Can they delete my account", "a", answer={"response": "yes"})
+    assert _ask(cache, "May they remove my account", "a") == {"response": "yes"}
+    assert _ask(cache, "How is my data shared", "a") is None
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["similar_hits"], stats["misses"]) == (0, 1, 2)
@@ -0,0 +1,111 @@
+"""
+Tests of the background job queue.
+
+Run from backend/src with:
+
+    python -m pytest test_jobs.py
+"""
+
+import threading
+import time
+
+import pytest
+
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobManager
+
+
+def _wait(manager: JobManager, job_id: str, statuses=(SUCCEEDED, FAILED), timeout: float = 5.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not reach {statuses}")
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = JobManager(str(tmp_path / "jobs.db"), workers=1)
+    yield manager
+    manager.shutdown()
+
+
+def test_job_reports_progress_timings_and_result(manager):
+    seen = []
+
+    def handler(params, progress):
+        progress("load", 0.0)
+        progress("extract", 0.5)
+        seen.append(manager.get(job_id)["percent"])
+        progress("extract", 1.0)
+        return {"doubled": params["n"] * 2}
+
+    manager.register("double", handler, {"load": 0.2, "extract": 0.8})
+    job_id = manager.submit("double", {"n": 21})
+    job = _wait(manager, job_id)
+
+    assert job["status"] == SUCCEEDED
+    assert job["stage"] == "done" and job["percent"] == 100.0
+    assert set(job["timings"]) == {"load", "extract"}
+    assert job["params"] == {"n": 21}
+    assert manager.result(job_id) == {"doubled": 42}
+    # The load stage plus half of the extract stage
+    assert seen == [60.0]
+
+
+def test_percent_never_moves_backwards(manager):
+    percents = []
+
+    def handler(params, progress):
+        progress("extract", 1.0)
+        progress("load", 0.0)
+        percents.append(manager.get(job_id)["percent"])
+
+    manager.register("interleaved", handler, {"load": 0.5, "extract": 0.5})
+    job_id = manager.submit("interleaved", {})
+    _wait(manager, job_id)
+    assert percents == [100.0]
+
+
+def test_failed_job_records_the_error(manager):
+    def handler(params, progress):
+        progress("load")
+        raise RuntimeError("file is corrupt")
+
+    manager.register("broken", handler)
+    job_id = manager.submit("broken", {})
+    job = _wait(manager, job_id)
+    assert job["status"] == FAILED
+    assert job["error"] == "file is corrupt"
+    assert manager.result(job_id) is None
+
+
+def test_unknown_kind_and_job(manager):
+    with pytest.raises(ValueError):
+        manager.submit("missing", {})
+    assert manager.get("no-such-job") is None
+
+
+def test_jobs_left_queued_are_resumed_by_the_next_manager(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    release = threading.Event()
+    first = JobManager(path, workers=1)
+    first.register("wait", lambda params, progress: release.wait(5))
+    running = first.submit("wait", {})
+    queued = first.submit("wait", {})
+    _wait(first, running, statuses=(RUNNING,))
+    # The queued job is cancelled but stays queued in the database
+    first.shutdown()
+    release.set()
+    _wait(first, running)
+    assert first.get(queued)["status"] == QUEUED
+
+    second = JobManager(path, workers=1)
+    second.register("wait", lambda params, progress: "resumed")
+    second.resume()
+    assert _wait(second, queued)["status"] == SUCCEEDED
+    assert second.result(queued) == "resumed"
+    # Finished jobs are not run again
+    assert second.result(running) is True
+    second.shutdown()
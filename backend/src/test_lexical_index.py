@@ -0,0 +1,108 @@
+"""
+Tests of the BM25 lexical index.
+
+Run from backend/src with:
+
+    python -m pytest test_lexical_index.py
+"""
+
+import math
+
+import pytest
+
+from lexical_index import LexicalIndex, tokenize
+
+CHUNKS = {
+    "arbitration": "Any dispute shall be resolved by binding arbitration on an individual basis.",
+    "waiver": "You waive any right to a class action and agree to individual arbitration.",
+    "cookies": "We use cookies to remember your preferences.",
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical"))
+    index.add(list(CHUNKS), list(CHUNKS.values()), doc_id="tos")
+    return index
+
+
+def _postings(index: LexicalIndex) -> int:
+    return index._db.execute("SELECT COUNT(*) FROM postings").fetchone()[0]
+
+
+def test_tokenize_drops_stopwords_and_adds_word_pairs():
+    assert tokenize("The class action waiver") == ["class", "action", "waiver", "class action", "action waiver"]
+
+
+def test_exact_phrase_ranks_first(index):
+    hits = index.search("class action waiver", 3)
+    assert hits[0][0] == "waiver"
+    assert [chunk_id for chunk_id, _ in index.search("binding arbitration", 3)][:2] == ["arbitration", "waiver"]
+    assert index.search("refund policy", 3) == []
+
+
+def test_score_is_okapi_bm25(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical"), k1=1.2, b=0.75)
+    index.add(["a", "b"], ["refund refund", "cookies tracking pixels"])
+    [(chunk_id, score)] = index.search("refund", 5)
+    # "refund" appears twice in a chunk of 2 words, average chunk length 2.5
+    idf = math.log(1.0 + (2 - 1 + 0.5) / (1 + 0.5))
+    norm = 1.2 * (1.0 - 0.75 + 0.75 * 2 / 2.5)
+    assert chunk_id == "a"
+    assert score == pytest.approx(idf * 2 * 2.2 / (2 + norm))
+
+
+def test_search_is_scoped_to_a_document(index):
+    index.add(["other"], ["Disputes go to binding arbitration in Delaware."], doc_id="privacy")
+    assert {chunk_id for chunk_id, _ in index.search("binding arbitration", 5)} == {"arbitration", "waiver", "other"}
+    assert [chunk_id for chunk_id, _ in index.search("binding arbitration", 5, doc_id="privacy")] == ["other"]
+
+
+def test_deleted_chunks_are_tombstoned_then_purged(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical"), purge_ratio=0.5)
+    index.add(list(CHUNKS), list(CHUNKS.values()), doc_id="tos")
+    postings = _postings(index)
+    index.delete(["cookies"])
+    assert index.size == 2
+    assert index.search("cookies", 3) == []
+    # Below the purge ratio the postings stay until more chunks are removed
+    assert _postings(index) == postings
+    index.delete(["waiver"])
+    assert index.chunk_ids() == {"arbitration"}
+    assert _postings(index) < postings
+    assert index._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0] == 1
+
+
+def test_reindexed_chunk_replaces_its_old_text(index):
+    index.add(["cookies"], ["We never use tracking pixels."], doc_id="tos")
+    assert index.size == 3
+    assert index.search("cookies preferences", 3) == []
+    assert index.search("tracking pixels", 3)[0][0] == "cookies"
+
+
+def test_delete_document(index):
+    index.add(["other"], ["Cookies are set by our partners."], doc_id="privacy")
+    index.delete_document("tos")
+    assert index.chunk_ids() == {"other"}
+
+
+def test_instances_sharing_a_file_see_each_other_writes(tmp_path):
+    path = str(tmp_path / "lexical")
+    server = LexicalIndex(path)
+    cli = LexicalIndex(path)
+    cli.add(list(CHUNKS), list(CHUNKS.values()), doc_id="tos")
+    assert server.size == 3
+    assert server.search("class action", 1)[0][0] == "waiver"
+    server.delete(["waiver"])
+    assert "waiver" not in cli.chunk_ids()
+    # Writes from both sides allocate distinct rows
+    server.add(["a"], ["refund within thirty days"])
+    cli.add(["b"], ["refund only as store credit"])
+    assert {chunk_id for chunk_id, _ in server.search("refund", 5)} == {"a", "b"}
+    assert LexicalIndex(path).chunk_ids() == {"arbitration", "cookies", "a", "b"}
+
+
+def test_clear(index):
+    index.clear()
+    assert index.size == 0
+    assert index.search("arbitration", 3) == []
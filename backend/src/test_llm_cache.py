@@ -0,0 +1,89 @@
+"""
+Tests of the persistent LLM response cache.
+
+Run from backend/src with:
+
+    python -m pytest test_llm_cache.py
+"""
+
+import pytest
+
+import llm_cache
+from llm_cache import LLMCache, make_key
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(llm_cache.time, "time", clock)
+    return clock
+
+
+def test_make_key_depends_on_model_prompt_and_params():
+    key = make_key("m", "prompt", {"temperature": 0})
+    assert key == make_key("m", "prompt", {"temperature": 0})
+    assert key != make_key("other", "prompt", {"temperature": 0})
+    assert key != make_key("m", "other prompt", {"temperature": 0})
+    assert key != make_key("m", "prompt", {"temperature": 1})
+    assert make_key("m", "prompt") == make_key("m", "prompt", {})
+
+
+def test_get_returns_what_put_stored_and_persists(tmp_path, clock):
+    path = str(tmp_path / "cache" / "llm.db")
+    cache = LLMCache(path)
+    assert cache.get("k") is None
+    cache.put("k", "response")
+    assert cache.get("k") == "response"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    assert LLMCache(path).get("k") == "response"
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, clock):
+    cache = LLMCache(str(tmp_path / "llm.db"), max_entries=2, ttl_seconds=0)
+    cache.put("a", "A")
+    clock.now += 1
+    cache.put("b", "B")
+    clock.now += 1
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a") == "A"
+    clock.now += 1
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    assert cache.stats()["entries"] == 2
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = LLMCache(str(tmp_path / "llm.db"), ttl_seconds=60)
+    cache.put("k", "response")
+    clock.now += 59
+    assert cache.get("k") == "response"
+    # Reads do not extend the lifetime of an entry
+    clock.now += 2
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_zero_ttl_disables_expiry(tmp_path, clock):
+    cache = LLMCache(str(tmp_path / "llm.db"), ttl_seconds=0)
+    cache.put("k", "response")
+    clock.now += 10 ** 9
+    assert cache.get("k") == "response"
+
+
+def test_clear_removes_every_entry(tmp_path, clock):
+    cache = LLMCache(str(tmp_path / "llm.db"))
+    cache.put("a", "A")
+    cache.put("b", "B")
+    cache.clear()
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,30 @@
+"""
+Tests of the rank fusion used by hybrid retrieval.
+
+Run from backend/src with:
+
+    python -m pytest test_retrieve.py
+"""
+
+import pytest
+
+from retrieve import fuse_rankings
+
+
+def test_chunks_found_by_both_rankings_come_first():
+    vector = [("a", 0.91), ("b", 0.90), ("c", 0.80)]
+    lexical = [("c", 14.2), ("d", 9.0), ("a", 3.1)]
+    fused = fuse_rankings([vector, lexical], 4, rrf_k=60)
+    assert [chunk_id for chunk_id, _ in fused] == ["a", "c", "b", "d"]
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 63)
+    assert fused[2][1] == pytest.approx(1 / 62)
+
+
+def test_scores_only_depend_on_ranks():
+    fused = fuse_rankings([[("a", 1000.0), ("b", 0.001)], [("b", 0.5), ("a", 0.4)]], 2, rrf_k=1)
+    assert fused[0][1] == pytest.approx(fused[1][1])
+
+
+def test_fusion_is_cut_to_k_and_accepts_empty_rankings():
+    assert fuse_rankings([[("a", 1.0), ("b", 0.5)], []], 1, rrf_k=60) == [("a", pytest.approx(1 / 61))]
+    assert fuse_rankings([[], []], 5) == []
@@ -0,0 +1,98 @@
+"""
+Tests of chunk assembly and chunk embedding in text_processor.
+
+Run from backend/src with:
+
+    python -m pytest test_text_processor.py
+"""
+
+import random
+from typing import List
+
+import numpy as np
+import pytest
+
+import text_processor as tp
+
+
+def reference_chunks(sentences: List[str], max_chunk_size: int, overlap: int) -> List[str]:
+    """
+    The original chunk_text_spacy packing loop, quadratic in the number of
+    sentences per chunk, kept as the oracle text_processor._assemble_chunks
+    is tested against (and timed against by bench.py chunking).
+    Packs sentences into chunks of at most `max_chunk_size` characters,
+    repeating the last `overlap` sentences of a chunk in the next one.
+    """
+    chunks = []
+    current_chunk_sents: List[str] = []
+    for sent in sentences:
+        temp = " ".join(current_chunk_sents + [sent])
+        if len(temp) <= max_chunk_size or not current_chunk_sents:
+            current_chunk_sents.append(sent)
+        else:
+            if current_chunk_sents:
+                chunks.append(" ".join(current_chunk_sents))
+            if overlap > 0:
+                current_chunk_sents = current_chunk_sents[-overlap:] + [sent]
+            else:
+                current_chunk_sents = [sent]
+    if current_chunk_sents:
+        chunks.append(" ".join(current_chunk_sents))
+    return chunks
+
+
+def _random_sentence(rng: random.Random) -> str:
+    kind = rng.random()
+    if kind < 0.05:
+        return ""
+    if kind < 0.10:
+        return "x" * rng.randint(400, 1200)
+    return " ".join("w" * rng.randint(1, 12) for _ in range(rng.randint(1, 30)))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_assemble_chunks_matches_reference(seed):
+    # Random sentence lists, including empty and oversized sentences and every overlap setting
+    rng = random.Random(seed)
+    for _ in range(100):
+        sentences = [_random_sentence(rng) for _ in range(rng.randint(0, 80))]
+        max_chunk_size = rng.choice([1, 10, 50, 200, 500, 1000])
+        overlap = rng.choice([-1, 0, 1, 2, 5])
+        expected = reference_chunks(sentences, max_chunk_size, overlap)
+        got = list(tp._assemble_chunks(sentences, max_chunk_size, overlap))
+        assert got == expected, f"max_chunk_size={max_chunk_size} overlap={overlap} sentences={sentences!r}"
+
+
+def test_assemble_chunks_accepts_a_generator():
+    sentences = [f"Sentence number {i}." for i in range(200)]
+    assert list(tp._assemble_chunks(iter(sentences), 100, 2)) == reference_chunks(sentences, 100, 2)
+
+
+class _LengthModel:
+    """
+    Stand-in embedding model: the embedding of a text is its length, and
+    every forward pass is recorded.
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def get_sentence_embedding_dimension(self):
+        return 2
+
+    def encode(self, texts, batch_size, **kwargs):
+        self.batches.append(list(texts))
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_embed_chunks_batches_by_length_and_keeps_the_order(monkeypatch):
+    model = _LengthModel()
+    monkeypatch.setattr(tp, "get_embedding_model", lambda: model)
+    chunks = ["x" * n for n in (3, 10, 1, 7, 5)]
+    progress = []
+    out = tp.embed_chunks(chunks, batch_size=2, on_progress=lambda done, total: progress.append((done, total)))
+    assert out.dtype == np.float32
+    assert out[:, 0].tolist() == [3, 10, 1, 7, 5]
+    assert [[len(text) for text in batch] for batch in model.batches] == [[10, 7], [5, 3], [1]]
+    assert progress == [(2, 5), (4, 5), (5, 5)]
+    assert tp.embed_chunks([], batch_size=2).shape == (0, 2)
@@ -0,0 +1,188 @@
+"""
+Tests of the in-process vector store.
+
+Run from backend/src with:
+
+    python -m pytest test_vector_store.py
+"""
+
+import gc
+
+import numpy as np
+import pytest
+
+from vector_store import LocalVectorStore, decode_embedding, dequantize, encode_embedding, quantize
+
+DIM = 16
+
+
+def _embeddings(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(n, DIM)).astype(np.float32)
+
+
+def _brute_force(embeddings: np.ndarray, query: np.ndarray, k: int) -> list:
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    return list(np.argsort(-scores)[:k])
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalVectorStore(str(tmp_path / "vectors"))
+
+
+def test_search_matches_brute_force_cosine(store):
+    embeddings = _embeddings(200)
+    ids = [f"c{i}" for i in range(200)]
+    store.add(ids, embeddings, doc_id="tos")
+    query = _embeddings(1, seed=1)[0]
+    hits = store.search(query, 5)
+    assert [chunk_id for chunk_id, _ in hits] == [ids[i] for i in _brute_force(embeddings, query, 5)]
+    # Neo4j's cosine convention, (1 + cosine) / 2
+    best = embeddings[int(hits[0][0][1:])]
+    cosine = best @ query / np.linalg.norm(best) / np.linalg.norm(query)
+    assert hits[0][1] == pytest.approx((1 + cosine) / 2, abs=1e-5)
+
+
+def test_search_is_scoped_to_a_document(store):
+    store.add(["a1", "a2"], _embeddings(2, seed=1), doc_id="a")
+    store.add(["b1", "b2", "b3"], _embeddings(3, seed=2), doc_id="b")
+    query = _embeddings(1, seed=3)[0]
+    assert {chunk_id for chunk_id, _ in store.search(query, 10, doc_id="b")} == {"b1", "b2", "b3"}
+    assert store.search(query, 10, doc_id="missing") == []
+    assert len(store.search(query, 10)) == 5
+
+
+def test_deleted_and_replaced_chunks(store):
+    embeddings = _embeddings(3)
+    store.add(["a", "b", "c"], embeddings, doc_id="tos")
+    store.delete(["a"])
+    assert "a" not in [chunk_id for chunk_id, _ in store.search(embeddings[0], 3)]
+    # A re-added chunk is found with its new embedding only
+    store.add(["b"], embeddings[2:3], doc_id="tos")
+    assert store.size == 2
+    assert store.search(embeddings[2], 2)[0][1] == pytest.approx(1.0, abs=1e-5)
+    store.delete_document("tos")
+    assert store.size == 0
+    assert store.search(embeddings[0], 3) == []
+
+
+def _compacted_search(path: str, embeddings: np.ndarray, query: np.ndarray) -> list:
+    store = LocalVectorStore(path, compact_ratio=0.25)
+    ids = [f"c{i}" for i in range(len(embeddings))]
+    store.add(ids, embeddings, doc_id="tos")
+    store.delete(ids[:20])
+    # 20% tombstoned: below the ratio, rows are kept
+    assert len(store._chunk_ids) == 100
+    store.delete(ids[20:30])
+    assert len(store._chunk_ids) == 70
+    assert store._row_of == {chunk_id: row for row, chunk_id in enumerate(ids[30:])}
+    # The store, and its writer lock, are released on return
+    return store.search(query, 5)
+
+
+def test_tombstones_are_compacted_and_the_store_persists(tmp_path):
+    path = str(tmp_path / "vectors")
+    embeddings = _embeddings(100)
+    expected = _compacted_search(path, embeddings, embeddings[50])
+    gc.collect()
+    reopened = LocalVectorStore(path)
+    assert reopened.size == 70
+    assert reopened.search(embeddings[50], 5) == expected
+
+
+def test_clear_empties_the_files(store):
+    store.add(["a", "b"], _embeddings(2))
+    store.clear()
+    assert store.size == 0
+    assert store._chunk_ids == []
+    assert store.search(_embeddings(1)[0], 3) == []
+
+
+def test_a_second_writer_is_refused(tmp_path):
+    path = str(tmp_path / "vectors")
+    store = LocalVectorStore(path)
+    with pytest.raises(RuntimeError):
+        LocalVectorStore(path)
+    # The lock is released with the store
+    del store
+    gc.collect()
+    assert LocalVectorStore(path).size == 0
+
+
+def test_dimension_is_fixed_by_the_first_add(store):
+    store.add(["a"], _embeddings(1))
+    with pytest.raises(ValueError):
+        store.add(["b"], np.ones((1, DIM + 1), dtype=np.float32))
+
+
+def test_hnsw_search_finds_the_nearest_vectors(tmp_path):
+    pytest.importorskip("hnswlib")
+    store = LocalVectorStore(str(tmp_path / "vectors"), hnsw_threshold=100)
+    embeddings = _embeddings(500)
+    store.add([f"c{i}" for i in range(500)], embeddings)
+    for seed in range(5):
+        query = _embeddings(1, seed=seed + 10)[0]
+        assert store.search(query, 1)[0][0] == f"c{_brute_force(embeddings, query, 1)[0]}"
+
+
+@pytest.mark.parametrize("precision, tolerance", [("float32", 0.0), ("float16", 1e-3), ("int8", 1e-2)])
+def test_quantize_round_trip(precision, tolerance):
+    embeddings = _embeddings(10)
+    codes, scales = quantize(embeddings, precision)
+    assert np.abs(dequantize(codes, scales) - embeddings).max() <= tolerance * np.abs(embeddings).max()
+    data, scale = encode_embedding(embeddings[0], precision)
+    assert np.allclose(decode_embedding(data, precision, scale), dequantize(codes, scales)[0])
+
+
+def test_unknown_precision_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        quantize(_embeddings(1), "int4")
+    with pytest.raises(ValueError):
+        LocalVectorStore(str(tmp_path / "vectors"), precision="int4")
+
+
+@pytest.mark.parametrize("precision, bytes_per_vector", [("float32", 4 * DIM), ("float16", 2 * DIM), ("int8", DIM + 4)])
+def test_compact_precisions_keep_the_ranking(tmp_path, precision, bytes_per_vector):
+    store = LocalVectorStore(str(tmp_path / "vectors"), precision=precision)
+    embeddings = _embeddings(300)
+    store.add([f"c{i}" for i in range(300)], embeddings)
+    assert store.bytes_per_vector() == bytes_per_vector
+    for seed in range(5):
+        query = _embeddings(1, seed=seed + 10)[0]
+        found = {chunk_id for chunk_id, _ in store.search(query, 10)}
+        expected = {f"c{i}" for i in _brute_force(embeddings, query, 10)}
+        assert len(found & expected) >= 8
+
+
+def test_rescore_returns_exact_scores(tmp_path):
+    embeddings = _embeddings(300)
+    ids = [f"c{i}" for i in range(300)]
+    exact = LocalVectorStore(str(tmp_path / "exact"))
+    rescored = LocalVectorStore(str(tmp_path / "int8"), precision="int8", rescore=True, rescore_factor=4)
+    exact.add(ids, embeddings)
+    rescored.add(ids, embeddings)
+    for seed in range(5):
+        query = _embeddings(1, seed=seed + 10)[0]
+        expected = exact.search(query, 5)
+        got = rescored.search(query, 5)
+        assert [chunk_id for chunk_id, _ in got] == [chunk_id for chunk_id, _ in expected]
+        assert [score for _, score in got] == pytest.approx([score for _, score in expected], abs=1e-6)
+
+
+def test_rescore_is_ignored_for_float32(tmp_path):
+    assert not LocalVectorStore(str(tmp_path / "vectors"), rescore=True).rescore
+
+
+def _filled(path: str, precision: str):
+    LocalVectorStore(path, precision=precision).add(["a", "b"], _embeddings(2))
+
+
+def test_store_written_at_another_precision_is_reset(tmp_path):
+    path = str(tmp_path / "vectors")
+    _filled(path, "float32")
+    gc.collect()
+    assert LocalVectorStore(path, precision="float32").size == 2
+    gc.collect()
+    # Refilled from Neo4j by the caller
+    assert LocalVectorStore(path, precision="int8").size == 0
@@ -6,13 +6,47 @@ like embedding generation, and chunking.
 """
 
 from oopsies import PDFExtractionError, HTMLExtractionError, IngestionError
-from langchain_setup import embedding_model,nlp
+from langchain_setup import (
+    EMBEDDING_BATCH_SIZE,
+    SEGMENTATION_BATCH_SIZE,
+    SEGMENTATION_PROCESSES,
+    get_embedding_model,
+    get_nlp,
+    get_segmenter,
+)
 import os
 import re
 from PyPDF2 import PdfReader
 from bs4 import BeautifulSoup
-from typing import List
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
 import uuid
+import numpy as np
+
+def split_sentences(
+    texts: Iterable[str], batch_size: Optional[int] = None, n_process: Optional[int] = None
+) -> Iterator[List[str]]:
+    """
+    Split texts into sentences with the segmentation pipeline, running
+    nlp.pipe over them in batches (and optionally across processes).
+
+    Args:
+        texts (Iterable[str]): The texts to split.
+        batch_size (int): Texts per nlp.pipe batch. Defaults to SEGMENTATION_BATCH_SIZE.
+        n_process (int): Worker processes. Defaults to SEGMENTATION_PROCESSES.
+
+    Yields:
+        List[str]: The sentences of each text with their trailing whitespace,
+        in input order.
+    """
+    nlp, disable = get_segmenter()
+    docs = nlp.pipe(
+        texts,
+        batch_size=batch_size or SEGMENTATION_BATCH_SIZE,
+        n_process=n_process or SEGMENTATION_PROCESSES,
+        disable=disable,
+    )
+    for doc in docs:
+        yield [sent.text_with_ws for sent in doc.sents]
 
 def segment_clauses(text: str) -> List[str]:
     """
@@ -25,11 +59,10 @@ def segment_clauses(text: str) -> List[str]:
         List[str]: A list of strings, where each string is a self contained
                    clause in English language.
     """
-    doc = nlp(text)
     clauses = []
 
-    for sent in doc.sents:
-        cleaned = sent.text.strip()
+    for sent in next(split_sentences([text], n_process=1)):
+        cleaned = sent.strip()
         split_parts = re.split(
             r'(?<=\.)\s*(?=\d+\.)|(?<=\))\s*(?=\w)', cleaned)
         for part in split_parts:
@@ -73,6 +106,34 @@ def load_text(path: str) -> str:
         raise IngestionError("Unsupported file type. Only use pdf, html, and txt")
 
 
+def iter_pdf_pages(path: str) -> Iterator[str]:
+    """
+    Lazily extracts the text of the PDF referenced by the provided path,
+    one page at a time.
+
+    Args:
+        path (str): The filepath of the PDF whose text is to be extracted.
+
+    Raises:
+        PDFExtractionError: When the PDF cannot be read.
+
+    Yields:
+        str: The text of each page, in order.
+    """
+    try:
+        reader = PdfReader(path)
+        n = len(reader.pages)
+    except Exception as e:
+        raise PDFExtractionError(str(e)) from e
+
+    for i in range(n):
+        try:
+            page_text = reader.pages[i].extract_text()
+        except Exception as e:
+            raise PDFExtractionError(str(e)) from e
+        yield page_text
+
+
 def extract_pdf_text(path: str) -> str:
     """
     Extracts the text in the PDF referenced by the provided path.
@@ -81,23 +142,39 @@ def extract_pdf_text(path: str) -> str:
         path (str): The filepath of the PDF whose text is to be extracted.
 
     Raises:
-        Exception: When the PDF cannot be read.
+        PDFExtractionError: When the PDF cannot be read.
 
     Returns:
         str: The extracted text from the PDF whose filepath is provided in
         a single string.
     """
-    try:
-        reader = PdfReader(path)
-        text = ""
-        n = len(reader.pages)
-        for i in range(n):
-            text = text + "\n" + reader.pages[i].extract_text()
+    return "".join("\n" + page for page in iter_pdf_pages(path))
 
-    except Exception as e:
-        raise PDFExtractionError(str(e)) from e
 
-    return text
+def iter_text(path: str) -> Iterator[str]:
+    """
+    Streaming counterpart of load_text: yields the text of the file in
+    pieces, page by page for PDFs and as a single piece for txt and html.
+
+    Args:
+        path (str): The filepath of the file to be read.
+
+    Raises:
+        IngestionError: When the file type is not supported.
+
+    Yields:
+        str: Consecutive pieces of the file's text.
+    """
+    path = os.path.expanduser(path)
+    _, ext = os.path.splitext(path)
+    ext = ext.lower().lstrip(".")
+    if ext == "pdf":
+        for page in iter_pdf_pages(path):
+            yield "\n" + page
+    elif ext in ("txt", "html"):
+        yield load_text(path)
+    else:
+        raise IngestionError("Unsupported file type. Only use pdf, html, and txt")
 
 def extract_html_text(path: str) -> str:
     """
@@ -120,7 +197,80 @@ def extract_html_text(path: str) -> str:
 
     text = soup.get_text(separator="\n")
     return text
-def chunk_text_spacy(text, max_chunk_size=500, overlap=1):
+def _assemble_chunks(
+    sentences: Iterable[str],
+    max_chunk_size: int,
+    overlap: int,
+    length: Callable[[str], int] = len,
+    separator_length: int = 1,
+) -> Iterator[str]:
+    """
+    Greedily pack consecutive sentences into chunks of at most
+    `max_chunk_size`, repeating the last `overlap` sentences of a chunk at
+    the start of the next one. A sentence is always added to an empty chunk,
+    and the carried-over sentences plus the next one may exceed the limit.
+
+    The size of the chunk being built is tracked with running counters, so
+    each sentence is measured once instead of re-joining the chunk.
+
+    Args:
+        sentences (Iterable[str]): Sentences in document order.
+        max_chunk_size (int): Max chunk size, in the unit of `length`.
+        overlap (int): Number of overlapping sentences between chunks.
+        length (Callable[[str], int]): Size of a sentence. Defaults to characters.
+        separator_length (int): Size of the space joining two sentences.
+    """
+    current_chunk_sents: List[str] = []
+    current_lengths: List[int] = []
+    # Sum of the sentence sizes, excluding separators
+    current_size = 0
+
+    for sent in sentences:
+        size = length(sent)
+        joined = current_size + len(current_chunk_sents) * separator_length + size
+        if joined <= max_chunk_size or not current_chunk_sents:
+            current_chunk_sents.append(sent)
+            current_lengths.append(size)
+            current_size += size
+            continue
+
+        yield " ".join(current_chunk_sents)
+        # handle overlap
+        if overlap > 0:
+            current_chunk_sents = current_chunk_sents[-overlap:]
+            current_lengths = current_lengths[-overlap:]
+        else:
+            current_chunk_sents, current_lengths = [], []
+        current_chunk_sents.append(sent)
+        current_lengths.append(size)
+        current_size = sum(current_lengths)
+
+    if current_chunk_sents:
+        yield " ".join(current_chunk_sents)
+
+
+def token_length() -> Callable[[str], int]:
+    """
+    Sentence size in tokens of the embedding model's tokenizer, without
+    special tokens.
+    """
+    tokenizer = get_embedding_model().tokenizer
+
+    def length(text: str) -> int:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+    return length
+
+
+def _chunk_budget(max_chunk_size: int, max_tokens: Optional[int]) -> Dict:
+    # Keyword arguments of _assemble_chunks for character or token budgets.
+    # WordPiece splits on whitespace first, so joining sentences adds no tokens.
+    if max_tokens:
+        return {"max_chunk_size": max_tokens, "length": token_length(), "separator_length": 0}
+    return {"max_chunk_size": max_chunk_size}
+
+
+def chunk_text_spacy(text, max_chunk_size=500, overlap=1, max_tokens=None):
     """
     Break text into sentence-based chunks using spaCy, each with a unique ID.
 
@@ -128,46 +278,122 @@ def chunk_text_spacy(text, max_chunk_size=500, overlap=1):
         text (str): Text to chunk.
         max_chunk_size (int): Max characters per chunk. Defaults to 500.
         overlap (int): Number of overlapping sentences between chunks. Defaults to 1. -1 for no overlap.
+        max_tokens (int): When set, chunks are limited to this many tokens of
+        the embedding model's tokenizer instead of `max_chunk_size` characters.
 
     Returns:
         list[dict]: List of dicts like {"id": <uuid>, "chunk": <str>}.
     """
-    doc = nlp(text)
-    sentences = [sent.text.strip() for sent in doc.sents]
-
-    chunks = []
-    current_chunk_sents = []
+    sentences = [sent.strip() for sent in next(split_sentences([text], n_process=1))]
 
-    for sent in sentences:
-        temp = " ".join(current_chunk_sents + [sent])
-        if len(temp) <= max_chunk_size or not current_chunk_sents:
-            current_chunk_sents.append(sent)
-        else:
-            if current_chunk_sents:
-                chunks.append(" ".join(current_chunk_sents))
-            # handle overlap
-            if overlap > 0:
-                current_chunk_sents = current_chunk_sents[-overlap:] + [sent]
+    # wrap with UUIDs
+    return [
+        {"id": str(uuid.uuid4()), "chunk": chunk}
+        for chunk in _assemble_chunks(sentences, overlap=overlap, **_chunk_budget(max_chunk_size, max_tokens))
+    ]
+
+
+def _windows(pieces: Iterable[str], window_pages: int) -> Iterator[str]:
+    window: List[str] = []
+    for piece in pieces:
+        window.append(piece)
+        if len(window) >= window_pages:
+            yield "".join(window)
+            window = []
+    if window:
+        yield "".join(window)
+
+
+def _stream_sentences(
+    pieces: Iterable[str], window_pages: int, batch_size: Optional[int] = None, n_process: Optional[int] = None
+) -> Iterator[str]:
+    # Windows are segmented independently through nlp.pipe, so they are
+    # batched (and spread over processes when configured). A sentence can run
+    # across a window boundary, so the last sentence of every window is
+    # segmented again together with the first sentence of the next one.
+    nlp, disable = get_segmenter()
+    carry = ""
+    for sents in split_sentences(_windows(pieces, window_pages), batch_size, n_process):
+        if carry:
+            if sents:
+                sents = [sent.text_with_ws for sent in nlp(carry + sents[0], disable=disable).sents] + sents[1:]
             else:
-                current_chunk_sents = [sent]
+                sents = [carry]
+        carry = sents.pop() if sents else ""
+        for sent in sents:
+            sent = sent.strip()
+            if sent:
+                yield sent
+    if carry.strip():
+        yield carry.strip()
+
+
+def chunk_text_stream(
+    pieces: Iterable[str], max_chunk_size=500, overlap=1, window_pages=1, max_tokens=None, n_process=None
+) -> Iterator[dict]:
+    """
+    Incremental version of chunk_text_spacy over a stream of text pieces,
+    e.g. the pages yielded by iter_text. Chunks are yielded as soon as they
+    are complete. Windows of `window_pages` pieces are segmented with
+    nlp.pipe, SEGMENTATION_BATCH_SIZE windows at a time, so memory stays
+    bounded for large files.
 
-    if current_chunk_sents:
-        chunks.append(" ".join(current_chunk_sents))
+    Sentence boundaries are the same as chunk_text_spacy's, except that
+    spaCy may split differently right at a page break.
 
-    # wrap with UUIDs
-    return [{"id": str(uuid.uuid4()), "chunk": chunk} for chunk in chunks]
-def embed_chunks(chunks):
+    Args:
+        pieces (Iterable[str]): Consecutive pieces of the text.
+        max_chunk_size (int): Max characters per chunk. Defaults to 500.
+        overlap (int): Number of overlapping sentences between chunks. Defaults to 1. -1 for no overlap.
+        window_pages (int): Number of pieces parsed together. Defaults to 1.
+        max_tokens (int): Token budget per chunk instead of `max_chunk_size`
+        characters (see chunk_text_spacy).
+        n_process (int): Segmentation processes. Defaults to SEGMENTATION_PROCESSES.
+
+    Yields:
+        dict: Dicts like {"id": <uuid>, "chunk": <str>}.
+    """
+    sentences = _stream_sentences(pieces, max(1, window_pages), n_process=n_process)
+    for chunk in _assemble_chunks(sentences, overlap=overlap, **_chunk_budget(max_chunk_size, max_tokens)):
+        yield {"id": str(uuid.uuid4()), "chunk": chunk}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token) used for prompt budgeting.
+    """
+    return len(text) // 4 + 1
+
+def embed_chunks(chunks, batch_size=None, on_progress=None):
     """
     Generate embeddings for a list of text chunks using Legal-BERT Small.
 
+    Chunks are sorted by length and encoded in fixed-size batches, so each
+    batch pads to similar lengths; the embeddings are written into one
+    preallocated float32 array in the original order.
+
     Args:
         chunks (list[str]): List of text chunks.
+        batch_size (int): Chunks per forward pass. Defaults to EMBEDDING_BATCH_SIZE.
+        on_progress (Callable[[int, int], None]): Called with the number of
+        chunks embedded so far and the total, after every batch.
 
     Returns:
-        list[np.ndarray]: List of embeddings corresponding to each chunk.
+        np.ndarray: (len(chunks), dim) float32 array, one row per chunk.
     """
-    embeddings = embedding_model.encode(chunks, convert_to_numpy=True)
-    return embeddings
+    model = get_embedding_model()
+    batch_size = max(1, batch_size or EMBEDDING_BATCH_SIZE)
+    out = np.empty((len(chunks), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    order = sorted(range(len(chunks)), key=lambda i: len(chunks[i]), reverse=True)
+
+    for start in range(0, len(order), batch_size):
+        rows = order[start:start + batch_size]
+        out[rows] = model.encode(
+            [chunks[i] for i in rows], batch_size=len(rows), convert_to_numpy=True, show_progress_bar=False
+        )
+        if on_progress:
+            on_progress(start + len(rows), len(order))
+    return out
 
 def extract_entities(text: str):
     """
@@ -180,7 +406,7 @@ def extract_entities(text: str):
         List[dict]: A list of dictionaries, each with keys:
                     'text', 'label', 'start', 'end'
     """
-    doc = nlp(text)
+    doc = get_nlp()(text)
     entities = []
     for ent in doc.ents:
         entities.append({
@@ -0,0 +1,592 @@
+"""
+Vector store backends for chunk retrieval.
+
+Two implementations share the VectorStore interface:
+- Neo4jVectorStore: the `chunk_embeddings` vector index over Chunk nodes.
+- LocalVectorStore: an in-process index persisted to a memory-mapped file.
+  Small corpora are searched by NumPy brute force; above a size threshold an
+  HNSW graph (hnswlib, optional dependency) serves unscoped queries. Vectors
+  can be stored as float32, float16 or int8 (see quantize()).
+
+Scores follow Neo4j's cosine convention, (1 + cosine) / 2, so both backends
+rank and report results on the same scale.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # optional dependency
+    hnswlib = None
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class VectorStore(ABC):
+    """
+    Interface of the chunk embedding stores.
+    """
+
+    # True when vectors live on the Chunk nodes, so searches can be fused into graph queries
+    in_graph = False
+
+    @abstractmethod
+    def add(self, chunk_ids: Sequence[str], embeddings, doc_id: Optional[str] = None):
+        """
+        Add (or replace) the embeddings of chunks.
+        """
+
+    @abstractmethod
+    def delete(self, chunk_ids: Sequence[str]):
+        """
+        Remove chunks from the store.
+        """
+
+    @abstractmethod
+    def delete_document(self, doc_id: str):
+        """
+        Remove every chunk of a document from the store.
+        """
+
+    @abstractmethod
+    def search(self, query_embedding, k: int, doc_id: Optional[str] = None) -> List[Tuple[str, float]]:
+        """
+        Find the k chunks most similar to the query.
+
+        Returns:
+            List[Tuple[str, float]]: (chunk_id, score) pairs, best first.
+        """
+
+    def clear(self):
+        """
+        Remove everything from the store.
+        """
+
+
+class Neo4jVectorStore(VectorStore):
+    """
+    Vector search through the Neo4j `chunk_embeddings` index. Embeddings are
+    stored on the Chunk nodes by ingestion, so add and delete have nothing to do.
+    """
+
+    in_graph = True
+
+    def __init__(self, driver_getter, index_name: str = "chunk_embeddings"):
+        self._driver_getter = driver_getter
+        self.index_name = index_name
+
+    def add(self, chunk_ids, embeddings, doc_id=None):
+        pass
+
+    def delete(self, chunk_ids):
+        pass
+
+    def delete_document(self, doc_id):
+        pass
+
+    def search(self, query_embedding, k, doc_id=None):
+        embedding = np.asarray(query_embedding, dtype=np.float32).tolist()
+        with self._driver_getter().session() as session:
+            if doc_id is None:
+                result = session.run(
+                    """
+                    CALL db.index.vector.queryNodes($index, $k, $embedding)
+                    YIELD node, score
+                    RETURN node.id AS chunk_id, score
+                    """,
+                    index=self.index_name, k=k, embedding=embedding,
+                )
+            else:
+                result = session.run(
+                    """
+                    MATCH (:Document {id: $doc_id})-[:HAS_CHUNK]->(node:Chunk)
+                    WITH node, vector.similarity.cosine(node.embedding, $embedding) AS score
+                    ORDER BY score DESC
+                    LIMIT $k
+                    RETURN node.id AS chunk_id, score
+                    """,
+                    doc_id=doc_id, k=k, embedding=embedding,
+                )
+            return [(record["chunk_id"], record["score"]) for record in result]
+
+
+PRECISIONS = ("float32", "float16", "int8")
+
+
+def quantize(embeddings, precision: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Encode embeddings for storage.
+
+    float32 and float16 are plain casts; int8 is symmetric scalar quantization
+    with one float32 scale per vector (value ~= code * scale).
+
+    Args:
+        embeddings: (n, dim) array of embeddings.
+        precision (str): One of PRECISIONS.
+
+    Returns:
+        Tuple[np.ndarray, Optional[np.ndarray]]: The codes and, for int8, the scales.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if precision == "float32":
+        return embeddings, None
+    if precision == "float16":
+        return embeddings.astype(np.float16), None
+    if precision == "int8":
+        scales = np.abs(embeddings).max(axis=-1) / 127.0
+        scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+        codes = np.clip(np.rint(embeddings / scales[..., None]), -127, 127).astype(np.int8)
+        return codes, scales
+    raise ValueError(f"Unknown embedding precision: {precision}")
+
+
+def dequantize(codes, scales=None) -> np.ndarray:
+    """
+    Decode stored embeddings back to float32.
+    """
+    values = np.asarray(codes).astype(np.float32)
+    if scales is not None:
+        values = values * np.asarray(scales, dtype=np.float32)[..., None]
+    return values
+
+
+def _dtype_of(precision: str):
+    return {"float32": np.float32, "float16": np.float16, "int8": np.int8}[precision]
+
+
+def encode_embedding(embedding, precision: str) -> Tuple[bytes, Optional[float]]:
+    """
+    Encode one embedding as a compact byte string, e.g. for a node property.
+
+    Returns:
+        Tuple[bytes, Optional[float]]: The raw codes and, for int8, the scale.
+    """
+    codes, scales = quantize(np.asarray(embedding, dtype=np.float32)[None, :], precision)
+    return codes[0].tobytes(), (float(scales[0]) if scales is not None else None)
+
+
+def decode_embedding(data: bytes, precision: str, scale: Optional[float] = None) -> np.ndarray:
+    """
+    Decode an embedding written by encode_embedding().
+    """
+    codes = np.frombuffer(data, dtype=_dtype_of(precision))[None, :]
+    scales = np.array([scale], dtype=np.float32) if scale is not None else None
+    return dequantize(codes, scales)[0]
+
+
+class _MappedArray:
+    """
+    A (capacity, cols) memory-mapped array that grows by resizing its file.
+    """
+
+    def __init__(self, path: str, dtype, cols: int):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.cols = cols
+        self.capacity = 0
+        self.data: Optional[np.memmap] = None
+        if os.path.exists(path):
+            self.capacity = os.path.getsize(path) // (self.dtype.itemsize * cols)
+            if self.capacity:
+                self._open()
+
+    def _open(self):
+        self.data = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(self.capacity, self.cols))
+
+    def grow(self, capacity: int):
+        if capacity <= self.capacity:
+            return
+        if self.data is not None:
+            self.data.flush()
+            self.data = None
+        with open(self.path, "ab") as f:
+            f.truncate(capacity * self.cols * self.dtype.itemsize)
+        self.capacity = capacity
+        self._open()
+
+    def flush(self):
+        if self.data is not None:
+            self.data.flush()
+
+    def compact(self, rows: np.ndarray, capacity: int, block: int = 65536):
+        """
+        Rewrite the file with only `rows`, in order, and room for `capacity` rows.
+        """
+        capacity = max(capacity, len(rows), 1)
+        tmp = self.path + ".compact"
+        out = np.memmap(tmp, dtype=self.dtype, mode="w+", shape=(capacity, self.cols))
+        for start in range(0, len(rows), block):
+            chunk = rows[start:start + block]
+            out[start:start + len(chunk)] = self.data[chunk]  # type: ignore
+        out.flush()
+        del out
+        self.data = None
+        os.replace(tmp, self.path)
+        self.capacity = capacity
+        self._open()
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector index persisted under `path`.
+
+    Vectors are L2-normalized and stored as rows of a memory-mapped file that
+    grows by doubling, at the configured precision (float32, float16, or int8
+    with a per-vector scale). Row metadata (chunk ID, document, liveness) is
+    kept in SQLite. Deleted rows are tombstoned and skipped by searches; the
+    files are compacted (live rows rewritten contiguously) on clear() and
+    once tombstones exceed `compact_ratio` of the rows.
+
+    Row numbers are allocated in process, so a store directory has a single
+    writer: opening it takes an exclusive lock on `writer.lock`, and a second
+    process opening the same path fails instead of overwriting rows.
+
+    With `rescore`, a float32 copy of the vectors is kept in a separate
+    memory-mapped file that is only read for the top `rescore_factor * k`
+    candidates, whose scores are then recomputed exactly.
+
+    The HNSW graph is kept in memory only: it is built from the memory-mapped
+    vectors on the first search that needs it and updated incrementally afterwards.
+
+    Args:
+        path (str): Directory holding the index files.
+        hnsw_threshold (int): Number of live vectors above which unscoped
+        searches use HNSW instead of brute force (requires hnswlib).
+        precision (str): Storage precision of the searched vectors.
+        rescore (bool): Re-score the top candidates with float32 vectors.
+        rescore_factor (int): Candidates re-scored per requested result.
+        compact_ratio (float): Share of tombstoned rows above which the
+        files are compacted.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        hnsw_threshold: int = 50000,
+        precision: str = "float32",
+        rescore: bool = False,
+        rescore_factor: int = 4,
+        compact_ratio: float = 0.25,
+    ):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown embedding precision: {precision}")
+        self.path = path
+        self.hnsw_threshold = hnsw_threshold
+        self.precision = precision
+        self.rescore = rescore and precision != "float32"
+        self.rescore_factor = max(1, rescore_factor)
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._writer_lock = self._lock_writer(path)
+
+        self._db = sqlite3.connect(os.path.join(path, "meta.db"), check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rows (
+                row INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL,
+                doc_id TEXT,
+                alive INTEGER NOT NULL DEFAULT 1
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS rows_chunk ON rows (chunk_id)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.commit()
+
+        meta = dict(self._db.execute("SELECT key, value FROM meta").fetchall())
+        if meta.get("layout") not in (None, self._layout()):
+            # Written with another precision: start over, the store is refilled from Neo4j
+            logger.warning(f"Vector store layout changed to {self._layout()}, resetting {path}")
+            self._reset_files()
+            meta = {}
+        elif meta.get("compacting"):
+            # Interrupted compaction: files and rows may disagree
+            logger.warning(f"Vector store compaction was interrupted, resetting {path}")
+            self._reset_files()
+            meta = {}
+        self.dim: Optional[int] = int(meta["dim"]) if "dim" in meta else None
+        self._hnsw = None
+        self._warned_no_hnsw = False
+        self._vectors: Optional[_MappedArray] = None
+        self._scales: Optional[_MappedArray] = None
+        self._exact: Optional[_MappedArray] = None
+        if self.dim is not None:
+            self._open_arrays()
+
+        # In-memory view of the row metadata
+        self._chunk_ids: List[str] = []
+        self._row_docs: List[Optional[str]] = []
+        self._row_of: Dict[str, int] = {}
+        self._doc_rows: Dict[str, set] = {}
+        for row, chunk_id, doc_id, alive in self._db.execute(
+            "SELECT row, chunk_id, doc_id, alive FROM rows ORDER BY row"
+        ):
+            self._chunk_ids.append(chunk_id)
+            self._row_docs.append(doc_id)
+            if alive:
+                self._row_of[chunk_id] = row
+                self._doc_rows.setdefault(doc_id, set()).add(row)
+        self._alive = np.zeros(len(self._chunk_ids), dtype=bool)
+        self._alive[list(self._row_of.values())] = True
+
+    @staticmethod
+    def _lock_writer(path: str):
+        if fcntl is None:
+            logger.warning("fcntl is unavailable, the vector store is not protected against a second writer")
+            return None
+        lock_file = open(os.path.join(path, "writer.lock"), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError(
+                f"Vector store {path} is already open in another process; "
+                "run bulk ingestion through the API or stop the server first"
+            )
+        return lock_file
+
+    def _layout(self) -> str:
+        return f"{self.precision}{'+rescore' if self.rescore else ''}"
+
+    def _reset_files(self):
+        for name in os.listdir(self.path):
+            if name.startswith(("vectors.", "scales.f32", "exact.f32")):
+                os.remove(os.path.join(self.path, name))
+        self._db.execute("DELETE FROM rows")
+        self._db.execute("DELETE FROM meta")
+        self._db.commit()
+
+    def _open_arrays(self):
+        self._vectors = _MappedArray(
+            os.path.join(self.path, f"vectors.{self.precision}"), _dtype_of(self.precision), self.dim  # type: ignore
+        )
+        if self.precision == "int8":
+            self._scales = _MappedArray(os.path.join(self.path, "scales.f32"), np.float32, 1)
+        if self.rescore:
+            self._exact = _MappedArray(os.path.join(self.path, "exact.f32"), np.float32, self.dim)  # type: ignore
+
+    def _arrays(self) -> List[_MappedArray]:
+        return [a for a in (self._vectors, self._scales, self._exact) if a is not None]
+
+    @property
+    def size(self) -> int:
+        """
+        Number of live vectors.
+        """
+        return len(self._row_of)
+
+    def bytes_per_vector(self) -> int:
+        """
+        Bytes read per vector by a brute force search.
+        """
+        if self.dim is None:
+            return 0
+        return self.dim * np.dtype(_dtype_of(self.precision)).itemsize + (4 if self.precision == "int8" else 0)
+
+    def _ensure_capacity(self, rows: int):
+        capacity = self._vectors.capacity  # type: ignore
+        if rows <= capacity:
+            return
+        for array in self._arrays():
+            array.grow(max(rows, 2 * capacity, 1024))
+
+    def _decoded(self, rows) -> np.ndarray:
+        codes = self._vectors.data[rows]  # type: ignore
+        scales = self._scales.data[rows, 0] if self._scales is not None else None  # type: ignore
+        return dequantize(codes, scales)
+
+    def _tombstone(self, chunk_ids: Sequence[str]) -> List[int]:
+        rows = []
+        for chunk_id in chunk_ids:
+            row = self._row_of.pop(chunk_id, None)
+            if row is None:
+                continue
+            rows.append(row)
+            self._alive[row] = False
+            self._doc_rows.get(self._row_docs[row], set()).discard(row)
+            if self._hnsw is not None:
+                self._hnsw.mark_deleted(row)
+        if rows:
+            self._db.executemany("UPDATE rows SET alive = 0 WHERE row = ?", [(row,) for row in rows])
+        return rows
+
+    def add(self, chunk_ids, embeddings, doc_id=None):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(chunk_ids) == 0:
+            return
+        embeddings = embeddings.reshape(len(chunk_ids), -1)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms == 0, 1, norms)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    [("dim", str(self.dim)), ("layout", self._layout())],
+                )
+                self._open_arrays()
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {embeddings.shape[1]}")
+
+            # Re-added chunks get a fresh row
+            self._tombstone(chunk_ids)
+            start, end = len(self._chunk_ids), len(self._chunk_ids) + len(chunk_ids)
+            rows = list(range(start, end))
+            self._ensure_capacity(end)
+            codes, scales = quantize(embeddings, self.precision)
+            self._vectors.data[start:end] = codes  # type: ignore
+            if self._scales is not None:
+                self._scales.data[start:end, 0] = scales  # type: ignore
+            if self._exact is not None:
+                self._exact.data[start:end] = embeddings  # type: ignore
+            for array in self._arrays():
+                array.flush()
+
+            self._db.executemany(
+                "INSERT INTO rows (row, chunk_id, doc_id, alive) VALUES (?, ?, ?, 1)",
+                [(row, chunk_id, doc_id) for row, chunk_id in zip(rows, chunk_ids)],
+            )
+            self._db.commit()
+
+            self._chunk_ids.extend(chunk_ids)
+            self._row_docs.extend([doc_id] * len(chunk_ids))
+            self._alive = np.concatenate([self._alive, np.ones(len(chunk_ids), dtype=bool)])
+            for row, chunk_id in zip(rows, chunk_ids):
+                self._row_of[chunk_id] = row
+            self._doc_rows.setdefault(doc_id, set()).update(rows)
+
+            if self._hnsw is not None:
+                self._hnsw.resize_index(max(self._hnsw.get_max_elements(), self._vectors.capacity))  # type: ignore
+                self._hnsw.add_items(dequantize(codes, scales), rows)
+            # Re-added chunks left tombstones behind
+            self._maybe_compact()
+
+    def delete(self, chunk_ids):
+        with self._lock:
+            self._tombstone(chunk_ids)
+            self._db.commit()
+            self._maybe_compact()
+
+    def delete_document(self, doc_id):
+        with self._lock:
+            rows = list(self._doc_rows.pop(doc_id, set()))
+            self._tombstone([self._chunk_ids[row] for row in rows])
+            self._db.commit()
+            self._maybe_compact()
+
+    def clear(self):
+        with self._lock:
+            self._tombstone(list(self._row_of))
+            self._db.commit()
+            self._compact()
+
+    def _maybe_compact(self):
+        dead = len(self._chunk_ids) - self.size
+        if dead and dead > self.compact_ratio * len(self._chunk_ids):
+            self._compact()
+
+    def _compact(self):
+        """
+        Rewrite the live rows contiguously, dropping tombstoned ones.
+        """
+        live = np.flatnonzero(self._alive)
+        dead = len(self._chunk_ids) - len(live)
+        if dead == 0:
+            return
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('compacting', '1')")
+        self._db.commit()
+        for array in self._arrays():
+            array.compact(live, max(2 * len(live), 1024))
+        self._chunk_ids = [self._chunk_ids[row] for row in live]
+        self._row_docs = [self._row_docs[row] for row in live]
+        self._row_of = {chunk_id: row for row, chunk_id in enumerate(self._chunk_ids)}
+        self._doc_rows = {}
+        for row, doc_id in enumerate(self._row_docs):
+            self._doc_rows.setdefault(doc_id, set()).add(row)
+        self._alive = np.ones(len(live), dtype=bool)
+        self._hnsw = None
+        self._db.execute("DELETE FROM rows")
+        self._db.executemany(
+            "INSERT INTO rows (row, chunk_id, doc_id, alive) VALUES (?, ?, ?, 1)",
+            [(row, chunk_id, doc_id) for row, (chunk_id, doc_id) in enumerate(zip(self._chunk_ids, self._row_docs))],
+        )
+        self._db.execute("DELETE FROM meta WHERE key = 'compacting'")
+        self._db.commit()
+        self._db.execute("VACUUM")
+        logger.info(f"Compacted the vector store: {len(live)} rows kept, {dead} removed")
+
+    def _hnsw_available(self) -> bool:
+        if hnswlib is None and not self._warned_no_hnsw:
+            logger.warning(
+                f"The vector store holds {self.size} vectors (hnsw_threshold={self.hnsw_threshold}) "
+                "but hnswlib is not installed; searching by brute force"
+            )
+            self._warned_no_hnsw = True
+        return hnswlib is not None
+
+    def _get_hnsw(self):
+        if self._hnsw is None:
+            index = hnswlib.Index(space="ip", dim=self.dim)
+            index.init_index(max_elements=max(self._vectors.capacity, 1), ef_construction=200, M=16)  # type: ignore
+            live = np.flatnonzero(self._alive)
+            index.add_items(self._decoded(live), live)
+            index.set_ef(128)
+            self._hnsw = index
+            logger.info(f"Built HNSW index over {len(live)} vectors")
+        return self._hnsw
+
+    def _rescored(self, rows: np.ndarray, query: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        scores = self._exact.data[rows] @ query  # type: ignore
+        order = np.argsort(-scores)[:k]
+        return [(self._chunk_ids[rows[i]], float((1.0 + scores[i]) / 2.0)) for i in order]
+
+    def search(self, query_embedding, k, doc_id=None):
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        fetch = k * self.rescore_factor if self.rescore else k
+
+        with self._lock:
+            if self._vectors is None or not self._row_of:
+                return []
+            if doc_id is not None:
+                candidates = np.fromiter(self._doc_rows.get(doc_id, ()), dtype=np.int64)
+            elif self.size >= self.hnsw_threshold and self._hnsw_available():
+                labels, distances = self._get_hnsw().knn_query(query, k=min(fetch, self.size))
+                if self.rescore:
+                    return self._rescored(labels[0].astype(np.int64), query, k)
+                # Inner product space: distance = 1 - cosine
+                return [
+                    (self._chunk_ids[row], float((2.0 - distance) / 2.0))
+                    for row, distance in zip(labels[0], distances[0])
+                ]
+            else:
+                candidates = np.flatnonzero(self._alive)
+
+            if candidates.size == 0:
+                return []
+            scores = self._vectors.data[candidates].astype(np.float32) @ query  # type: ignore
+            if self._scales is not None:
+                scores *= self._scales.data[candidates, 0]  # type: ignore
+            top = min(fetch, candidates.size)
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            if self.rescore:
+                return self._rescored(candidates[best], query, k)
+            return [(self._chunk_ids[candidates[i]], float((1.0 + scores[i]) / 2.0)) for i in best]
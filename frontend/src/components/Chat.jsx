@@ -3,7 +3,7 @@ import { useResults } from './ResultsContext';
 
 function Chat() {
   const [inputMessage, setInputMessage] = useState('');
-  const { chatMessages, setChatMessages, isChatLoading, setIsChatLoading, setError, setShowChat } = useResults();
+  const { chatMessages, setChatMessages, isChatLoading, setIsChatLoading, setError, setShowChat, docId } = useResults();
 
   const handleSendMessage = async () => {
     if (!inputMessage.trim()) return;
@@ -19,38 +19,64 @@ function Chat() {
     setInputMessage('');
     setIsChatLoading(true);
 
+    const assistantId = Date.now() + 1;
+    const updateAssistant = (update) =>
+      setChatMessages(prev => prev.map(m => (m.id === assistantId ? { ...m, ...update(m) } : m)));
+
     try {
-      const response = await fetch('http://localhost:8000/query', {
+      const response = await fetch('http://localhost:8000/query/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': 'text/event-stream',
         },
-        body: JSON.stringify({ query: inputMessage.trim() }),
+        body: JSON.stringify({ query: inputMessage.trim(), doc_id: docId }),
       });
 
       if (!response.ok) {
         throw new Error(`HTTP error! Status: ${response.status}`);
       }
 
-      const data = await response.json();
-      
-      const assistantMessage = {
-        id: Date.now() + 1,
-        type: 'assistant',
-        content: data.response || 'No response received',
-        chunks: data.chunks || []
-      };
+      setChatMessages(prev => [...prev, { id: assistantId, type: 'assistant', content: '', chunks: [] }]);
+
+      // Server-sent events: chunks first, then tokens, then done
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let finished = false;
+      while (!finished) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const raw of events) {
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const dataLine = raw.match(/^data: (.*)$/m)?.[1];
+          const data = dataLine ? JSON.parse(dataLine) : null;
+          if (event === 'chunks') {
+            updateAssistant(() => ({ chunks: data || [] }));
+          } else if (event === 'token') {
+            setIsChatLoading(false);
+            updateAssistant(m => ({ content: m.content + data }));
+          } else if (event === 'error') {
+            throw new Error(data);
+          } else if (event === 'done') {
+            finished = true;
+          }
+        }
+      }
 
-      setChatMessages(prev => [...prev, assistantMessage]);
+      updateAssistant(m => ({ content: m.content || 'No response received' }));
     } catch (err) {
       setError(`Failed to get response: ${err.message}`);
       const errorMessage = {
-        id: Date.now() + 1,
+        id: assistantId,
         type: 'assistant',
         content: 'Sorry, I encountered an error while processing your question.',
         chunks: []
       };
-      setChatMessages(prev => [...prev, errorMessage]);
+      setChatMessages(prev => [...prev.filter(m => m.id !== assistantId), errorMessage]);
     } finally {
       setIsChatLoading(false);
     }
@@ -1,9 +1,12 @@
 import { useState } from 'react';
 import { useResults } from './ResultsContext';
 
+const POLL_INTERVAL_MS = 2000;
+
 function ToSInput() {
     const [file, setFile] = useState(null);
-    const { setResults, setIsLoading, isLoading, setError, setHasAnalysisResults } = useResults();
+    const [progress, setProgress] = useState(0);
+    const { setResults, setIsLoading, isLoading, setError, setHasAnalysisResults, setDocId } = useResults();
 
     const handleAnalyze = async () => {
         if (!file) {
@@ -12,6 +15,7 @@ function ToSInput() {
         }
         
         setIsLoading(true);
+        setProgress(0);
         setError(null);
         setHasAnalysisResults(false);
 
@@ -19,7 +23,7 @@ function ToSInput() {
             const formData = new FormData();
             formData.append('file', file);
 
-            const response = await fetch('http://localhost:8000/ingest', {
+            const response = await fetch('http://localhost:8000/ingest/jobs', {
                 method: 'POST',
                 body: formData,
             });
@@ -28,7 +32,31 @@ function ToSInput() {
                 throw new Error(`HTTP error! Status: ${response.status}`);
             }
             
-            const data = await response.json();
+            const { job_id, doc_id } = await response.json();
+
+            // Poll the job until the ingestion finishes
+            let job;
+            do {
+                await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+                const statusResponse = await fetch(`http://localhost:8000/ingest/jobs/${job_id}`);
+                if (!statusResponse.ok) {
+                    throw new Error(`HTTP error! Status: ${statusResponse.status}`);
+                }
+                job = await statusResponse.json();
+                setProgress(job.percent);
+            } while (job.status === 'queued' || job.status === 'running');
+
+            if (job.status === 'failed') {
+                throw new Error(job.error || 'Ingestion failed');
+            }
+
+            const resultResponse = await fetch(`http://localhost:8000/ingest/jobs/${job_id}/result`);
+            if (!resultResponse.ok) {
+                throw new Error(`HTTP error! Status: ${resultResponse.status}`);
+            }
+
+            const data = await resultResponse.json();
+            setDocId(doc_id);
             setResults(data || []);
             setHasAnalysisResults(true);
         } catch (err) {
@@ -107,7 +135,7 @@ function ToSInput() {
                     {isLoading ? (
                         <>
                             <div className="w-5 h-5 border-2 border-white/30 border-t-white rounded-full animate-spin"></div>
-                            <span>Analyzing...</span>
+                            <span>Analyzing... {Math.round(progress)}%</span>
                         </>
                     ) : (
                         <>